@@ -0,0 +1,91 @@
+"""
+Benchmark of the NumPy columnar parser against the pure-Python parser.
+
+For each record count a fixed width file is written to a temporary directory,
+then parsed into columns with and without NumPy, and converted to a delimited
+file through generate_delimited_file(). Defaults to 1M and 10M records; the
+10M file is roughly 1 GB with spec.json.
+
+Run from the repository root:
+$ python -m benchmarks.bench_columnar [record_count ...]
+"""
+
+import os
+import random
+import sys
+import tempfile
+import time
+
+from delimited_writer.columnar import ColumnarParser, np
+from delimited_writer.delimited_writer import DelimitedFileWriter
+from delimited_writer.encoding_properties import EncodingProperties
+
+# Distinct records tiled to build the benchmark file
+SAMPLE_SIZE = 4096
+
+
+def write_fixed_width_file(encoding_props, record_count):
+    """ Writes record_count records by tiling a random sample of records.
+    """
+    layout = encoding_props.layout
+    alphabet = "ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789éüß€"
+    sample = []
+    for _ in range(SAMPLE_SIZE):
+        fields = [
+            "".join(random.choices(alphabet, k=random.randint(1, offset))).ljust(offset)
+            for offset in layout.offsets
+        ]
+        sample.append("".join(fields).encode(layout.encoding) + b"\n")
+
+    block = b"".join(sample)
+    with open(encoding_props.fixed_width_filename, "wb") as f:
+        for _ in range(record_count // SAMPLE_SIZE):
+            f.write(block)
+        f.write(b"".join(sample[: record_count % SAMPLE_SIZE]))
+
+
+def timed(label, func, record_count):
+    start = time.perf_counter()
+    func()
+    seconds = time.perf_counter() - start
+    print(f"  {label:<44}{seconds:>8.2f} s{record_count / seconds:>14,.0f} records/s")
+
+
+def bench(record_count, directory):
+    encoding_props = EncodingProperties(
+        "spec.json",
+        os.path.join(directory, "fixed_width.txt"),
+        os.path.join(directory, "delimited.csv"),
+        delimited_newline="\n",
+    )
+    write_fixed_width_file(encoding_props, record_count)
+    size = os.path.getsize(encoding_props.fixed_width_filename)
+    print(f"{record_count:,} records, {size / 1e6:,.0f} MB")
+
+    delimited = DelimitedFileWriter(encoding_props)
+    python_parser = ColumnarParser(encoding_props, use_numpy=False)
+    timed("pure-Python parse_columns", python_parser.parse_columns, record_count)
+    if np is not None:
+        numpy_parser = ColumnarParser(encoding_props, use_numpy=True)
+        timed("NumPy parse_columns", numpy_parser.parse_columns, record_count)
+    else:
+        print("  NumPy is not installed, skipping the vectorised parser")
+
+    timed("convert (streaming)", delimited.convert, record_count)
+    if np is not None:
+        timed(
+            "NumPy iter_rows -> generate_delimited_file",
+            lambda: delimited.generate_delimited_file(numpy_parser.iter_rows()),
+            record_count,
+        )
+
+
+def main(record_counts):
+    random.seed(0)
+    with tempfile.TemporaryDirectory() as directory:
+        for record_count in record_counts:
+            bench(record_count, directory)
+
+
+if __name__ == "__main__":
+    main([int(arg) for arg in sys.argv[1:]] or [1_000_000, 10_000_000])
@@ -0,0 +1,75 @@
+"""
+Benchmark of field extraction strategies for a single fixed width record.
+
+Compares the original list comprehension, which sums the preceding offsets
+for every field, against the compiled RecordLayout slicing decoded text and
+unpacking raw bytes.
+
+Run from the repository root:
+$ python -m benchmarks.bench_record_layout
+"""
+
+import random
+import sys
+import timeit
+
+from delimited_writer.record_layout import RecordLayout
+
+ENCODING = "cp1252"
+
+
+def legacy_split(line, offsets):
+    """ The field extraction used by parse_fixed_width_file before RecordLayout.
+    """
+    if len(line) != sum(offsets):
+        raise ValueError("One or more fields are of incorrect length")
+    return [
+        line[sum(offsets[0:i]) : sum(offsets[0:i]) + offset].replace(" ", "")
+        for i, offset in enumerate(offsets)
+    ]
+
+
+def make_record(offsets):
+    """ Returns a record of random letters padded to each column's offset.
+    """
+    fields = [
+        "".join(random.choices("ABCDEFGHIJ", k=random.randint(1, offset))).ljust(
+            offset
+        )
+        for offset in offsets
+    ]
+    return "".join(fields)
+
+
+def bench(name, offsets, number):
+    layout = RecordLayout(offsets, ENCODING)
+    line = make_record(offsets)
+    record = line.encode(ENCODING)
+
+    # All strategies must agree before timing them
+    expected = legacy_split(line, offsets)
+    assert layout.split_line(line) == expected
+    assert layout.split_record(record) == expected
+
+    cases = [
+        ("legacy list comprehension", lambda: legacy_split(line, offsets)),
+        ("RecordLayout.split_line (str)", lambda: layout.split_line(line)),
+        ("RecordLayout.split_record (bytes)", lambda: layout.split_record(record)),
+    ]
+    print(f"{name}: {len(offsets)} columns, {layout.record_length} bytes/record")
+    baseline = None
+    for label, func in cases:
+        seconds = min(timeit.repeat(func, number=number, repeat=5))
+        rate = number / seconds
+        baseline = baseline or seconds
+        print(f"  {label:<36}{rate:>12,.0f} records/s  x{baseline / seconds:.1f}")
+
+
+def main(number=20000):
+    random.seed(0)
+    bench("spec.json", [5, 12, 3, 2, 13, 7, 10, 13, 20, 13], number)
+    bench("wide", [random.randint(1, 20) for _ in range(200)], number // 10)
+
+
+if __name__ == "__main__":
+    main(*map(int, sys.argv[1:]))
@@ -0,0 +1,311 @@
+"""
+Benchmark suite for the fixed width to delimited converter.
+
+Generates a synthetic fixed width file, then runs each benchmark case in its
+own fresh process so that peak RSS is measured per case:
+
+    pipeline          one pass timing the parse, encode (CSV formatting and
+                      UTF-8 encoding) and write stages separately
+    convert           DelimitedFileWriter.convert()
+    instrumented      convert() with an Instrumentation, reporting its stages
+    convert_parallel  DelimitedFileWriter.convert_parallel()
+    column_store      DelimitedFileWriter.convert_to_column_store()
+    columnar          ColumnarParser.parse_columns(), when NumPy is installed
+
+Results are printed and optionally saved as JSON. Passing an earlier results
+file with --baseline reports any case or stage whose throughput has dropped by
+more than --tolerance, and exits with status 1 if there is one.
+
+Run from the repository root, e.g.:
+$ python -m benchmarks.run_benchmarks --size 1GB --columns 50 --output new.json
+$ python -m benchmarks.run_benchmarks --size 1GB --baseline old.json
+"""
+
+import argparse
+import csv
+import io
+import json
+import multiprocessing
+import os
+import platform
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from benchmarks.synthetic import CHARSETS, FILLS, SyntheticFixedWidthFile, write_spec
+from delimited_writer.delimited_writer import DEFAULT_BATCH_SIZE, DelimitedFileWriter
+from delimited_writer.encoding_properties import EncodingProperties
+from delimited_writer.metrics import Instrumentation, peak_rss
+
+SIZE_UNITS = {"": 1, "KB": 1 << 10, "MB": 1 << 20, "GB": 1 << 30, "TB": 1 << 40}
+
+
+def parse_size(text):
+    """ Parses a size such as '500MB' or '20GB' into bytes.
+    """
+    text = text.strip().upper()
+    number = text.rstrip("KMGTB")
+    return int(float(number) * SIZE_UNITS[text[len(number) :]])
+
+
+def stage_result(seconds, records, size):
+    return {
+        "seconds": seconds,
+        "records_per_sec": records / seconds if seconds else None,
+        "bytes_per_sec": size / seconds if seconds else None,
+    }
+
+
+def bench_pipeline(encoding_props):
+    """ Converts the file in one pass, timing each stage of every batch.
+    """
+    layout = encoding_props.layout
+    timings = {"parse": 0.0, "encode": 0.0, "write": 0.0}
+    records = 0
+    output_size = 0
+    clock = time.perf_counter
+
+    with open(encoding_props.fixed_width_filename, "rb") as f, open(
+        encoding_props.delimited_filename, "wb"
+    ) as out:
+        record_iter = layout.iter_records(f)
+        while True:
+            start = clock()
+            batch = []
+            for record in record_iter:
+                batch.append(layout.split_record(record))
+                if len(batch) == DEFAULT_BATCH_SIZE:
+                    break
+            parsed = clock()
+            if not batch:
+                timings["parse"] += parsed - start
+                break
+
+            text = io.StringIO()
+            csv.writer(text, lineterminator="\n").writerows(batch)
+            data = text.getvalue().encode(encoding_props.delimited_encoding)
+            encoded = clock()
+            out.write(data)
+            written = clock()
+
+            timings["parse"] += parsed - start
+            timings["encode"] += encoded - parsed
+            timings["write"] += written - encoded
+            records += len(batch)
+            output_size += len(data)
+
+        start = clock()
+        out.flush()
+        os.fsync(out.fileno())
+        timings["write"] += clock() - start
+
+    input_size = os.path.getsize(encoding_props.fixed_width_filename)
+    sizes = {"parse": input_size, "encode": output_size, "write": output_size}
+    return {
+        "records": records,
+        "seconds": sum(timings.values()),
+        "stages": {
+            stage: stage_result(seconds, records, sizes[stage])
+            for stage, seconds in timings.items()
+        },
+    }
+
+
+def bench_convert(encoding_props):
+    DelimitedFileWriter(encoding_props).convert()
+
+
+def bench_instrumented(encoding_props):
+    """ Converts the file with instrumentation on, which also shows its cost
+        relative to the convert case.
+    """
+    delimited = DelimitedFileWriter(encoding_props, instrumentation=Instrumentation())
+    delimited.convert()
+    metrics = delimited.metrics
+    return {
+        "seconds": metrics.run_seconds,
+        "stages": {
+            stage: stage_result(seconds, metrics.records_read, metrics.bytes_read)
+            for stage, seconds in metrics.seconds.items()
+        },
+    }
+
+
+def bench_convert_parallel(encoding_props):
+    DelimitedFileWriter(encoding_props).convert_parallel()
+
+
+def bench_column_store(encoding_props):
+    directory = os.path.join(
+        os.path.dirname(encoding_props.delimited_filename), "column_store"
+    )
+    DelimitedFileWriter(encoding_props).convert_to_column_store(directory)
+
+
+def bench_columnar(encoding_props):
+    from delimited_writer.columnar import ColumnarParser
+
+    ColumnarParser(encoding_props, use_numpy=True).parse_columns()
+
+
+CASES = {
+    "pipeline": bench_pipeline,
+    "convert": bench_convert,
+    "instrumented": bench_instrumented,
+    "convert_parallel": bench_convert_parallel,
+    "column_store": bench_column_store,
+    "columnar": bench_columnar,
+}
+
+
+def run_case(name, spec_filename, fixed_width_filename, delimited_filename):
+    """ Runs one case. Called in a fresh process, so peak_rss() is its own.
+    """
+    encoding_props = EncodingProperties(
+        spec_filename, fixed_width_filename, delimited_filename, "\n"
+    )
+    start = time.perf_counter()
+    result = CASES[name](encoding_props) or {}
+    seconds = result.pop("seconds", time.perf_counter() - start)
+
+    input_size = os.path.getsize(fixed_width_filename)
+    records = input_size // (encoding_props.layout.record_length + 1)
+    result.update(stage_result(seconds, records, input_size))
+    result["peak_rss_bytes"] = peak_rss()
+    # Worker processes, e.g. of convert_parallel, are measured separately
+    result["peak_child_rss_bytes"] = peak_rss("RUSAGE_CHILDREN")
+    return result
+
+
+def compare(results, baseline, tolerance):
+    """ Returns a description of every throughput that dropped by more than
+        tolerance relative to baseline.
+    """
+    regressions = []
+    for name, case in results["cases"].items():
+        old_case = baseline.get("cases", {}).get(name)
+        if not old_case:
+            continue
+        pairs = [(name, case, old_case)] + [
+            (f"{name}.{stage}", stage_values, old_case.get("stages", {}).get(stage))
+            for stage, stage_values in case.get("stages", {}).items()
+        ]
+        for label, new, old in pairs:
+            if not old or not old.get("records_per_sec"):
+                continue
+            change = new["records_per_sec"] / old["records_per_sec"] - 1
+            if change < -tolerance:
+                regressions.append(f"{label}: {change:+.1%} records/s")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--size", default="100MB", help="e.g. 500MB or 20GB")
+    parser.add_argument("--records", type=int, help="record count, overrides --size")
+    parser.add_argument("--columns", type=int, help="generate a spec of N columns")
+    parser.add_argument("--max-width", type=int, default=20)
+    parser.add_argument("--spec", default="spec.json")
+    parser.add_argument("--charset", default="cp1252", choices=sorted(CHARSETS))
+    parser.add_argument("--fill", default="random", choices=sorted(FILLS))
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--cases", nargs="+", default=list(CASES), choices=CASES)
+    parser.add_argument("--directory", help="work directory, default a temp dir")
+    parser.add_argument("--output", help="save results as JSON")
+    parser.add_argument("--baseline", help="earlier results JSON to compare to")
+    parser.add_argument("--tolerance", type=float, default=0.10)
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory(dir=args.directory) as directory:
+        spec_filename = args.spec
+        if args.columns:
+            spec_filename = os.path.join(directory, "spec.json")
+            write_spec(spec_filename, args.columns, max_width=args.max_width)
+        fixed_width_filename = os.path.join(directory, "fixed_width.txt")
+        delimited_filename = os.path.join(directory, "delimited.csv")
+        encoding_props = EncodingProperties(
+            spec_filename, fixed_width_filename, delimited_filename
+        )
+
+        start = time.perf_counter()
+        generator = SyntheticFixedWidthFile(
+            encoding_props, args.seed, args.charset, args.fill
+        )
+        if args.records:
+            records = generator.write(record_count=args.records)
+        else:
+            records = generator.write(size=parse_size(args.size))
+        input_size = os.path.getsize(fixed_width_filename)
+        print(
+            f"Generated {records:,} records, {input_size / 1e6:,.1f} MB, "
+            f"{len(encoding_props.offsets)} columns "
+            f"in {time.perf_counter() - start:.1f} s"
+        )
+
+        results = {
+            "created": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "parameters": {
+                "records": records,
+                "input_bytes": input_size,
+                "columns": len(encoding_props.offsets),
+                "record_length": encoding_props.layout.record_length,
+                "charset": args.charset,
+                "fill": args.fill,
+                "seed": args.seed,
+            },
+            "cases": {},
+        }
+
+        context = multiprocessing.get_context("spawn")
+        for name in args.cases:
+            if name == "columnar":
+                from delimited_writer.columnar import np
+
+                if np is None:
+                    print("columnar: skipped, NumPy is not installed")
+                    continue
+            with ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+                result = pool.submit(
+                    run_case,
+                    name,
+                    spec_filename,
+                    fixed_width_filename,
+                    delimited_filename,
+                ).result()
+            results["cases"][name] = result
+            rss = result["peak_rss_bytes"]
+            rss = f"{rss / 1e6:,.0f} MB" if rss else "n/a"
+            print(
+                f"{name:<18}{result['seconds']:>8.2f} s"
+                f"{result['records_per_sec']:>14,.0f} records/s"
+                f"{result['bytes_per_sec'] / 1e6:>10,.1f} MB/s   peak RSS {rss}"
+            )
+            for stage, values in result.get("stages", {}).items():
+                print(
+                    f"  {stage:<16}{values['seconds']:>8.2f} s"
+                    f"{values['records_per_sec'] or 0:>14,.0f} records/s"
+                    f"{(values['bytes_per_sec'] or 0) / 1e6:>10,.1f} MB/s"
+                )
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=4)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if baseline.get("parameters") != results["parameters"]:
+            print("WARNING baseline was run with different parameters")
+        regressions = compare(results, baseline, args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,109 @@
+"""
+Deterministic, streaming generation of synthetic fixed width files.
+
+Unlike MockFixedWidthFileWriter, which builds ten lines in memory for the
+unit tests, SyntheticFixedWidthFile writes files of any size in large blocks
+with bounded memory. A pool of distinct records is generated from the seed,
+then records are drawn from the pool with the same seeded generator, so a
+given seed, spec and size always produce byte-identical files.
+"""
+
+import json
+import random
+
+from encodings.cp1252 import decoding_table
+
+# Characters drawn for each field, by distribution name
+CHARSETS = {
+    "ascii": "ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789",
+    "numeric": "0123456789",
+    # Every printable cp1252 character, as used by MockFixedWidthFileWriter
+    "cp1252": "".join(
+        char
+        for code, char in enumerate(decoding_table)
+        if code > 32 and code not in {127, 129, 141, 143, 144, 157, 160}
+    ),
+}
+
+# Fraction of each field filled with characters, by fill name
+FILLS = {
+    "full": (1.0, 1.0),
+    "random": (0.0, 1.0),
+    "sparse": (0.0, 0.25),
+}
+
+# Distinct records generated before drawing from the pool
+POOL_SIZE = 1 << 14
+
+# Records written per f.write() call
+RECORDS_PER_BLOCK = 1 << 12
+
+
+def write_spec(spec_filename, column_count, min_width=1, max_width=20, seed=0):
+    """ Writes a spec.json style file with column_count columns of random
+        widths, and returns its offsets.
+    """
+    rng = random.Random(seed)
+    offsets = [rng.randint(min_width, max_width) for _ in range(column_count)]
+    spec = {
+        "ColumnNames": [f"f{i + 1}" for i in range(column_count)],
+        "Offsets": [str(offset) for offset in offsets],
+        "FixedWidthEncoding": "windows-1252",
+        "IncludeHeader": "True",
+        "DelimitedEncoding": "utf-8",
+    }
+    with open(spec_filename, "w") as f:
+        json.dump(spec, f, indent=4)
+    return offsets
+
+
+class SyntheticFixedWidthFile:
+    """ Generates fixed width files for the layout in encoding_props.
+
+        charset is a key of CHARSETS or a string of characters to draw from.
+        fill is a key of FILLS, giving the range of the fraction of each field
+        holding characters; the rest is space padding.
+    """
+
+    def __init__(self, encoding_props, seed=0, charset="cp1252", fill="random"):
+        self.encoding_props = encoding_props
+        self.layout = encoding_props.layout
+        self.seed = seed
+        self.charset = CHARSETS.get(charset, charset)
+        self.fill = FILLS[fill]
+
+    def generate_pool(self, rng, pool_size=POOL_SIZE):
+        """ Returns pool_size randomly generated, encoded records.
+        """
+        low, high = self.fill
+        encoding = self.layout.encoding
+        pool = []
+        for _ in range(pool_size):
+            fields = []
+            for offset in self.layout.offsets:
+                length = round(offset * rng.uniform(low, high))
+                field = "".join(rng.choices(self.charset, k=length))
+                fields.append(field.ljust(offset))
+            pool.append("".join(fields).encode(encoding))
+        return pool
+
+    def write(self, record_count=None, size=None, newline=b"\n"):
+        """ Streams record_count records, or enough records to reach size
+            bytes, to the fixed width file. Returns the number of records.
+        """
+        if (record_count is None) == (size is None):
+            raise ValueError("Exactly one of record_count and size is required")
+        stride = self.layout.record_length + len(newline)
+        if record_count is None:
+            record_count = max(1, size // stride)
+
+        rng = random.Random(self.seed)
+        pool = self.generate_pool(rng, min(POOL_SIZE, record_count))
+        pool = [record + newline for record in pool]
+        remaining = record_count
+        with open(self.encoding_props.fixed_width_filename, "wb") as f:
+            while remaining:
+                count = min(RECORDS_PER_BLOCK, remaining)
+                f.write(b"".join(rng.choices(pool, k=count)))
+                remaining -= count
+        return record_count
@@ -0,0 +1,351 @@
+"""
+Batch conversion of many fixed width files over a pool of worker processes
+
+Jobs are read from a JSONL manifest, one object per line:
+
+    {"spec": "spec.json", "input": "in.txt", "output": "out.csv", "newline": "\\n"}
+
+or picked up from a directory watched for new .json and .jsonl job files.
+Jobs are spread over a bounded process pool, and each worker caches validated
+specs by content hash so that feeds sharing a spec only parse it once.
+
+Run from the repository root, e.g.:
+$ python -m delimited_writer.batch --manifest jobs.jsonl --report report.json
+$ python -m delimited_writer.batch --watch incoming/ --idle-timeout 600
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import sys
+import time
+from collections import namedtuple
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+from delimited_writer.compression import COMPRESSION_OPTIONS
+from delimited_writer.delimited_writer import DEFAULT_BATCH_SIZE, DelimitedFileWriter
+from delimited_writer.encoding_properties import EncodingProperties
+
+# Seconds between scans of a watched directory
+DEFAULT_POLL_INTERVAL = 1.0
+
+# Jobs queued in the pool per worker before the manifest is read further
+DEFAULT_PENDING_PER_WORKER = 2
+
+ConversionJob = namedtuple(
+    "ConversionJob",
+    [
+        "spec_filename",
+        "fixed_width_filename",
+        "delimited_filename",
+        "delimited_newline",
+    ],
+)
+
+# The outcome of one job. seconds is the time the worker spent on it, and
+# latency the time from submission to completion, including queueing.
+JobResult = namedtuple(
+    "JobResult",
+    [
+        "job",
+        "error",
+        "summary",
+        "input_bytes",
+        "spec_cached",
+        "seconds",
+        "latency",
+    ],
+)
+
+
+def parse_job(line):
+    """ Returns the ConversionJob described by one JSON manifest line.
+    """
+    fields = json.loads(line)
+    missing = [key for key in ["spec", "input", "output"] if key not in fields]
+    if missing:
+        raise ValueError(f"Job is missing {', '.join(missing)}: {line.strip()}")
+    return ConversionJob(
+        fields["spec"], fields["input"], fields["output"], fields.get("newline")
+    )
+
+
+def read_manifest(manifest_filename):
+    """ Lazily yields the jobs of a JSONL manifest, skipping blank lines.
+    """
+    with open(manifest_filename, "r") as f:
+        for line in f:
+            if line.strip():
+                yield parse_job(line)
+
+
+def watch_directory(directory, poll_interval=DEFAULT_POLL_INTERVAL, idle_timeout=None):
+    """ Yields the jobs of each .json or .jsonl job file placed in directory,
+        in name order, polling for new files every poll_interval seconds.
+        Job files should be moved into place complete, e.g. with os.replace().
+
+        None is yielded whenever no new job is found, so that the consumer can
+        report finished jobs while waiting. Stops once no new job file has
+        appeared for idle_timeout seconds, or never when it is None.
+    """
+    seen = set()
+    last_job = time.monotonic()
+    while True:
+        found = False
+        for name in sorted(os.listdir(directory)):
+            if name in seen or not name.endswith((".json", ".jsonl")):
+                continue
+            seen.add(name)
+            found = True
+            yield from read_manifest(os.path.join(directory, name))
+        if found:
+            last_job = time.monotonic()
+        elif idle_timeout is not None and time.monotonic() - last_job >= idle_timeout:
+            return
+        else:
+            yield None
+            time.sleep(poll_interval)
+
+
+class SpecCache:
+    """ Validated EncodingProperties keyed by the SHA-256 of the spec file.
+
+        Each lookup still reads the spec file, so an edited spec is noticed,
+        but a spec already seen skips parsing, validation and compiling its
+        RecordLayout.
+    """
+
+    def __init__(self):
+        self.specs = {}
+
+    def get(self, spec_filename, fixed_width_filename, delimited_filename, newline):
+        """ Returns (encoding_props, cached) for the given files. cached is
+            True when the spec was already in the cache.
+        """
+        with open(spec_filename, "rb") as f:
+            data = f.read()
+        digest = hashlib.sha256(data).hexdigest()
+        cached = digest in self.specs
+        if not cached:
+            self.specs[digest] = EncodingProperties(
+                spec_filename, None, None, spec=json.loads(data)
+            )
+        encoding_props = self.specs[digest].for_files(
+            fixed_width_filename, delimited_filename, newline
+        )
+        return encoding_props, cached
+
+
+# One cache per worker process, kept for the life of the pool
+spec_cache = SpecCache()
+
+
+def run_job(
+    job, batch_size=DEFAULT_BATCH_SIZE, input_compression=None, output_compression=None
+):
+    """ Worker entry point. Converts one job, returning its JobResult with
+        the latency left to the caller. Errors are returned, not raised, so
+        that one bad feed does not stop the batch. The compression options,
+        when given, override those of the job's spec.
+    """
+    start = time.perf_counter()
+    summary = error = None
+    input_bytes = 0
+    cached = False
+    try:
+        encoding_props, cached = spec_cache.get(*job)
+        if input_compression is not None:
+            encoding_props.fixed_width_compression = input_compression
+        if output_compression is not None:
+            encoding_props.delimited_compression = output_compression
+        input_bytes = os.path.getsize(job.fixed_width_filename)
+        # Jobs already run in parallel, so each compresses on one thread
+        delimited = DelimitedFileWriter(encoding_props, compression_workers=1)
+        summary = delimited.convert(batch_size).as_dict()
+    except Exception as exception:
+        error = f"{type(exception).__name__}: {exception}"
+    return JobResult(
+        job, error, summary, input_bytes, cached, time.perf_counter() - start, None
+    )
+
+
+class BatchReport:
+    """ Overall results of a batch: job and failure counts, records and input
+        bytes converted, throughput over the wall clock time, and latency
+        percentiles of the jobs.
+    """
+
+    def __init__(self):
+        self.results = []
+        self.seconds = 0.0
+
+    def add(self, result):
+        self.results.append(result)
+
+    def as_dict(self):
+        done = [result for result in self.results if result.error is None]
+        records = sum(result.summary["records_read"] for result in done)
+        input_bytes = sum(result.input_bytes for result in done)
+        latencies = sorted(result.latency for result in self.results)
+
+        def percentile(fraction):
+            if not latencies:
+                return None
+            return latencies[min(len(latencies) - 1, int(fraction * len(latencies)))]
+
+        return {
+            "jobs": len(self.results),
+            "failed": len(self.results) - len(done),
+            "spec_cache_hits": sum(result.spec_cached for result in self.results),
+            "seconds": self.seconds,
+            "records": records,
+            "input_bytes": input_bytes,
+            "records_per_sec": records / self.seconds if self.seconds else None,
+            "bytes_per_sec": input_bytes / self.seconds if self.seconds else None,
+            "latency_p50": percentile(0.50),
+            "latency_p95": percentile(0.95),
+            "latency_max": latencies[-1] if latencies else None,
+        }
+
+
+class BatchConverter:
+    """ Converts a stream of ConversionJobs over a pool of `workers` processes,
+        one per CPU by default.
+
+        Jobs are taken from the stream only while fewer than max_pending are
+        queued or running, by default DEFAULT_PENDING_PER_WORKER per worker,
+        so a long manifest or a busy watched directory never builds an
+        unbounded backlog in memory.
+    """
+
+    def __init__(
+        self,
+        workers=None,
+        max_pending=None,
+        batch_size=DEFAULT_BATCH_SIZE,
+        input_compression=None,
+        output_compression=None,
+    ):
+        self.workers = workers or os.cpu_count() or 1
+        self.max_pending = max_pending or self.workers * DEFAULT_PENDING_PER_WORKER
+        if self.max_pending < 1:
+            raise ValueError(f"max_pending must be positive, got {max_pending}")
+        self.batch_size = batch_size
+        for compression in [input_compression, output_compression]:
+            if compression is not None and compression not in COMPRESSION_OPTIONS:
+                raise ValueError(f"Unknown compression: {compression}")
+        self.input_compression = input_compression
+        self.output_compression = output_compression
+
+    def iter_results(self, jobs):
+        """ Runs jobs, an iterable of ConversionJob in which None means that no
+            job is ready yet, yielding each JobResult as it completes.
+        """
+        pending = {}
+        jobs = iter(jobs)
+        with ProcessPoolExecutor(max_workers=self.workers) as pool:
+            exhausted = False
+            while not exhausted or pending:
+                # Fill the pool up to max_pending, the backpressure bound
+                while not exhausted and len(pending) < self.max_pending:
+                    job = next(jobs, StopIteration)
+                    if job is StopIteration:
+                        exhausted = True
+                    elif job is None:
+                        break
+                    else:
+                        submitted = time.perf_counter()
+                        future = pool.submit(
+                            run_job,
+                            job,
+                            self.batch_size,
+                            self.input_compression,
+                            self.output_compression,
+                        )
+                        pending[future] = submitted
+                if not pending:
+                    continue
+                # Only block when the pool is full or there are no more jobs,
+                # otherwise go back to the job stream
+                timeout = None if exhausted or len(pending) >= self.max_pending else 0
+                done, _ = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+                for future in done:
+                    latency = time.perf_counter() - pending.pop(future)
+                    yield future.result()._replace(latency=latency)
+
+    def run(self, jobs, callback=None):
+        """ Runs jobs and returns the BatchReport. callback, if given, is
+            called with each JobResult as it completes.
+        """
+        report = BatchReport()
+        start = time.perf_counter()
+        for result in self.iter_results(jobs):
+            report.add(result)
+            if callback is not None:
+                callback(result)
+        report.seconds = time.perf_counter() - start
+        return report
+
+
+def print_result(result):
+    job = result.job
+    if result.error is None:
+        print(
+            f"{job.fixed_width_filename}: {result.summary['records_written']:,} "
+            f"records in {result.seconds:.3f} s, latency {result.latency:.3f} s"
+        )
+    else:
+        print(f"{job.fixed_width_filename}: FAILED {result.error}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--manifest", help="JSONL file of jobs")
+    source.add_argument("--watch", help="directory to watch for job files")
+    parser.add_argument("--poll-interval", type=float, default=DEFAULT_POLL_INTERVAL)
+    parser.add_argument("--idle-timeout", type=float, help="seconds, default never")
+    parser.add_argument("--workers", type=int, help="default one per CPU")
+    parser.add_argument("--max-pending", type=int, help="jobs queued at once")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE)
+    parser.add_argument(
+        "--input-compression",
+        choices=sorted(COMPRESSION_OPTIONS),
+        help="overrides FixedWidthCompression of the specs",
+    )
+    parser.add_argument(
+        "--output-compression",
+        choices=sorted(COMPRESSION_OPTIONS),
+        help="overrides DelimitedCompression of the specs",
+    )
+    parser.add_argument("--report", help="save the report as JSON")
+    args = parser.parse_args(argv)
+
+    if args.manifest:
+        jobs = read_manifest(args.manifest)
+    else:
+        jobs = watch_directory(args.watch, args.poll_interval, args.idle_timeout)
+    converter = BatchConverter(
+        args.workers,
+        args.max_pending,
+        args.batch_size,
+        args.input_compression,
+        args.output_compression,
+    )
+    report = converter.run(jobs, print_result).as_dict()
+
+    print(
+        f"{report['jobs']} jobs, {report['failed']} failed, "
+        f"{report['records']:,} records in {report['seconds']:.2f} s, "
+        f"{report['records_per_sec'] or 0:,.0f} records/s, "
+        f"{(report['bytes_per_sec'] or 0) / 1e6:,.1f} MB/s"
+    )
+    if args.report:
+        with open(args.report, "w") as f:
+            json.dump(report, f, indent=4)
+    return 1 if report["failed"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
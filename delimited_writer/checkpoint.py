@@ -0,0 +1,179 @@
+"""
+Checkpoints for resuming interrupted conversions
+"""
+
+import hashlib
+import json
+import os
+
+CHECKPOINT_VERSION = 1
+
+# Bytes before a checkpointed offset that are hashed to verify a file
+TAIL_SIZE = 4096
+
+
+class CheckpointMismatch(ValueError):
+    """ Raised when a checkpoint does not belong to the run being resumed,
+        or the files it describes have changed since it was written.
+        Delete the checkpoint file to start the conversion again.
+    """
+
+
+def checkpoint_filename(delimited_filename):
+    """ Returns the checkpoint filename kept next to the delimited file.
+    """
+    return f"{delimited_filename}.checkpoint"
+
+
+def tail_digest(filename, offset, size=TAIL_SIZE):
+    """ Returns a SHA-256 digest of the size bytes of a file ending at offset.
+    """
+    with open(filename, "rb") as f:
+        start = max(0, offset - size)
+        f.seek(start)
+        return hashlib.sha256(f.read(offset - start)).hexdigest()
+
+
+def run_fingerprint(encoding_props, mode, **options):
+    """ Returns a digest of everything that shapes the output of a run, so
+        that a checkpoint is only ever resumed by an identical run.
+    """
+    run = {
+        "mode": mode,
+        "fixed_width_filename": os.path.abspath(encoding_props.fixed_width_filename),
+        "column_names": encoding_props.column_names,
+        "offsets": encoding_props.offsets,
+        "fixed_width_encoding": encoding_props.fixed_width_encoding,
+        "delimited_encoding": encoding_props.delimited_encoding,
+        "delimited_newline": encoding_props.delimited_newline,
+        "include_header": encoding_props.include_header,
+        "options": {key: repr(value) for key, value in sorted(options.items())},
+    }
+    return hashlib.sha256(json.dumps(run, sort_keys=True).encode()).hexdigest()
+
+
+class Checkpoint:
+    """ The progress of a conversion, saved next to the delimited file.
+
+        input_offset is the byte offset of the first fixed width line not yet
+        converted, and output_offset the length of the delimited file holding
+        every record before it. reject_offset is the same for a quarantine's
+        reject file. The summary counts are restored on resume so that they,
+        and reject line numbers, cover the whole run.
+
+        Parallel runs record the number of chunks planned and how many have
+        been appended to the delimited file, in order, in chunks_done.
+
+        Digests of the bytes just before input_offset and output_offset are
+        saved, so that a resumed run can check that neither file changed.
+    """
+
+    FIELDS = [
+        "fingerprint",
+        "input_offset",
+        "output_offset",
+        "reject_offset",
+        "records_read",
+        "records_written",
+        "records_filtered",
+        "records_rejected",
+        "chunks",
+        "chunks_done",
+        "input_digest",
+        "output_digest",
+    ]
+
+    def __init__(self, filename, fingerprint):
+        self.filename = filename
+        self.fingerprint = fingerprint
+        self.input_offset = 0
+        self.output_offset = 0
+        self.reject_offset = 0
+        self.records_read = 0
+        self.records_written = 0
+        self.records_filtered = 0
+        self.records_rejected = 0
+        self.chunks = None
+        self.chunks_done = 0
+        self.input_digest = None
+        self.output_digest = None
+
+    @classmethod
+    def load(cls, filename, fingerprint):
+        """ Returns the checkpoint saved in filename, or a new checkpoint at the
+            start of the run when there is none.
+        """
+        checkpoint = cls(filename, fingerprint)
+        if not os.path.exists(filename):
+            return checkpoint
+        with open(filename, "r") as f:
+            state = json.load(f)
+        if state.get("version") != CHECKPOINT_VERSION:
+            raise CheckpointMismatch(f"Unsupported checkpoint version in {filename}")
+        for field in cls.FIELDS:
+            setattr(checkpoint, field, state[field])
+        return checkpoint
+
+    @property
+    def started(self):
+        return self.input_offset > 0 or self.chunks_done > 0
+
+    def verify(self, fingerprint, fixed_width_filename, delimited_filename):
+        """ Checks that this checkpoint belongs to the run with fingerprint,
+            and that the input and partial output are as it left them.
+        """
+        if not self.started:
+            self.fingerprint = fingerprint
+            return
+        if self.fingerprint != fingerprint:
+            raise CheckpointMismatch(
+                f"{self.filename} was written by a run with different settings"
+            )
+        for filename, offset, digest in [
+            (fixed_width_filename, self.input_offset, self.input_digest),
+            (delimited_filename, self.output_offset, self.output_digest),
+        ]:
+            if not os.path.exists(filename) or os.path.getsize(filename) < offset:
+                raise CheckpointMismatch(f"{filename} is shorter than checkpointed")
+            if tail_digest(filename, offset) != digest:
+                raise CheckpointMismatch(f"{filename} changed since the checkpoint")
+
+    def update(self, summary, input_offset, output_offset, reject_offset=0):
+        self.input_offset = input_offset
+        self.output_offset = output_offset
+        self.reject_offset = reject_offset
+        self.records_read = summary.records_read
+        self.records_written = summary.records_written
+        self.records_filtered = summary.records_filtered
+        self.records_rejected = summary.records_rejected
+
+    def restore(self, summary):
+        """ Copies the checkpointed counts into a ConversionSummary.
+        """
+        summary.records_read = self.records_read
+        summary.records_written = self.records_written
+        summary.records_filtered = self.records_filtered
+        summary.records_rejected = self.records_rejected
+
+    def save(self, fixed_width_filename, delimited_filename):
+        """ Writes the checkpoint atomically: a temporary file is written and
+            synced, then renamed over the previous checkpoint.
+        """
+        self.input_digest = tail_digest(fixed_width_filename, self.input_offset)
+        self.output_digest = tail_digest(delimited_filename, self.output_offset)
+        self.write()
+
+    def write(self):
+        state = {field: getattr(self, field) for field in self.FIELDS}
+        state["version"] = CHECKPOINT_VERSION
+
+        temporary_filename = f"{self.filename}.tmp"
+        with open(temporary_filename, "w") as f:
+            json.dump(state, f, indent=4)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temporary_filename, self.filename)
+
+    def remove(self):
+        if os.path.exists(self.filename):
+            os.remove(self.filename)
@@ -0,0 +1,195 @@
+"""
+Single pass column statistics, collected while converting
+"""
+
+import json
+import math
+import os
+import sys
+from array import array
+from hashlib import blake2b
+
+# Registers of each HyperLogLog are 2 ** DEFAULT_PRECISION bytes, for a
+# relative error of about 1.6%
+DEFAULT_PRECISION = 12
+
+# Bits of the BLAKE2b digest of a value, which HyperLogLog splits into
+# register and rank
+HASH_BITS = 64
+
+# 2 ** -rank of every possible register value
+INVERSE_POWERS = [2.0 ** -rank for rank in range(HASH_BITS + 2)]
+
+
+def stats_filename(delimited_filename):
+    """ Returns the statistics filename kept next to the delimited file.
+    """
+    return f"{delimited_filename}.stats.json"
+
+
+class HyperLogLog:
+    """ An approximate count of distinct values in 2 ** precision one byte
+        registers, whatever the number of values, with a relative error of
+        about 1.04 / sqrt(2 ** precision).
+
+        Values are hashed with BLAKE2b rather than hash(), which is salted
+        per process for str, so that the estimate for the same values is the
+        same in every run.
+    """
+
+    def __init__(self, precision=DEFAULT_PRECISION):
+        if not 4 <= precision <= 16:
+            raise ValueError(f"precision must be from 4 to 16, got {precision}")
+        self.precision = precision
+        self.registers = bytearray(1 << precision)
+
+    def update(self, values):
+        """ Adds the str values.
+
+            Each distinct value of the batch is encoded and hashed, and the
+            digests are read as one array of little endian integers. Once
+            every register holds at least r, only a hash with its top r bits
+            clear can raise one, so the hashes are filtered against that limit
+            before any is looked at one at a time. On a large column most are
+            dropped there.
+        """
+        precision = self.precision
+        mask = (1 << precision) - 1
+        bits = HASH_BITS - precision
+        registers = self.registers
+        size = HASH_BITS // 8
+        digests = [
+            blake2b(value.encode("utf-8"), digest_size=size).digest()
+            for value in set(values)
+        ]
+        hashes = array("Q", b"".join(digests))
+        if sys.byteorder == "big":
+            hashes.byteswap()
+        limit = 1 << (HASH_BITS - min(registers))
+        for h in filter(limit.__gt__, hashes):
+            i = h & mask
+            rank = bits - (h >> precision).bit_length() + 1
+            if rank > registers[i]:
+                registers[i] = rank
+
+    def estimate(self):
+        """ Returns the estimated number of distinct values added.
+        """
+        m = len(self.registers)
+        alpha = {16: 0.673, 32: 0.697, 64: 0.709}.get(m, 0.7213 / (1 + 1.079 / m))
+        harmonic = sum(map(INVERSE_POWERS.__getitem__, self.registers))
+        estimate = alpha * m * m / harmonic
+        zeros = self.registers.count(0)
+        if estimate <= 2.5 * m and zeros:
+            # Linear counting is more accurate for small counts
+            estimate = m * math.log(m / zeros)
+        return round(estimate)
+
+
+class ColumnProfile:
+    """ Statistics of one column, updated a batch of values at a time.
+
+        Lengths are of the trimmed values, in characters, and fill_ratio is
+        the average length over the width declared in the spec. non_ascii
+        counts the characters outside ASCII over all values.
+    """
+
+    def __init__(self, width, precision=DEFAULT_PRECISION):
+        self.width = width
+        self.count = 0
+        self.blank = 0
+        self.min_length = None
+        self.max_length = None
+        self.total_length = 0
+        self.non_ascii = 0
+        self.distinct = HyperLogLog(precision)
+
+    def update(self, values):
+        lengths = list(map(len, values))
+        self.count += len(lengths)
+        self.blank += lengths.count(0)
+        self.total_length += sum(lengths)
+        shortest, longest = min(lengths), max(lengths)
+        if self.min_length is None or shortest < self.min_length:
+            self.min_length = shortest
+        if self.max_length is None or longest > self.max_length:
+            self.max_length = longest
+        text = "".join(values)
+        if not text.isascii():
+            self.non_ascii += len(text) - len(text.encode("ascii", "ignore"))
+        self.distinct.update(values)
+
+    @property
+    def average_length(self):
+        return self.total_length / self.count if self.count else None
+
+    def as_dict(self):
+        average_length = self.average_length
+        return {
+            "width": self.width,
+            "count": self.count,
+            "blank": self.blank,
+            "min_length": self.min_length,
+            "max_length": self.max_length,
+            "average_length": average_length,
+            "fill_ratio": (
+                average_length / self.width
+                if average_length is not None and self.width
+                else None
+            ),
+            "distinct": self.distinct.estimate(),
+            "non_ascii": self.non_ascii,
+        }
+
+
+class ColumnStatistics:
+    """ Opt-in column statistics for DelimitedFileWriter.
+
+        Each column written is profiled, see ColumnProfile, from the batches
+        on their way to the delimited file, so no second pass is needed.
+        Memory use is fixed by the number of columns and precision, one
+        HyperLogLog of 2 ** precision bytes per column, not by the data.
+
+        At the end of the run the statistics are written as JSON to
+        filename, by default stats_filename() of the delimited file. The
+        file is replaced atomically.
+    """
+
+    def __init__(self, filename=None, precision=DEFAULT_PRECISION):
+        self.filename = filename
+        self.precision = precision
+        self.columns = {}
+        self.records = 0
+        # Fail early on a bad precision, rather than at the start of a run
+        HyperLogLog(precision)
+
+    def start(self, column_names, widths):
+        """ Starts a run writing column_names, of the declared widths.
+        """
+        self.columns = {
+            name: ColumnProfile(width, self.precision)
+            for name, width in zip(column_names, widths)
+        }
+        self.records = 0
+
+    def add(self, batch):
+        """ Adds a batch of records, each a sequence of the column values.
+        """
+        self.records += len(batch)
+        for profile, values in zip(self.columns.values(), zip(*batch)):
+            profile.update(values)
+
+    def as_dict(self):
+        return {
+            "records": self.records,
+            "columns": {
+                name: profile.as_dict() for name, profile in self.columns.items()
+            },
+        }
+
+    def save(self, delimited_filename):
+        filename = self.filename or stats_filename(delimited_filename)
+        temporary_filename = f"{filename}.tmp"
+        with open(temporary_filename, "w") as f:
+            json.dump(self.as_dict(), f, indent=4)
+        os.replace(temporary_filename, filename)
@@ -0,0 +1,396 @@
+"""
+Binary columnar output, one memory-mappable file per column
+
+A column store is a directory holding the values of each column written in
+its own files, and a JSON manifest describing them. Values are UTF-8, with
+their padding removed as in the delimited file. A column is stored in one of
+two layouts:
+
+- "fixed": one slot of `width` bytes per record, the column's width in the
+  spec, padded with NUL bytes, i.e. a NumPy "S<width>" array.
+- "offsets": an offsets file of records + 1 little endian int64, where value
+  n is bytes offsets[n] to offsets[n + 1] of the data file.
+
+Columns are written as fixed while every value fits in a slot, and changed to
+offsets by the first value that does not, e.g. one with characters taking
+several bytes in UTF-8.
+
+The manifest is written last, so a directory without one is incomplete:
+
+    {
+        "format": "column_store",
+        "version": 1,
+        "records": 2,
+        "encoding": "utf-8",
+        "columns": [
+            {"name": "f1", "width": 5, "layout": "fixed", "files": ["0.fixed"]},
+            {"name": "f2", "width": 12, "layout": "offsets",
+             "files": ["1.offsets", "1.data"]}
+        ]
+    }
+"""
+
+import json
+import mmap
+import os
+import struct
+import sys
+from array import array
+from itertools import accumulate
+
+MANIFEST_FILENAME = "manifest.json"
+
+FORMAT_NAME = "column_store"
+
+FORMAT_VERSION = 1
+
+# Records read at once when a fixed column is rewritten as offsets
+PROMOTE_BLOCK_RECORDS = 1 << 16
+
+# Records decoded at once by ColumnStoreReader.records()
+RECORDS_BLOCK_SIZE = 4096
+
+
+def manifest_filename(directory):
+    """ Returns the manifest filename of the column store in directory.
+    """
+    return os.path.join(directory, MANIFEST_FILENAME)
+
+
+def int64_bytes(values):
+    """ Returns values packed as little endian int64.
+    """
+    packed = array("q", values)
+    if sys.byteorder == "big":
+        packed.byteswap()
+    return packed.tobytes()
+
+
+def int64_array(data):
+    """ Returns an array of the little endian int64 in data.
+    """
+    values = array("q")
+    values.frombytes(data)
+    if sys.byteorder == "big":
+        values.byteswap()
+    return values
+
+
+class ColumnWriter:
+    """ Writes the values of one column to directory, as fixed slots of width
+        bytes until a value does not fit, then as offsets and data.
+    """
+
+    def __init__(self, directory, index, name, width):
+        self.directory = directory
+        self.index = index
+        self.name = name
+        self.width = width
+        self.layout = "fixed"
+        self.slot = struct.Struct(f"{width}s")
+        self.fixed = open(self.path("fixed"), "wb")
+        self.offsets = None
+        self.data = None
+        self.end = 0
+        self.bytes_written = 0
+
+    def path(self, extension):
+        return os.path.join(self.directory, f"{self.index}.{extension}")
+
+    @property
+    def files(self):
+        if self.layout == "fixed":
+            return [f"{self.index}.fixed"]
+        return [f"{self.index}.offsets", f"{self.index}.data"]
+
+    def add(self, values):
+        """ Appends a batch of str values.
+        """
+        text = "\n".join(values)
+        if text.count("\n") == len(values) - 1:
+            # Encoded in one call, then split apart again
+            self.add_encoded(text.encode("utf-8").split(b"\n"))
+        else:
+            # A value holds a newline, so the batch cannot be split on them
+            self.add_encoded(list(map(str.encode, values)))
+
+    def add_encoded(self, values):
+        """ Appends a batch of values encoded as UTF-8.
+
+            Values without spaces, as parsed, are padded to their slots in
+            one call, with spaces that are then replaced by NUL bytes.
+        """
+        data = b"".join(values)
+        if self.layout == "fixed":
+            # A trailing NUL would be taken for padding when read back
+            if max(map(len, values)) <= self.width and not (
+                b"\0" in data and any(value.endswith(b"\0") for value in values)
+            ):
+                if b" " in data:
+                    slots = b"".join(map(self.slot.pack, values))
+                else:
+                    padded = b"%%-%ds" % self.width * len(values) % tuple(values)
+                    slots = padded.replace(b" ", b"\0")
+                self.fixed.write(slots)
+                self.bytes_written += len(slots)
+                return
+            self.promote()
+        self.append(list(map(len, values)), data)
+
+    def append(self, lengths, data):
+        """ Appends the encoded values of a batch, joined as data, to the
+            offsets and data files.
+        """
+        ends = list(accumulate(lengths, initial=self.end))[1:]
+        self.offsets.write(int64_bytes(ends))
+        self.data.write(data)
+        self.bytes_written += 8 * len(ends) + len(data)
+        self.end = ends[-1]
+
+    def promote(self):
+        """ Rewrites the slots written so far as offsets and data.
+        """
+        self.fixed.close()
+        self.layout = "offsets"
+        self.offsets = open(self.path("offsets"), "wb")
+        self.data = open(self.path("data"), "wb")
+        self.offsets.write(int64_bytes([0]))
+        self.bytes_written = 8
+        with open(self.path("fixed"), "rb") as f:
+            while True:
+                block = f.read(self.width * PROMOTE_BLOCK_RECORDS)
+                if not block:
+                    break
+                values = [
+                    value.rstrip(b"\0") for value, in self.slot.iter_unpack(block)
+                ]
+                self.append(list(map(len, values)), b"".join(values))
+        os.remove(self.path("fixed"))
+
+    def close(self):
+        for f in [self.fixed, self.offsets, self.data]:
+            if f is not None:
+                f.close()
+
+    def as_dict(self):
+        return {
+            "name": self.name,
+            "width": self.width,
+            "layout": self.layout,
+            "files": self.files,
+        }
+
+
+class ColumnStoreWriter:
+    """ Writes records to a column store in directory, see the module
+        docstring. column_names and widths are those of the columns written.
+
+        Stands in for csv.writer: writerows() appends a batch of records,
+        each a sequence of str values, or the raw records of a single byte
+        encoding when given a Transcoder, from delimited_writer.transcoding,
+        which transcodes them a column at a time, timed by metrics when
+        given. close() writes the manifest, which replaces any earlier one
+        atomically. The manifest of a store being rewritten is removed first,
+        so that it is never read half written.
+    """
+
+    def __init__(self, directory, column_names, widths, transcoder=None, metrics=None):
+        self.directory = directory
+        self.transcoder = transcoder
+        self.metrics = metrics
+        self.records = 0
+        os.makedirs(directory, exist_ok=True)
+        if os.path.exists(manifest_filename(directory)):
+            os.remove(manifest_filename(directory))
+        self.columns = []
+        try:
+            for index, (name, width) in enumerate(zip(column_names, widths)):
+                self.columns.append(ColumnWriter(directory, index, name, width))
+        except OSError:
+            self.abort()
+            raise
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *exc_info):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+    @property
+    def bytes_written(self):
+        return sum(column.bytes_written for column in self.columns)
+
+    def writerows(self, records):
+        records = list(records)
+        if not records:
+            return
+        if self.transcoder is not None:
+            for column, values in zip(
+                self.columns, self.transcoder.transcode_columns(records, self.metrics)
+            ):
+                column.add_encoded(values)
+        else:
+            for column, values in zip(self.columns, zip(*records)):
+                column.add(values)
+        self.records += len(records)
+
+    def abort(self):
+        """ Closes the column files, leaving no manifest.
+        """
+        for column in self.columns:
+            column.close()
+
+    def close(self):
+        self.abort()
+        manifest = {
+            "format": FORMAT_NAME,
+            "version": FORMAT_VERSION,
+            "records": self.records,
+            "encoding": "utf-8",
+            "columns": [column.as_dict() for column in self.columns],
+        }
+        filename = manifest_filename(self.directory)
+        temporary_filename = f"{filename}.tmp"
+        with open(temporary_filename, "w") as f:
+            json.dump(manifest, f, indent=4)
+        os.replace(temporary_filename, filename)
+
+
+class ColumnStoreReader:
+    """ Reads a column store written by ColumnStoreWriter, see the module
+        docstring, without parsing the whole dataset.
+
+        A column's files are memory-mapped when the column is first read, so
+        only the columns asked for are ever mapped. A value of a fixed column
+        is found at n * width, and of an offsets column by two offsets.
+
+        Usage:
+            with ColumnStoreReader("store/") as reader:
+                reader[7300112]         # one record, as a list of values
+                reader[1000:2000]       # a list of records
+                reader.column("f5")     # every value of one column
+                reader.record(42, ["f1", "f5"])
+                for record in reader.records(columns=["f1", "f5"]):
+                    ...
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        with open(manifest_filename(directory)) as f:
+            manifest = json.load(f)
+        if manifest.get("format") != FORMAT_NAME:
+            raise ValueError(f"{directory} does not hold a column store")
+        if manifest.get("version") != FORMAT_VERSION:
+            raise ValueError(
+                f"Unsupported column store version: {manifest.get('version')}"
+            )
+        self.record_count = manifest["records"]
+        self.columns = {column["name"]: column for column in manifest["columns"]}
+        self.column_names = list(self.columns)
+        self._maps = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        for data in self._maps.values():
+            if isinstance(data, mmap.mmap):
+                data.close()
+        self._maps = {}
+
+    def __len__(self):
+        return self.record_count
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            start, stop, step = key.indices(self.record_count)
+            if step != 1:
+                return [self.record(i) for i in range(start, stop, step)]
+            return [list(record) for record in self.records(start, stop)]
+        return self.record(key)
+
+    def __iter__(self):
+        return self.records()
+
+    def _map(self, filename):
+        """ Returns the memory map of a file of the store, mapping it once.
+            Empty files, which cannot be mapped, are read as b"".
+        """
+        if filename not in self._maps:
+            with open(os.path.join(self.directory, filename), "rb") as f:
+                if os.fstat(f.fileno()).st_size:
+                    data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                else:
+                    data = b""
+            self._maps[filename] = data
+        return self._maps[filename]
+
+    def _column(self, name):
+        try:
+            return self.columns[name]
+        except KeyError:
+            raise KeyError(f"Unknown column: {name}") from None
+
+    def column(self, name, start=0, stop=None):
+        """ Returns the values of column `name` for records start to stop,
+            reading nothing else.
+        """
+        start, stop, _ = slice(start, stop).indices(self.record_count)
+        column = self._column(name)
+        count = max(0, stop - start)
+        if column["layout"] == "fixed":
+            width = column["width"]
+            if not width or not count:
+                return [""] * count
+            data = self._map(column["files"][0])[start * width : stop * width]
+            return [
+                value.rstrip(b"\0").decode("utf-8")
+                for value, in struct.iter_unpack(f"{width}s", data)
+            ]
+
+        offsets_filename, data_filename = column["files"]
+        if not count:
+            return []
+        offsets = int64_array(self._map(offsets_filename)[8 * start : 8 * stop + 8])
+        first = offsets[0]
+        data = self._map(data_filename)[first : offsets[-1]]
+        ends = [offset - first for offset in offsets]
+        if data.isascii():
+            # Character and byte offsets coincide, so slice once decoded
+            data = data.decode("ascii")
+            return [data[a:b] for a, b in zip(ends, ends[1:])]
+        return [data[a:b].decode("utf-8") for a, b in zip(ends, ends[1:])]
+
+    def value(self, name, n):
+        """ Returns the value of column `name` of record n. Negative n counts
+            from the end.
+        """
+        if n < 0:
+            n += self.record_count
+        if not 0 <= n < self.record_count:
+            raise IndexError("record index out of range")
+        return self.column(name, n, n + 1)[0]
+
+    def record(self, n, columns=None):
+        """ Returns the values of record n. If columns, a list of column
+            names, is given only those columns are read.
+        """
+        names = self.column_names if columns is None else columns
+        return [self.value(name, n) for name in names]
+
+    def records(self, start=0, stop=None, columns=None):
+        """ Yields each record from start to stop as a tuple of the values
+            of columns, by default all of them, RECORDS_BLOCK_SIZE records
+            at a time.
+        """
+        names = self.column_names if columns is None else list(columns)
+        start, stop, _ = slice(start, stop).indices(self.record_count)
+        for first in range(start, stop, RECORDS_BLOCK_SIZE):
+            last = min(first + RECORDS_BLOCK_SIZE, stop)
+            yield from zip(*(self.column(name, first, last) for name in names))
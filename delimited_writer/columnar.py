@@ -0,0 +1,208 @@
+"""
+Vectorised columnar parsing of single byte fixed width files
+"""
+
+try:
+    import numpy as np
+except ImportError:  # NumPy is optional, see ColumnarParser
+    np = None
+
+# Number of records viewed as one 2D array at a time
+DEFAULT_COLUMNAR_BATCH_SIZE = 1 << 16
+
+
+class ColumnarParser:
+    """ Parses a fixed width file into one array of values per column.
+
+        With NumPy installed, each batch of records is read straight from the
+        file into an (n_records, record_length + len(newline)) uint8 array.
+        Every column is cut out as a 2D slice and decoded by looking up each
+        byte in a 256 entry code point table. Trailing padding is blanked in
+        place; columns with spaces inside values instead have every space moved
+        to the end of its row with a stable sort first. The result is a
+        NumPy unicode array per column, with no Python loop per record.
+
+        Without NumPy, or when use_numpy is False, the same results are built
+        from the pure-Python RecordLayout path as lists of str.
+
+        As with DelimitedFileWriter.convert_parallel(), every line must use the
+        same newline, which is detected from the first record. Batches holding
+        a NUL byte are parsed in pure Python, because NumPy strings cannot end
+        in NUL characters, and their columns are object arrays of str.
+
+        iter_rows() yields records that can be passed straight to
+        DelimitedFileWriter.generate_delimited_file().
+    """
+
+    def __init__(
+        self, encoding_props, use_numpy=None, batch_size=DEFAULT_COLUMNAR_BATCH_SIZE
+    ):
+        self.encoding_props = encoding_props
+        self.layout = encoding_props.layout
+        if not self.layout.single_byte:
+            raise ValueError(
+                "Columnar parsing requires a single byte fixed width encoding"
+            )
+        if batch_size < 1:
+            raise ValueError(f"batch_size must be positive, got {batch_size}")
+        if use_numpy and np is None:
+            raise ImportError("NumPy is required when use_numpy is True")
+
+        self.use_numpy = np is not None if use_numpy is None else use_numpy
+        self.batch_size = batch_size
+        self.column_names = list(encoding_props.column_names)
+        if self.use_numpy:
+            self.code_points, self.undefined = self._decoding_table()
+
+    def parse_columns(self, columns=None):
+        """ Returns a dict mapping each column name, or each name in columns,
+            to all of that column's values.
+        """
+        names = self.column_names if columns is None else list(columns)
+        parts = {name: [] for name in names}
+        for batch in self.iter_column_batches(names):
+            for name in names:
+                parts[name].append(batch[name])
+
+        if self.use_numpy:
+            return {
+                name: np.concatenate(values) if values else np.array([], dtype="U")
+                for name, values in parts.items()
+            }
+        return {
+            name: [value for values in parts[name] for value in values]
+            for name in names
+        }
+
+    def iter_rows(self, columns=None):
+        """ Yields each record as a tuple of str, batch by batch, suitable for
+            DelimitedFileWriter.generate_delimited_file().
+        """
+        names = self.column_names if columns is None else list(columns)
+        for batch in self.iter_column_batches(names):
+            values = [batch[name] for name in names]
+            if self.use_numpy:
+                values = [column.tolist() for column in values]
+            yield from zip(*values)
+
+    def to_utf8(self, values):
+        """ Transcodes a whole column of values to UTF-8 bytes in one call.
+        """
+        if self.use_numpy:
+            if values.dtype == object:
+                encoded = [value.encode("utf-8") for value in values]
+                return np.array(encoded, dtype=object)
+            return np.char.encode(values, "utf-8")
+        return [value.encode("utf-8") for value in values]
+
+    def iter_column_batches(self, columns=None):
+        """ Yields a dict of column name to values for each batch of records.
+        """
+        names = self.column_names if columns is None else list(columns)
+        indices = [self.column_names.index(name) for name in names]
+        layout = self.layout
+
+        with open(self.encoding_props.fixed_width_filename, "rb") as f:
+            newline = layout.detect_newline(f)
+            record_count = layout.count_records(f.seek(0, 2), newline)
+            f.seek(0)
+            stride = layout.record_length + len(newline)
+
+            remaining = record_count
+            while remaining:
+                count = min(self.batch_size, remaining)
+                remaining -= count
+                block = f.read(count * stride)
+                if len(block) == count * stride - len(newline):
+                    # Final record of the file has no newline
+                    block += newline
+
+                if self.use_numpy and b"\x00" not in block:
+                    batch = self._numpy_batch(block, count, stride, newline, indices)
+                else:
+                    batch = self._python_batch(block, stride, newline, indices)
+                yield dict(zip(names, batch))
+
+    def _python_batch(self, block, stride, newline, indices):
+        values = [[] for i in indices]
+        layout = self.layout
+        record_length = layout.record_length
+        for start in range(0, len(block), stride):
+            record = block[start : start + record_length]
+            if (
+                block[start + record_length : start + stride] != newline
+                or layout.line_feed in record
+                or layout.carriage_return in record
+            ):
+                raise ValueError("One or more fields are of incorrect length")
+            fields = self.layout.split_record(record)
+            for column, i in zip(values, indices):
+                column.append(fields[i])
+
+        if self.use_numpy:
+            # A unicode array would drop trailing NULs from the values
+            return [np.array(column, dtype=object) for column in values]
+        return values
+
+    def _numpy_batch(self, block, count, stride, newline, indices):
+        layout = self.layout
+        record_length = layout.record_length
+        records = np.frombuffer(block, dtype=np.uint8).reshape(count, stride)
+
+        # Validate every terminator, and that no record holds a newline
+        terminators = records[:, record_length:]
+        expected = np.frombuffer(newline, dtype=np.uint8)
+        data = records[:, :record_length]
+        if not (terminators == expected).all() or (
+            (data == layout.line_feed[0]) | (data == layout.carriage_return[0])
+        ).any():
+            raise ValueError("One or more fields are of incorrect length")
+        undefined = np.flatnonzero(self.undefined[records])
+        if len(undefined):
+            position = int(undefined[0])
+            raise UnicodeDecodeError(
+                self.layout.encoding,
+                block,
+                position,
+                position + 1,
+                "character maps to <undefined>",
+            )
+
+        values = []
+        for i in indices:
+            start, end = self.layout.bounds[i]
+            values.append(self._decode_column(data[:, start:end], end - start))
+        return values
+
+    def _decode_column(self, column, width):
+        """ Strips spaces from and decodes a 2D uint8 array of fixed width
+            fields, returning a 1D unicode array.
+        """
+        if width == 0:
+            return np.full(len(column), "", dtype="U1")
+        spaces = column == self.layout.space[0]
+        if not (spaces[:, :-1] & ~spaces[:, 1:]).any():
+            # Only trailing padding, which NumPy treats as string padding once
+            # blanked to NUL
+            code_points = self.code_points[column]
+            code_points[spaces] = 0
+        else:
+            # A stable sort on the space mask moves every non-space byte to
+            # the front of its row, keeping the original order
+            order = np.argsort(spaces, axis=1, kind="stable")
+            code_points = self.code_points[np.take_along_axis(column, order, axis=1)]
+            code_points[np.sort(spaces, axis=1)] = 0
+        return np.ascontiguousarray(code_points).view(f"U{width}").ravel()
+
+    def _decoding_table(self):
+        """ Returns the code point of every byte in the fixed width encoding,
+            and a mask of the bytes that the encoding leaves undefined.
+        """
+        code_points = np.zeros(256, dtype=np.uint32)
+        undefined = np.zeros(256, dtype=bool)
+        for byte in range(256):
+            try:
+                code_points[byte] = ord(bytes([byte]).decode(self.layout.encoding))
+            except UnicodeDecodeError:
+                undefined[byte] = True
+        return code_points, undefined
@@ -0,0 +1,165 @@
+"""
+Streaming compression of fixed width input and delimited output
+"""
+
+import bz2
+import gzip
+import io
+import lzma
+import os
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+# Codec of each recognised file extension
+EXTENSIONS = {".gz": "gzip", ".bz2": "bz2", ".xz": "xz"}
+
+# Values of a compression option. "auto" chooses by file extension.
+COMPRESSION_OPTIONS = {"auto", "none", "gzip", "bz2", "xz"}
+
+# Default compression level of each codec
+LEVELS = {"gzip": 6, "bz2": 9, "xz": 6}
+
+# Uncompressed bytes per independently compressed member
+DEFAULT_COMPRESSION_BLOCK_SIZE = 4 << 20
+
+
+def codec_for(filename, compression="auto"):
+    """ Returns the codec of filename, "gzip", "bz2" or "xz", or None when it
+        is not compressed. compression is one of COMPRESSION_OPTIONS.
+    """
+    if compression not in COMPRESSION_OPTIONS:
+        raise ValueError(f"Unknown compression: {compression}")
+    if compression == "auto":
+        return EXTENSIONS.get(os.path.splitext(filename)[1].lower())
+    if compression == "none":
+        return None
+    return compression
+
+
+def compress_member(codec, data, level):
+    """ Compresses data as one complete gzip member, bz2 stream or xz stream.
+    """
+    if codec == "gzip":
+        return gzip.compress(data, compresslevel=level, mtime=0)
+    if codec == "bz2":
+        return bz2.compress(data, compresslevel=level)
+    return lzma.compress(data, preset=level)
+
+
+def open_input(filename, codec=None):
+    """ Opens filename for reading in binary, decompressing it as a stream
+        when codec is given. Concatenated members are read as one stream.
+    """
+    if codec == "gzip":
+        return gzip.open(filename, "rb")
+    if codec == "bz2":
+        return bz2.open(filename, "rb")
+    if codec == "xz":
+        return lzma.open(filename, "rb")
+    return open(filename, "rb")
+
+
+def open_output(filename, codec=None, mode="wb", workers=None):
+    """ Opens filename for writing in binary, compressing the stream with
+        ParallelCompressedWriter when codec is given.
+    """
+    if codec is None:
+        return open(filename, mode)
+    return ParallelCompressedWriter(open(filename, mode), codec, workers)
+
+
+def open_text_output(filename, codec, encoding, mode="w", workers=None):
+    """ Opens filename for writing as text with newline="", as csv.writer
+        expects, compressing it when codec is given.
+    """
+    if codec is None:
+        return open(filename, mode, encoding=encoding, newline="")
+    return io.TextIOWrapper(
+        open_output(filename, codec, mode + "b", workers),
+        encoding=encoding,
+        newline="",
+    )
+
+
+class ParallelCompressedWriter(io.BufferedIOBase):
+    """ A binary file object compressing what is written to it in parallel.
+
+        Data is cut into blocks of block_size bytes, and each block is
+        compressed as an independent gzip member, bz2 stream or xz stream by a
+        pool of `workers` threads, one per CPU by default. zlib, bzip2 and
+        liblzma release the GIL, so threads use every core without copying
+        blocks to other processes. Compressed blocks are written to fileobj in
+        order; the concatenation is a valid file that gzip, bzip2 and xz, and
+        Python's own modules, decompress as one stream.
+
+        At most two blocks per worker are in flight, which bounds memory use.
+        The output is a little larger than from a single stream, as each
+        member starts with an empty dictionary. Closing the writer closes
+        fileobj.
+    """
+
+    def __init__(
+        self,
+        fileobj,
+        codec,
+        workers=None,
+        level=None,
+        block_size=DEFAULT_COMPRESSION_BLOCK_SIZE,
+    ):
+        super().__init__()
+        if codec not in LEVELS:
+            raise ValueError(f"Unknown codec: {codec}")
+        self.fileobj = fileobj
+        self.codec = codec
+        self.level = LEVELS[codec] if level is None else level
+        self.block_size = block_size
+        self.workers = workers or os.cpu_count() or 1
+        self.data = bytearray()
+        self.pending = deque()
+        self.members = 0
+        self.pool = ThreadPoolExecutor(max_workers=self.workers)
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.data += data
+        while len(self.data) >= self.block_size:
+            block = bytes(self.data[: self.block_size])
+            del self.data[: self.block_size]
+            self._submit(block)
+        return len(data)
+
+    def _submit(self, block):
+        if len(self.pending) >= 2 * self.workers:
+            self.fileobj.write(self.pending.popleft().result())
+        self.members += 1
+        self.pending.append(
+            self.pool.submit(compress_member, self.codec, block, self.level)
+        )
+
+    def flush(self):
+        """ Compresses everything written so far and writes it to fileobj.
+            Each flush ends a member, so flushing often costs compression.
+        """
+        if self.data:
+            self._submit(bytes(self.data))
+            self.data.clear()
+        while self.pending:
+            self.fileobj.write(self.pending.popleft().result())
+        self.fileobj.flush()
+
+    def fileno(self):
+        return self.fileobj.fileno()
+
+    def close(self):
+        if self.closed:
+            return
+        try:
+            if not self.members and not self.data:
+                # An empty member, so that an empty file is still valid
+                self._submit(b"")
+            super().close()
+        finally:
+            self.pool.shutdown()
+            self.fileobj.close()
@@ -3,7 +3,37 @@ Data Engineering Coding Challenge - Latitude Finance
 """
 
 import csv
+import io
 import os
+import time
+from contextlib import contextmanager
+from itertools import islice
+from operator import itemgetter
+
+from delimited_writer import compression, external_sort, parallel
+from delimited_writer.checkpoint import Checkpoint, checkpoint_filename, run_fingerprint
+from delimited_writer.column_store import ColumnStoreWriter
+from delimited_writer.follow import (
+    DEFAULT_POLL_INTERVAL,
+    FollowState,
+    RangeReader,
+    complete_end,
+    feed_newline,
+    follow_filename,
+)
+from delimited_writer.metrics import (
+    ConversionMetrics,
+    TimedReader,
+    TimedWriter,
+    profiling,
+    timed_split_line,
+    timed_split_record,
+)
+from delimited_writer.quarantine import ConversionSummary
+from delimited_writer.transcoding import Transcoder, can_transcode
+
+# Number of records buffered between the parse and write stages
+DEFAULT_BATCH_SIZE = 10000
 
 
 class DelimitedFileWriter:
@@ -24,6 +54,17 @@ class DelimitedFileWriter:
     Otherwise if delimited_newline is '\r', '\n' or '\r\n', this will the character
     written.
 
+    Large files can be converted with convert(), which streams records from
+    the parser to the writer in bounded batches instead of building the whole
+    dataset in memory first. convert_parallel() splits the file on record
+    boundaries and converts the pieces in a pool of worker processes.
+    Files that keep being appended to are converted a piece at a time by
+    convert_incremental() or follow(). convert_to_column_store() writes a
+    binary column store for analytics instead of a delimited file.
+
+    Optionally only some columns are written, and only records matching a set
+    of predicates, see __init__(). The header then lists the selected columns.
+
     The following Python documentation discusses how encoding and newlines are applicable
     to the built-in function 'open()' and 'csv.writer()' used in this class:
     https://docs.python.org/3/library/functions.html#open
@@ -33,71 +74,786 @@ class DelimitedFileWriter:
     https://docs.python.org/3/library/csv.html#module-csv
     """
 
-    def __init__(self, encoding_props):
+    def __init__(
+        self,
+        encoding_props,
+        columns=None,
+        predicates=None,
+        quarantine=None,
+        compression_workers=None,
+        instrumentation=None,
+        column_stats=None,
+        sort=None,
+    ):
+        """ columns optionally selects and orders the columns written, by name.
+            predicates is an optional list of FieldPredicate objects, from
+            delimited_writer.predicates, which a record must all match to be
+            written. Both are applied to the raw record before it is decoded.
+
+            quarantine is an optional Quarantine, from
+            delimited_writer.quarantine. When given, malformed records are
+            written to its reject file instead of aborting the run.
+
+            Compressed fixed width and delimited files are read and written as
+            streams, with the codecs chosen by encoding_props. Compressed
+            output is compressed by compression_workers threads, one per CPU
+            by default.
+
+            instrumentation is an optional Instrumentation, from
+            delimited_writer.metrics. When given, each run times its stages
+            and leaves a ConversionMetrics in metrics.
+
+            column_stats is an optional ColumnStatistics, from
+            delimited_writer.column_stats. When given, convert() profiles
+            each column written in the same pass, and saves the statistics
+            as JSON next to the delimited file.
+
+            sort is an optional ExternalSort, from
+            delimited_writer.external_sort. When given, convert() writes the
+            records sorted by its key columns, which must be among those
+            written, and optionally deduplicated, however large the file.
+
+            After each run, summary holds the ConversionSummary of the counts
+            of records read, written, filtered and rejected.
+
+            Records of a single byte encoding are formatted straight from
+            their bytes by a Transcoder, from delimited_writer.transcoding,
+            unless column_stats or sort needs their decoded fields. The
+            output is the same either way.
+        """
         self.encoding_props = encoding_props
+        self.predicates = list(predicates or [])
+        self.quarantine = quarantine
+        self.summary = ConversionSummary()
+        self.compression_workers = compression_workers
+        self.instrumentation = instrumentation
+        self.column_stats = column_stats
+        self.sort = sort
+        self.metrics = None
+        self.input_codec = compression.codec_for(
+            encoding_props.fixed_width_filename, encoding_props.fixed_width_compression
+        )
+        self.output_codec = compression.codec_for(
+            encoding_props.delimited_filename, encoding_props.delimited_compression
+        )
+
+        spec_columns = encoding_props.column_names
+        if columns is None:
+            self.column_names = list(spec_columns)
+            self.layout = encoding_props.layout
+        else:
+            self.column_names = list(columns)
+            unknown = [name for name in self.column_names if name not in spec_columns]
+            if unknown:
+                raise ValueError(f"Unknown column(s): {', '.join(unknown)}")
+            if not self.column_names:
+                raise ValueError("At least one column must be selected")
+            self.layout = encoding_props.layout.project(
+                [spec_columns.index(name) for name in self.column_names]
+            )
+
+        # Compile once here so that unknown predicate columns fail early
+        self.matches = [
+            predicate.compile(self.layout, spec_columns)
+            for predicate in self.predicates
+        ]
+        if sort is not None:
+            self.sort_columns = sort.key_columns(self.column_names)
+
+        self.transcoder = None
+        if can_transcode(self.layout) and column_stats is None and sort is None:
+            self.transcoder = Transcoder(
+                self.layout, encoding_props.delimited_encoding, self.lineterminator()
+            )
 
     def parse_fixed_width_file(self):
-        """ Parses fixed width file.
-            newline takes default value of None (Python Universal Newlines)
-            as to ensure that any occurences of '\n', '\r' & '\r\n' are converted 
-            to '\n' and then removed. This ensures independence of environment.
+        """ Parses fixed width file into a list of records.
+            Retained for callers that want the whole file in memory; the
+            records themselves are produced by iter_fixed_width_records().
+        """
+        return list(self.iter_fixed_width_records())
+
+    def iter_fixed_width_records(self, checkpoint=None, metrics=None, raw=False):
+        """ Lazily parses fixed width file, yielding one list of fields per line.
+            With raw, the raw bytes of each record are yielded instead, for
+            self.transcoder, which requires one.
+
+            For single byte encodings the file is read in binary and split on
+            the precomputed record layout, with '\n', '\r' & '\r\n' all
+            accepted as newlines, mirroring universal newlines.
+
+            Otherwise the file is split into lines on the same newlines
+            before each line is decoded, which keeps the byte offset of every
+            line for the quarantine. This ensures independence of environment.
+
+            A started Checkpoint resumes parsing at its input_offset, with its
+            counts, which requires a single byte encoding. self.input_offset
+            is kept at the offset following the last record yielded.
+
+            Given a ConversionMetrics, reading, slicing and decoding are timed.
+            Raw records are sliced and transcoded as they are written.
         """
         fixed_width_filename = self.encoding_props.fixed_width_filename
-        fixed_width_encoding = self.encoding_props.fixed_width_encoding
-        offsets = self.encoding_props.offsets
-        delimited_data = []
-
-        with open(
-            fixed_width_filename, "r", encoding=fixed_width_encoding, newline=None
-        ) as f:
-            for line in f:
-                line = line.replace("\n", "")
-                if len(line) != sum(offsets):
-                    raise ValueError("One or more fields are of incorrect length")
-                # pull out each field
-                line_data = [
-                    line[sum(offsets[0:i]) : sum(offsets[0:i]) + offset].replace(
-                        " ", ""
+        input_codec = self.input_codec
+        layout = self.layout
+        quarantine = self.quarantine
+        tolerant = quarantine is not None
+        offset = checkpoint.input_offset if checkpoint is not None else 0
+        self.input_offset = offset
+
+        if tolerant:
+            quarantine.open(checkpoint.reject_offset if offset else 0)
+        try:
+            f = compression.open_input(fixed_width_filename, input_codec)
+            if metrics is not None:
+                f = TimedReader(f, metrics)
+            if layout.single_byte:
+                if raw:
+                    # bytes() returns a record as it is, see Transcoder.check()
+                    split = self.transcoder.check if tolerant else bytes
+                else:
+                    split = layout.split_record
+                    if metrics is not None:
+                        split = timed_split_record(layout, metrics)
+                with f:
+                    f.seek(offset)
+                    lines = layout.scan(f, tolerant, offset=offset)
+                    yield from self.parse_lines(lines, split, checkpoint)
+            else:
+                if offset:
+                    f.close()
+                    raise ValueError(
+                        "Resuming requires a single byte fixed width encoding"
                     )
-                    for i, offset in enumerate(offsets)
-                ]
-                delimited_data.append(line_data)
-        return delimited_data
+                split = self.split_line
+                if metrics is not None:
+                    metrics.text_mode = True
+                    split = timed_split_line(split, metrics)
+                # Undecodable bytes are escaped in tolerant mode, so that the
+                # line can be rejected on its own rather than ending the run
+                with f:
+                    yield from self.parse_lines(layout.scan_lines(f, tolerant), split)
+        finally:
+            if tolerant:
+                quarantine.close()
+
+    def split_line(self, line):
+        """ Splits a decoded line, first checking that it holds no bytes
+            escaped by a tolerant run because they could not be decoded.
+        """
+        if self.quarantine is not None:
+            line.encode(self.encoding_props.fixed_width_encoding)
+        return self.layout.split_line(line)
 
-    def generate_delimited_file(self, delimited_data):
+    def parse_lines(self, lines, split, checkpoint=None):
+        """ Splits each (byte offset, line, next offset) from lines into
+            fields, after applying the predicates, and yields the records to
+            be written. Malformed lines are passed to the quarantine, if there
+            is one. self.summary is kept up to date as records are yielded,
+            continuing from the counts of checkpoint when given.
+        """
+        record_length = self.layout.record_length
+        encoding = self.encoding_props.fixed_width_encoding
+        matches = self.matches
+        quarantine = self.quarantine
+        summary = self.summary = ConversionSummary()
+        if checkpoint is not None:
+            checkpoint.restore(summary)
+        # Counted in locals, which is cheaper per line, and copied to summary
+        # with the input offset at each yield so a checkpoint taken between
+        # records is consistent
+        read = summary.records_read
+        written = summary.records_written
+        filtered = summary.records_filtered
+
+        try:
+            for offset, line, next_offset in lines:
+                read += 1
+                reason = None
+                if len(line) != record_length:
+                    reason = "One or more fields are of incorrect length"
+                elif matches and not all(match(line) for match in matches):
+                    filtered += 1
+                    continue
+                else:
+                    try:
+                        fields = split(line)
+                    except UnicodeError as error:
+                        if quarantine is None:
+                            raise
+                        reason = f"Cannot be decoded: {error.reason}"
+
+                if reason is not None:
+                    summary.records_read = read
+                    quarantine.reject(summary, read, offset, line, encoding, reason)
+                    continue
+                written += 1
+                summary.records_read = read
+                summary.records_written = written
+                summary.records_filtered = filtered
+                self.input_offset = next_offset
+                yield fields
+        finally:
+            summary.records_read = read
+            summary.records_written = written
+            summary.records_filtered = filtered
+
+        if quarantine is not None:
+            quarantine.check_error_rate(summary)
+
+    def generate_delimited_file(
+        self, delimited_data, batch_size=DEFAULT_BATCH_SIZE, metrics=None, raw=False
+    ):
         """ Write the generated delimited data to file. 
             Built-in function, 'open()', is called in text mode, ensuring that 
             data is writted with encoding=delimited_encoding. With newline="", 
             it is ensured that 'open()' will not interfere with how csv.writer
             writes newline characters.
 
+            delimited_data may be any iterable of records, including the
+            generator returned by iter_fixed_width_records(). Records are
+            written batch_size at a time, so at most one batch is held in
+            memory. Given a ConversionMetrics, CSV formatting and writing are
+            timed, as is pulling each batch from delimited_data. Column
+            statistics, if collected, are counted as CSV formatting.
+
+            With raw, delimited_data holds raw records, as yielded by
+            iter_fixed_width_records(raw=True), which self.transcoder formats.
+
             See documentation for details:
             "Footnotes"
             https://docs.python.org/3/library/csv.html#id3
         """
-        delimited_filename = self.encoding_props.delimited_filename
-        delimited_encoding = self.encoding_props.delimited_encoding
-        delimited_newline = self.encoding_props.delimited_newline
-        include_header = self.encoding_props.include_header
-
-        with open(
-            delimited_filename, "w", encoding=delimited_encoding, newline=""
-        ) as f:
-            # Ensure that newline behaviour is as described in class docstrings
-            if delimited_newline in {None, ""}:
-                delimited_newline = os.linesep
-            elif delimited_newline == "\n":
-                pass
-            elif delimited_newline == "\r":
-                pass
-            elif delimited_newline == "\r\n":
-                pass
-
-            writer = csv.writer(f, delimiter=",", lineterminator=delimited_newline)
+        if batch_size < 1:
+            raise ValueError(f"batch_size must be positive, got {batch_size}")
+
+        column_stats = self.column_stats
+        if column_stats is not None:
+            layout = self.layout
+            widths = [layout.offsets[i] for i in layout.columns]
+            column_stats.start(self.column_names, widths)
+        with self.open_delimited_file(metrics=metrics) as f:
+            writer = self.record_writer(f, raw, metrics)
             # Write the header out, if required
-            if include_header is True:
-                header = self.encoding_props.column_names
+            if self.encoding_props.include_header is True:
+                header = self.column_names
                 writer.writerow(header)
-            # Write out data
-            for line in delimited_data:
-                writer.writerow(line)
+            self.write_batches(writer, delimited_data, batch_size, metrics)
+        if column_stats is not None:
+            column_stats.save(self.encoding_props.delimited_filename)
+
+    def generate_column_store(
+        self,
+        records,
+        directory,
+        batch_size=DEFAULT_BATCH_SIZE,
+        metrics=None,
+        raw=False,
+    ):
+        """ Writes records, as for generate_delimited_file(), to a column
+            store in directory instead: one file, or an offsets and a data
+            file, per column written, and a JSON manifest. The store is read
+            by ColumnStoreReader, see delimited_writer.column_store. Raw
+            records are transcoded by self.transcoder.
+
+            Given a ConversionMetrics, encoding the values counts as CSV
+            formatting, and the writes of the column files are included. Raw
+            records are timed as slice and decode while transcoded.
+        """
+        if batch_size < 1:
+            raise ValueError(f"batch_size must be positive, got {batch_size}")
+        if self.column_stats is not None:
+            raise ValueError("Column statistics are collected by convert()")
+        layout = self.layout
+        widths = [layout.offsets[i] for i in layout.columns]
+        transcoder = self.transcoder if raw else None
+        with ColumnStoreWriter(
+            directory, self.column_names, widths, transcoder, metrics
+        ) as writer:
+            self.write_batches(writer, records, batch_size, metrics)
+        if metrics is not None:
+            metrics.bytes_written = writer.bytes_written
+
+    def write_batches(self, writer, records, batch_size, metrics=None, written=None):
+        """ Writes out records, one bounded batch at a time, with csv.writer
+            writer. written, if given, is called after each batch with its
+            length. Batches are timed when given a ConversionMetrics.
+        """
+        records = iter(records)
+        column_stats = self.column_stats
+        clock = time.perf_counter
+        while True:
+            start = clock()
+            batch = list(islice(records, batch_size))
+            parsed = clock()
+            if not batch:
+                break
+            writer.writerows(batch)
+            if column_stats is not None:
+                column_stats.add(batch)
+            if metrics is not None:
+                metrics.add_parse(parsed - start)
+                metrics.add_csv(clock() - parsed)
+            if written is not None:
+                written(len(batch))
+        if metrics is not None:
+            metrics.add_parse(parsed - start)
+
+    def record_writer(self, f, raw=False, metrics=None):
+        """ Returns a writer of records to the delimited file object f: a
+            csv.writer, or with raw a TranscodingWriter of raw records to the
+            binary file under f, timing its stages in metrics when given.
+        """
+        if raw:
+            return self.transcoder.writer(f.buffer, metrics)
+        return self.csv_writer(f)
+
+    def csv_writer(self, f):
+        """ Returns a csv.writer for the delimited file object f.
+        """
+        return csv.writer(f, delimiter=",", lineterminator=self.lineterminator())
+
+    def lineterminator(self):
+        """ Returns the newline written after each delimited record.
+        """
+        delimited_newline = self.encoding_props.delimited_newline
+        # Ensure that newline behaviour is as described in class docstrings
+        if delimited_newline in {None, ""}:
+            delimited_newline = os.linesep
+        elif delimited_newline == "\n":
+            pass
+        elif delimited_newline == "\r":
+            pass
+        elif delimited_newline == "\r\n":
+            pass
+
+        return delimited_newline
+
+    def open_delimited_file(self, mode="w", metrics=None):
+        """ Opens the delimited file for writing as text, compressing it as a
+            stream when the delimited compression calls for it. Given a
+            ConversionMetrics, writes to the file are timed.
+        """
+        if metrics is None:
+            return compression.open_text_output(
+                self.encoding_props.delimited_filename,
+                self.output_codec,
+                self.encoding_props.delimited_encoding,
+                mode,
+                self.compression_workers,
+            )
+        f = compression.open_output(
+            self.encoding_props.delimited_filename,
+            self.output_codec,
+            mode + "b",
+            self.compression_workers,
+        )
+        return io.TextIOWrapper(
+            TimedWriter(f, metrics),
+            encoding=self.encoding_props.delimited_encoding,
+            newline="",
+        )
+
+    @contextmanager
+    def instrumented(self):
+        """ Wraps a run, yielding its ConversionMetrics, or None when this
+            writer has no Instrumentation. The run is profiled if the
+            Instrumentation, or the environment, asks for it.
+        """
+        instrumentation = self.instrumentation
+        profile = instrumentation.profile if instrumentation is not None else None
+        metrics = ConversionMetrics() if instrumentation is not None else None
+        start = time.perf_counter()
+        with profiling(profile):
+            yield metrics
+        if metrics is not None:
+            metrics.finish(time.perf_counter() - start, self.summary)
+            self.metrics = metrics
+            instrumentation.publish(metrics)
+
+    def fingerprint(self, mode, **options):
+        """ Returns the run_fingerprint of a conversion by this writer.
+        """
+        quarantine = self.quarantine
+        return run_fingerprint(
+            self.encoding_props,
+            mode,
+            columns=self.column_names,
+            predicates=self.predicates,
+            quarantine=quarantine and quarantine.reject_filename,
+            **options,
+        )
+
+    def convert(self, batch_size=DEFAULT_BATCH_SIZE, checkpoint_every=None):
+        """ Streams the fixed width file straight into the delimited file.
+            The parse stage is a generator feeding the batched write stage,
+            so memory use is bounded by batch_size rather than file size.
+            Returns the ConversionSummary of the run.
+
+            With checkpoint_every, a Checkpoint is saved next to the
+            delimited file after every batch once that many records have been
+            written since the last one, and an interrupted run called again
+            with the same settings resumes from it. Requires a single byte
+            fixed width encoding. The checkpoint is removed on success.
+
+            With an ExternalSort, records are written in key order once the
+            whole file has been read, see iter_sorted_records().
+
+            With an Instrumentation, the run's ConversionMetrics is left in
+            self.metrics.
+        """
+        with self.instrumented() as metrics:
+            if checkpoint_every is None:
+                raw = self.transcoder is not None
+                if self.sort is None:
+                    records = self.iter_fixed_width_records(metrics=metrics, raw=raw)
+                else:
+                    records = self.iter_sorted_records(metrics)
+                self.generate_delimited_file(records, batch_size, metrics, raw)
+            else:
+                self.convert_resumable(batch_size, checkpoint_every, metrics)
+        return self.summary
+
+    def convert_to_column_store(self, directory, batch_size=DEFAULT_BATCH_SIZE):
+        """ Streams the fixed width file into a column store in directory,
+            as convert() does into the delimited file, which is not written.
+            Records are sorted first when the writer has an ExternalSort.
+            Returns the ConversionSummary of the run.
+        """
+        with self.instrumented() as metrics:
+            raw = self.transcoder is not None
+            if self.sort is None:
+                records = self.iter_fixed_width_records(metrics=metrics, raw=raw)
+            else:
+                records = self.iter_sorted_records(metrics)
+            self.generate_column_store(records, directory, batch_size, metrics, raw)
+        return self.summary
+
+    def iter_sorted_records(self, metrics=None):
+        """ Yields the records of the fixed width file sorted, and optionally
+            deduplicated, by self.sort.
+
+            Sorted runs are built by the sort's worker processes when the file
+            can be split between them, as for convert_parallel(), and
+            otherwise as the file is parsed. The runs are then merged. At the
+            end self.summary counts the records written after deduplication
+            and those dropped as duplicates.
+        """
+        sort = self.sort
+        key = itemgetter(*self.sort_columns)
+        in_parallel = (
+            sort.workers > 1
+            and self.layout.single_byte
+            and self.input_codec is None
+            and self.quarantine is None
+        )
+        with sort.run_directory(self.encoding_props.delimited_filename) as directory:
+            if in_parallel:
+                runs, read, sorted_count = external_sort.sorted_runs_parallel(
+                    sort,
+                    self.encoding_props,
+                    self.layout,
+                    self.predicates,
+                    self.sort_columns,
+                    directory,
+                )
+                summary = self.summary = ConversionSummary()
+                summary.records_read = read
+                summary.records_filtered = read - sorted_count
+            else:
+                records = self.iter_fixed_width_records(metrics=metrics)
+                runs = list(
+                    sort.build_runs(records, key, sort.memory_budget, directory)
+                )
+                summary = self.summary
+                sorted_count = summary.records_written
+
+            written = 0
+            try:
+                for record in sort.merge(runs, key, directory):
+                    written += 1
+                    yield record
+            finally:
+                summary.records_written = written
+                summary.records_duplicate = sorted_count - written
+
+    def convert_resumable(self, batch_size, checkpoint_every, metrics=None):
+        """ Runs convert() with checkpoints every checkpoint_every records.
+        """
+        if batch_size < 1:
+            raise ValueError(f"batch_size must be positive, got {batch_size}")
+        if checkpoint_every < 1:
+            raise ValueError(
+                f"checkpoint_every must be positive, got {checkpoint_every}"
+            )
+        if not self.layout.single_byte:
+            raise ValueError("Checkpoints require a single byte fixed width encoding")
+        if self.column_stats is not None or self.sort is not None:
+            raise ValueError(
+                "Column statistics and sorting cannot be resumed from a checkpoint"
+            )
+        if self.input_codec or self.output_codec:
+            raise ValueError("Checkpoints require uncompressed files")
+
+        fixed_width_filename = self.encoding_props.fixed_width_filename
+        delimited_filename = self.encoding_props.delimited_filename
+        fingerprint = self.fingerprint("stream")
+        checkpoint = Checkpoint.load(
+            checkpoint_filename(delimited_filename), fingerprint
+        )
+        checkpoint.verify(fingerprint, fixed_width_filename, delimited_filename)
+
+        if checkpoint.started:
+            # Drop anything written after the checkpoint by the interrupted run
+            os.truncate(delimited_filename, checkpoint.output_offset)
+        raw = self.transcoder is not None
+        records = self.iter_fixed_width_records(checkpoint, metrics, raw)
+        mode = "a" if checkpoint.started else "w"
+        with self.open_delimited_file(mode, metrics) as f:
+            writer = self.record_writer(f, raw, metrics)
+            if self.encoding_props.include_header is True and not checkpoint.started:
+                writer.writerow(self.column_names)
+            unsaved = 0
+
+            def written(count):
+                nonlocal unsaved
+                unsaved += count
+                if unsaved >= checkpoint_every:
+                    self.save_checkpoint(checkpoint, f)
+                    unsaved = 0
+
+            self.write_batches(writer, records, batch_size, metrics, written)
+        checkpoint.remove()
+
+    def save_checkpoint(self, checkpoint, f):
+        """ Syncs the delimited file object f, and the reject file, to disk
+            and saves checkpoint at the last record written.
+        """
+        f.flush()
+        os.fsync(f.fileno())
+        reject_offset = self.quarantine.sync() if self.quarantine is not None else 0
+        output_offset = f.buffer.tell()
+        checkpoint.update(self.summary, self.input_offset, output_offset, reject_offset)
+        checkpoint.save(
+            self.encoding_props.fixed_width_filename,
+            self.encoding_props.delimited_filename,
+        )
+
+    def convert_parallel(
+        self, workers=None, batch_size=DEFAULT_BATCH_SIZE, checkpoint_every=None
+    ):
+        """ Converts the file using `workers` processes, one per CPU by default.
+            Requires a single byte fixed width encoding, and that every line
+            uses the same newline, which is detected from the first record.
+            Returns the ConversionSummary of the run.
+
+            With checkpoint_every, the file is split into chunks of at most
+            that many records and a Checkpoint is saved as each chunk is
+            appended to the delimited file, so that an interrupted run called
+            again with the same settings skips the chunks already done.
+
+            With an Instrumentation, only the totals of the run are measured
+            in self.metrics, as its stages run in the worker processes.
+        """
+        if batch_size < 1:
+            raise ValueError(f"batch_size must be positive, got {batch_size}")
+        if self.quarantine is not None:
+            raise ValueError(
+                "Quarantine requires convert(), as malformed records break the "
+                "fixed record positions that convert_parallel() relies on"
+            )
+        if self.input_codec is not None:
+            raise ValueError(
+                "Parallel conversion requires an uncompressed fixed width file, "
+                "use convert() to stream a compressed one"
+            )
+        if self.column_stats is not None or self.sort is not None:
+            raise ValueError(
+                "Column statistics and sorting require convert(), as the "
+                "records of convert_parallel() are written by the workers"
+            )
+        checkpoint = None
+        if checkpoint_every is not None:
+            if self.output_codec is not None:
+                raise ValueError("Checkpoints require uncompressed files")
+            if checkpoint_every < 1:
+                raise ValueError(
+                    f"checkpoint_every must be positive, got {checkpoint_every}"
+                )
+            delimited_filename = self.encoding_props.delimited_filename
+            fingerprint = self.fingerprint(
+                "parallel",
+                input_size=os.path.getsize(self.encoding_props.fixed_width_filename),
+                checkpoint_every=checkpoint_every,
+            )
+            checkpoint = Checkpoint.load(
+                checkpoint_filename(delimited_filename), fingerprint
+            )
+            checkpoint.verify(
+                fingerprint,
+                self.encoding_props.fixed_width_filename,
+                delimited_filename,
+            )
+        with self.instrumented() as metrics:
+            self.summary = parallel.convert_parallel(
+                self.encoding_props,
+                self.layout,
+                self.column_names,
+                self.predicates,
+                workers,
+                batch_size,
+                checkpoint,
+                checkpoint_every,
+                self.output_codec,
+                self.compression_workers,
+            )
+            if metrics is not None:
+                metrics.bytes_read = os.path.getsize(
+                    self.encoding_props.fixed_width_filename
+                )
+                metrics.bytes_written = os.path.getsize(
+                    self.encoding_props.delimited_filename
+                )
+        if checkpoint is not None:
+            checkpoint.remove()
+        return self.summary
+
+    def convert_incremental(self, batch_size=DEFAULT_BATCH_SIZE):
+        """ Appends the records added to the fixed width file since the last
+            call to the delimited file, reading only the new data. The first
+            call converts the whole file. Returns the ConversionSummary of the
+            records read by this call.
+
+            The offset reached and the identity of the file are kept in a
+            FollowState next to the delimited file. A trailing record that is
+            still being written, i.e. not yet followed by a newline, is left
+            for a later call. When the fixed width file has been rotated, the
+            rest of the rotated file is converted before the new file. See
+            delimited_writer.follow.
+
+            Requires a single byte fixed width encoding and uncompressed files.
+        """
+        if batch_size < 1:
+            raise ValueError(f"batch_size must be positive, got {batch_size}")
+        if not self.layout.single_byte:
+            raise ValueError("Following requires a single byte fixed width encoding")
+        if self.input_codec or self.output_codec:
+            raise ValueError("Following requires uncompressed files")
+        if self.column_stats is not None or self.sort is not None:
+            raise ValueError("Column statistics and sorting require convert()")
+
+        delimited_filename = self.encoding_props.delimited_filename
+        fingerprint = self.fingerprint("follow")
+        state = FollowState.load(follow_filename(delimited_filename), fingerprint)
+        state.verify(fingerprint, delimited_filename)
+        sources = state.sources(self.encoding_props.fixed_width_filename)
+
+        with self.instrumented() as metrics:
+            self.summary = self.follow_sources(state, sources, batch_size, metrics)
+        state.save(delimited_filename)
+        return self.summary
+
+    def follow_sources(self, state, sources, batch_size, metrics=None):
+        """ Converts each (filename, start, final) of sources in turn, as
+            given by FollowState.sources(), advancing state past each one.
+            Returns the ConversionSummary of the records read.
+        """
+        quarantine = self.quarantine
+        tolerant = quarantine is not None
+        layout = self.layout
+        raw = self.transcoder is not None
+        if raw:
+            split = self.transcoder.check if tolerant else bytes
+        else:
+            split = layout.split_record
+            if metrics is not None:
+                split = timed_split_record(layout, metrics)
+        total = ConversionSummary()
+
+        if state.started:
+            # Drop anything written after the last run by an interrupted one
+            os.truncate(self.encoding_props.delimited_filename, state.output_offset)
+        if tolerant:
+            quarantine.open(state.reject_offset)
+        try:
+            mode = "a" if state.started else "w"
+            with self.open_delimited_file(mode, metrics) as f:
+                writer = self.record_writer(f, raw, metrics)
+                if self.encoding_props.include_header is True and not state.started:
+                    writer.writerow(self.column_names)
+
+                for filename, start, final in sources:
+                    if start == 0:
+                        state.forget_input()
+                    with open(filename, "rb") as source:
+                        size = source.seek(0, os.SEEK_END)
+                        end = size
+                        if not final:
+                            newline = feed_newline(source, size, layout)
+                            end = complete_end(source, start, size, newline, layout)
+                        source.seek(start)
+                        reader = RangeReader(source, end)
+                        if metrics is not None:
+                            reader = TimedReader(reader, metrics)
+                        lines = layout.scan(reader, tolerant, offset=start)
+                        records = self.parse_lines(lines, split, state)
+                        self.write_batches(writer, records, batch_size, metrics)
+                        # The summary continues from the counts of state
+                        previous = ConversionSummary()
+                        state.restore(previous)
+                        total.add(self.summary, previous)
+                        state.advance(source, end, self.summary)
+                    if final:
+                        state.forget_input()
+
+                f.flush()
+                os.fsync(f.fileno())
+                state.output_offset = f.buffer.tell()
+        finally:
+            if tolerant:
+                quarantine.close()
+        if tolerant:
+            state.reject_offset = os.path.getsize(quarantine.reject_filename)
+        return total
+
+    def follow(
+        self,
+        poll_interval=DEFAULT_POLL_INTERVAL,
+        idle_timeout=None,
+        batch_size=DEFAULT_BATCH_SIZE,
+        callback=None,
+    ):
+        """ Keeps converting the fixed width file as it grows, with
+            convert_incremental(), checking it for changes every poll_interval
+            seconds. callback, if given, is called with the ConversionSummary
+            of each run.
+
+            Stops once the file has not changed for idle_timeout seconds, or
+            never when it is None, and returns the ConversionSummary of all
+            the records read.
+        """
+        fixed_width_filename = self.encoding_props.fixed_width_filename
+        total = ConversionSummary()
+        seen = None
+        last_change = time.monotonic()
+        while True:
+            try:
+                stat = os.stat(fixed_width_filename)
+                current = (stat.st_ino, stat.st_size, stat.st_mtime_ns)
+            except FileNotFoundError:
+                # Between rotating the file and creating the next one
+                current = None
+            if current != seen:
+                seen = current
+                last_change = time.monotonic()
+                if current is not None or os.path.exists(
+                    follow_filename(self.encoding_props.delimited_filename)
+                ):
+                    summary = self.convert_incremental(batch_size)
+                    total.add(summary)
+                    if callback is not None:
+                        callback(summary)
+            elif idle_timeout is not None:
+                if time.monotonic() - last_change >= idle_timeout:
+                    return total
+            time.sleep(poll_interval)
@@ -1,11 +1,48 @@
+import copy
 import json
 
+from delimited_writer.compression import COMPRESSION_OPTIONS
+from delimited_writer.record_layout import RecordLayout
+
+# Fixed width encodings accepted in 'spec.json', and the Python codec of each.
+# Code pages listed in record_layout.SINGLE_BYTE_ENCODINGS are parsed from
+# bytes, and transcoded to the delimited encoding without decoding them to
+# str where possible. Others, such as utf-8, are decoded as text.
+FIXED_WIDTH_ENCODINGS = {
+    "windows-1252": "cp1252",
+    "windows-1250": "cp1250",
+    "latin-1": "latin-1",
+    "iso-8859-1": "latin-1",
+    "cp437": "cp437",
+    "cp037": "cp037",
+    "cp500": "cp500",
+    "utf-8": "UTF-8",
+}
+
+# Delimited encodings accepted in 'spec.json', and the Python codec of each
+DELIMITED_ENCODINGS = {"utf-8": "UTF-8"}
+
 
 class EncodingProperties:
     """ A class for holding the encoding properties provided in 'spec.json' and
         raising exceptions for invalid specs.
         Input & output filenames and the desired output newline character are
         also stored.
+        Once validated, the offsets are compiled into a RecordLayout, 'layout',
+        which parsers share rather than recomputing column positions.
+
+        spec may be given as an already parsed 'spec.json', in which case
+        spec_filename is only kept for reference.
+
+        'FixedWidthEncoding' is one of FIXED_WIDTH_ENCODINGS, e.g.
+        "windows-1252", "latin-1" or the EBCDIC "cp037", and
+        'DelimitedEncoding' one of DELIMITED_ENCODINGS. Further encodings are
+        supported by adding them to these tables.
+
+        The optional spec keys 'FixedWidthCompression' and
+        'DelimitedCompression' are one of "auto", the default, which chooses
+        the codec by file extension (.gz, .bz2 or .xz), "none", "gzip", "bz2"
+        or "xz".
     """
 
     def __init__(
@@ -14,6 +51,7 @@ class EncodingProperties:
         fixed_width_filename,
         delimited_filename,
         delimited_newline=None,
+        spec=None,
     ):
 
         self.spec_filename = spec_filename
@@ -25,10 +63,14 @@ class EncodingProperties:
         self.fixed_width_encoding = ""
         self.delimited_encoding = ""
         self.include_header = False
+        self.fixed_width_compression = "auto"
+        self.delimited_compression = "auto"
+        self.layout = None
 
-        # Load spec file
-        with open(spec_filename, "r") as spec_file:
-            spec = json.load(spec_file)
+        # Load spec file, unless it has already been parsed
+        if spec is None:
+            with open(spec_filename, "r") as spec_file:
+                spec = json.load(spec_file)
 
         # Raise exception for illegal delimited_newline character
         if delimited_newline not in {None, "", "\n", "\r\n", "\r"}:
@@ -48,18 +90,42 @@ class EncodingProperties:
 
         # Reject specs with unrecognised fixed width encoding
         fixed_width_encoding = spec["FixedWidthEncoding"]
-        if fixed_width_encoding != "windows-1252":
+        if fixed_width_encoding not in FIXED_WIDTH_ENCODINGS:
             raise ValueError(
                 f"{fixed_width_encoding} is either not a valid encoding, or it has not been implemented."
             )
         else:
-            self.fixed_width_encoding = "cp1252"
+            self.fixed_width_encoding = FIXED_WIDTH_ENCODINGS[fixed_width_encoding]
 
         # Reject specs with unrecognised delimited encoding
         delimited_encoding = spec["DelimitedEncoding"]
-        if delimited_encoding != "utf-8":
+        if delimited_encoding not in DELIMITED_ENCODINGS:
             raise ValueError(
                 f"{delimited_encoding} is either not a valid encoding or it has not been implemented."
             )
         else:
-            self.delimited_encoding = "UTF-8"
+            self.delimited_encoding = DELIMITED_ENCODINGS[delimited_encoding]
+
+        # Reject unrecognised compression options
+        self.fixed_width_compression = spec.get("FixedWidthCompression", "auto")
+        self.delimited_compression = spec.get("DelimitedCompression", "auto")
+        for compression in [self.fixed_width_compression, self.delimited_compression]:
+            if compression not in COMPRESSION_OPTIONS:
+                raise ValueError(f"{compression} is not a valid compression.")
+
+        # Compile the column positions once for use by the parsers
+        self.layout = RecordLayout(self.offsets, self.fixed_width_encoding)
+
+    def for_files(
+        self, fixed_width_filename, delimited_filename, delimited_newline=None
+    ):
+        """ Returns a copy of these properties for other input and output files,
+            sharing the validated spec and its layout.
+        """
+        if delimited_newline not in {None, "", "\n", "\r\n", "\r"}:
+            raise ValueError(f"Illegal newline value: {delimited_newline}")
+        encoding_props = copy.copy(self)
+        encoding_props.fixed_width_filename = fixed_width_filename
+        encoding_props.delimited_filename = delimited_filename
+        encoding_props.delimited_newline = delimited_newline
+        return encoding_props
@@ -0,0 +1,278 @@
+"""
+External sort and deduplication of records by key columns
+"""
+
+import heapq
+import os
+import pickle
+import shutil
+import sys
+import tempfile
+from collections import deque, namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from itertools import groupby, islice
+from operator import itemgetter
+
+from delimited_writer.parallel import iter_chunk_records, plan_chunks
+
+# Records held in memory by the sort runs, across all workers
+DEFAULT_MEMORY_BUDGET = 256 << 20
+
+# Values of ExternalSort's keep, None keeping every record
+KEEP_OPTIONS = {None, "first", "last"}
+
+# Records pickled together in a run file, and so read at once when merging
+FRAME_RECORDS = 1024
+
+# Records added to a run between estimates of its memory use
+SIZE_SAMPLE = 1024
+
+# Runs merged at once. More are first merged in groups into longer runs, so
+# that merging never holds more than this many frames.
+MAX_MERGE_RUNS = 128
+
+# A contiguous range of records for a worker to sort into runs
+SortTask = namedtuple(
+    "SortTask",
+    [
+        "fixed_width_filename",
+        "layout",
+        "column_names",
+        "predicates",
+        "newline",
+        "first_record",
+        "record_count",
+        "sort",
+        "key_columns",
+        "memory_budget",
+        "directory",
+    ],
+)
+
+
+def record_size(record):
+    """ Returns an estimate of the memory used by a record in a run.
+    """
+    return sys.getsizeof(record) + sum(map(sys.getsizeof, record)) + 8
+
+
+def deduplicate(records, key, keep):
+    """ Yields records, sorted by key, keeping only the first or last of each
+        run of equal keys, or every record when keep is None.
+    """
+    if keep is None:
+        yield from records
+    elif keep == "first":
+        for _, group in groupby(records, key):
+            yield next(group)
+    else:
+        for _, group in groupby(records, key):
+            yield deque(group, maxlen=1)[0]
+
+
+def spill(records, directory):
+    """ Writes records to a new run file in directory, FRAME_RECORDS to a
+        pickle, and returns its filename.
+    """
+    descriptor, filename = tempfile.mkstemp(suffix=".run", dir=directory)
+    with open(descriptor, "wb") as f:
+        records = iter(records)
+        while True:
+            frame = list(islice(records, FRAME_RECORDS))
+            if not frame:
+                break
+            pickle.dump(frame, f, pickle.HIGHEST_PROTOCOL)
+    return filename
+
+
+def read_run(run):
+    """ Yields the records of a run, a run file read a frame at a time or a
+        list of records still in memory.
+    """
+    if isinstance(run, list):
+        yield from run
+        return
+    with open(run, "rb") as f:
+        while True:
+            try:
+                frame = pickle.load(f)
+            except EOFError:
+                return
+            yield from frame
+
+
+class ExternalSort:
+    """ Sorts the records of a conversion by the key columns, in order of
+        precedence, and optionally keeps only the first or last record of
+        each key, in file order. Keys compare as the text written.
+
+        Files larger than memory are sorted in runs of at most memory_budget
+        bytes of records, which are spilled to run files in
+        temporary_directory, by default the directory of the delimited file
+        rather than a /tmp that may itself be held in memory. The runs are
+        then merged into the delimited file. Both sorting and deduplication
+        are stable, so equal keys keep their order in the file.
+
+        Runs are built by `workers` processes, one per CPU by default, each
+        reading its own range of the fixed width file, which requires a
+        single byte encoding, an uncompressed file and no quarantine.
+        Otherwise, or with one worker, runs are built as the file is parsed.
+    """
+
+    def __init__(
+        self,
+        keys,
+        keep=None,
+        memory_budget=DEFAULT_MEMORY_BUDGET,
+        workers=None,
+        temporary_directory=None,
+    ):
+        self.keys = list(keys)
+        if not self.keys:
+            raise ValueError("At least one sort key must be given")
+        if keep not in KEEP_OPTIONS:
+            raise ValueError(f"keep must be 'first', 'last' or None, got {keep}")
+        if memory_budget < 1:
+            raise ValueError(f"memory_budget must be positive, got {memory_budget}")
+        self.keep = keep
+        self.memory_budget = memory_budget
+        self.workers = workers or os.cpu_count() or 1
+        self.temporary_directory = temporary_directory
+
+    @contextmanager
+    def run_directory(self, delimited_filename):
+        """ Creates a directory for the run files of one sort, and removes it
+            with any runs left in it afterwards.
+        """
+        parent = self.temporary_directory
+        if parent is None:
+            parent = os.path.dirname(os.path.abspath(delimited_filename))
+        directory = tempfile.mkdtemp(prefix=".sort-", dir=parent)
+        try:
+            yield directory
+        finally:
+            shutil.rmtree(directory, ignore_errors=True)
+
+    def key_columns(self, column_names):
+        """ Returns the positions of the keys among column_names, the columns
+            written.
+        """
+        unknown = [key for key in self.keys if key not in column_names]
+        if unknown:
+            raise ValueError(f"Sort key(s) not written: {', '.join(unknown)}")
+        return [column_names.index(key) for key in self.keys]
+
+    def build_runs(self, records, key, memory_budget, directory):
+        """ Sorts records into runs of at most memory_budget bytes, yielding
+            the filename of each run spilled to directory. The final run is
+            yielded as a list instead, as it can be merged from memory.
+        """
+        records = iter(records)
+        run = []
+        used = 0
+        sample = list(islice(records, SIZE_SAMPLE))
+        while sample:
+            run += sample
+            used += len(sample) * record_size(sample[0])
+            sample = list(islice(records, SIZE_SAMPLE))
+            if used >= memory_budget and sample:
+                run.sort(key=key)
+                yield spill(deduplicate(run, key, self.keep), directory)
+                run = []
+                used = 0
+        run.sort(key=key)
+        yield list(deduplicate(run, key, self.keep))
+
+    def merge(self, runs, key, directory):
+        """ Yields the records of the sorted runs, given in file order, in key
+            order and deduplicated. Run files merged into longer runs are
+            removed as soon as they are merged.
+        """
+        while len(runs) > MAX_MERGE_RUNS:
+            merged = []
+            for i in range(0, len(runs), MAX_MERGE_RUNS):
+                group = runs[i : i + MAX_MERGE_RUNS]
+                records = heapq.merge(*map(read_run, group), key=key)
+                merged.append(spill(deduplicate(records, key, self.keep), directory))
+                for run in group:
+                    if not isinstance(run, list):
+                        os.remove(run)
+            runs = merged
+        records = heapq.merge(*map(read_run, runs), key=key)
+        yield from deduplicate(records, key, self.keep)
+
+
+def sort_chunk(task):
+    """ Worker entry point. Sorts one chunk of the fixed width file into run
+        files, returning their filenames and the number of records that
+        matched the predicates.
+    """
+    layout = task.layout
+    matches = [
+        predicate.compile(layout, task.column_names) for predicate in task.predicates
+    ]
+    key = itemgetter(*task.key_columns)
+    parsed = 0
+
+    def records(f):
+        nonlocal parsed
+        for record in iter_chunk_records(
+            f,
+            layout,
+            task.newline,
+            task.first_record,
+            task.record_count,
+            SIZE_SAMPLE,
+        ):
+            if all(match(record) for match in matches):
+                parsed += 1
+                yield layout.split_record(record)
+
+    runs = []
+    with open(task.fixed_width_filename, "rb") as f:
+        for run in task.sort.build_runs(
+            records(f), key, task.memory_budget, task.directory
+        ):
+            if isinstance(run, list):
+                run = spill(run, task.directory)
+            runs.append(run)
+    return runs, parsed
+
+
+def sorted_runs_parallel(
+    sort, encoding_props, layout, predicates, key_columns, directory
+):
+    """ Builds the sorted runs of the fixed width file in a pool of
+        sort.workers processes, each sorting one range of records. Returns
+        the runs, in file order, and the counts of records read and of
+        records that matched the predicates.
+    """
+    fixed_width_filename = encoding_props.fixed_width_filename
+    with open(fixed_width_filename, "rb") as f:
+        newline = layout.detect_newline(f)
+        record_count = layout.count_records(os.fstat(f.fileno()).st_size, newline)
+    tasks = [
+        SortTask(
+            fixed_width_filename,
+            layout,
+            encoding_props.column_names,
+            predicates,
+            newline,
+            first,
+            count,
+            sort,
+            key_columns,
+            max(1, sort.memory_budget // sort.workers),
+            directory,
+        )
+        for first, count in plan_chunks(record_count, sort.workers)
+    ]
+    runs = []
+    parsed = 0
+    with ProcessPoolExecutor(max_workers=sort.workers) as pool:
+        for chunk_runs, chunk_parsed in pool.map(sort_chunk, tasks):
+            runs += chunk_runs
+            parsed += chunk_parsed
+    return runs, record_count, parsed
+
@@ -1,9 +1,17 @@
+import csv
+import io
 import random
 import os
+from collections import namedtuple
+from itertools import islice
 
 # For generating cp1252 characters
 from encodings.cp1252 import decoding_table
 
+from delimited_writer import compression, parallel
+from delimited_writer.quarantine import ConversionSummary
+from delimited_writer.record_layout import find_newline
+
 
 class MockFixedWidthFileWriter:
     """ A helper class to generate mock fixed width data for
@@ -60,3 +68,263 @@ class MockFixedWidthFileWriter:
                 for field in line:
                     f.write(field)
                 f.write("\n")
+
+
+# Delimited records formatted and encoded as one block
+DEFAULT_BATCH_SIZE = 10000
+
+# Uncompressed bytes of delimited file read per block by convert_parallel()
+DEFAULT_CHUNK_BLOCK_SIZE = 1 << 20
+
+# Bytes read at a time by read_line() when looking for the end of a line
+LINE_BLOCK_SIZE = 1 << 12
+
+# A byte range of the delimited file, and where a worker writes its records
+ReverseChunkTask = namedtuple(
+    "ReverseChunkTask", ["writer", "start", "end", "part_filename", "batch_size"]
+)
+
+
+class FixedWidthFileWriter:
+    """ Converts delimited files (CSV) back into fixed width files, as
+        described by the same EncodingProperties spec.
+
+        The delimited file is read as a stream with csv.reader, and, if
+        include_header is True, its first row must be the column names. Each
+        record is padded to the spec's offsets with spaces, using one
+        precompiled format string. A field longer than its column raises
+        ValueError, or is cut to fit when truncate is True. Records are
+        encoded to the fixed width encoding batch_size at a time and written
+        as one block, each ending in fixed_width_newline, or os.linesep when
+        it is None or "".
+
+        Fields holding a newline cannot be written to a fixed width file and
+        raise ValueError, so convert_parallel() may split the delimited file
+        on any line break, '\r', '\n' or '\r\n' as for csv.reader. Compressed
+        files are read and written as streams, as in DelimitedFileWriter.
+
+        After each run, summary holds the ConversionSummary of the counts of
+        records read and written.
+    """
+
+    def __init__(self, encoding_props, fixed_width_newline=None, truncate=False):
+        if fixed_width_newline not in {None, "", "\n", "\r\n", "\r"}:
+            raise ValueError(f"Illegal newline value: {fixed_width_newline}")
+        self.encoding_props = encoding_props
+        self.fixed_width_newline = fixed_width_newline or os.linesep
+        self.truncate = truncate
+        self.summary = ConversionSummary()
+        self.offsets = list(encoding_props.offsets)
+        self.record_length = sum(self.offsets)
+        self.template = "".join(f"%-{offset}s" for offset in self.offsets)
+        self.input_codec = compression.codec_for(
+            encoding_props.delimited_filename, encoding_props.delimited_compression
+        )
+        self.output_codec = compression.codec_for(
+            encoding_props.fixed_width_filename, encoding_props.fixed_width_compression
+        )
+
+    def check_header(self, row):
+        if row != list(self.encoding_props.column_names):
+            raise ValueError(f"Header does not match the spec's column names: {row}")
+
+    def format_records(self, rows, first_record=1):
+        """ Returns the fixed width encoding of rows, a list of lists of field
+            values, with a newline after every record. first_record is the
+            1-based number of the first row, for error messages.
+        """
+        template = self.template
+        columns = len(self.offsets)
+        record_length = self.record_length
+        lines = []
+        for row in rows:
+            if len(row) != columns:
+                raise ValueError(
+                    f"Record {first_record + len(lines)} has {len(row)} fields, "
+                    f"expected {columns}"
+                )
+            line = template % tuple(row)
+            if len(line) != record_length:
+                # Padding never shortens a field, so one is too long
+                line = self.fit_record(row, first_record + len(lines))
+            lines.append(line)
+
+        newline = self.fixed_width_newline
+        text = newline.join(lines) + newline
+        if text.count("\n") + text.count("\r") != len(lines) * len(newline):
+            for i, line in enumerate(lines):
+                if "\n" in line or "\r" in line:
+                    raise ValueError(f"Record {first_record + i} contains a newline")
+        try:
+            return text.encode(self.encoding_props.fixed_width_encoding)
+        except UnicodeEncodeError as error:
+            record = first_record + error.start // (record_length + len(newline))
+            raise ValueError(
+                f"Record {record} cannot be encoded: {error.reason}"
+            ) from None
+
+    def fit_record(self, row, record):
+        """ Pads each field of row to its offset, truncating long fields if
+            truncate is True and raising ValueError otherwise.
+        """
+        fields = []
+        for name, offset, field in zip(
+            self.encoding_props.column_names, self.offsets, row
+        ):
+            if len(field) > offset and not self.truncate:
+                raise ValueError(
+                    f"Record {record}: {name} is {len(field)} characters long, "
+                    f"wider than its column of {offset}"
+                )
+            fields.append(field[:offset].ljust(offset))
+        return "".join(fields)
+
+    def open_fixed_width_file(self):
+        """ Opens the fixed width file for writing in binary, compressing it
+            as a stream when the fixed width compression calls for it.
+        """
+        return compression.open_output(
+            self.encoding_props.fixed_width_filename, self.output_codec
+        )
+
+    def convert(self, batch_size=DEFAULT_BATCH_SIZE):
+        """ Streams the delimited file into the fixed width file, holding at
+            most batch_size records in memory. Returns the ConversionSummary.
+        """
+        if batch_size < 1:
+            raise ValueError(f"batch_size must be positive, got {batch_size}")
+        summary = self.summary = ConversionSummary()
+        binary = compression.open_input(
+            self.encoding_props.delimited_filename, self.input_codec
+        )
+        with io.TextIOWrapper(
+            binary, encoding=self.encoding_props.delimited_encoding, newline=""
+        ) as f, self.open_fixed_width_file() as out:
+            reader = csv.reader(f)
+            if self.encoding_props.include_header is True:
+                self.check_header(next(reader, list(self.encoding_props.column_names)))
+            batch = list(islice(reader, batch_size))
+            while batch:
+                out.write(self.format_records(batch, summary.records_read + 1))
+                summary.records_read += len(batch)
+                batch = list(islice(reader, batch_size))
+        summary.records_written = summary.records_read
+        return summary
+
+    def convert_parallel(self, workers=None, batch_size=DEFAULT_BATCH_SIZE):
+        """ Converts the delimited file using `workers` processes, one per CPU
+            by default. The file is split into byte ranges ending on line
+            breaks, each converted to a part file by a worker, and the parts
+            are stitched together in order as for
+            DelimitedFileWriter.convert_parallel(). Requires an uncompressed
+            delimited file. Returns the ConversionSummary.
+        """
+        if batch_size < 1:
+            raise ValueError(f"batch_size must be positive, got {batch_size}")
+        if self.input_codec is not None:
+            raise ValueError(
+                "Parallel conversion requires an uncompressed delimited file, "
+                "use convert() to stream a compressed one"
+            )
+        workers = workers or os.cpu_count() or 1
+        delimited_filename = self.encoding_props.delimited_filename
+        fixed_width_filename = self.encoding_props.fixed_width_filename
+
+        with open(delimited_filename, "rb") as f:
+            if self.encoding_props.include_header is True:
+                header = read_line(f).decode(self.encoding_props.delimited_encoding)
+                self.check_header(next(csv.reader([header]), []))
+            ranges = split_on_lines(f, f.tell(), workers)
+        tasks = [
+            ReverseChunkTask(
+                self, start, end, f"{fixed_width_filename}.part{i}", batch_size
+            )
+            for i, (start, end) in enumerate(ranges)
+        ]
+
+        summary = self.summary = ConversionSummary()
+
+        def part_done(task, written):
+            summary.records_read += written
+
+        with self.open_fixed_width_file() as out:
+            parallel.stitch_parts(convert_reverse_chunk, tasks, workers, out, part_done)
+        summary.records_written = summary.records_read
+        return summary
+
+
+def read_line(f, block_size=LINE_BLOCK_SIZE):
+    """ Reads binary file object f up to and including its next line break,
+        '\r', '\n' or '\r\n', and returns the bytes read, or the rest of the
+        file when it has no line break. f is left just after the line break.
+    """
+    start = f.tell()
+    data = b""
+    searched = 0
+    while True:
+        block = f.read(block_size)
+        data += block
+        end = find_newline(data, searched)
+        if end == -1:
+            if not block:
+                return data
+            searched = len(data)
+        elif data[end:] == b"\r" and block:
+            # A '\r' ending the data may be the start of a '\r\n'
+            searched = end
+        else:
+            end += 2 if data[end : end + 2] == b"\r\n" else 1
+            f.seek(start + end)
+            return data[:end]
+
+
+def split_on_lines(f, start, chunks):
+    """ Splits binary file object f from start to its end into at most
+        `chunks` (start, end) byte ranges of near equal size, each ending
+        just after a line break.
+    """
+    size = f.seek(0, io.SEEK_END)
+    ranges = []
+    for i in range(1, chunks + 1):
+        end = size
+        if i < chunks:
+            f.seek(max(start, start + (size - start) * i // chunks - 1))
+            read_line(f)
+            end = min(f.tell(), size)
+        if end > start:
+            ranges.append((start, end))
+            start = end
+    return ranges
+
+
+def convert_reverse_chunk(task):
+    """ Worker entry point. Converts the delimited records in the byte range
+        of task to the fixed width part file task.part_filename, and returns
+        its filename with the number of records written.
+    """
+    writer = task.writer
+    encoding = writer.encoding_props.delimited_encoding
+    written = 0
+    with open(writer.encoding_props.delimited_filename, "rb") as f, open(
+        task.part_filename, "wb"
+    ) as part:
+        f.seek(task.start)
+        remaining = task.end - task.start
+        while remaining:
+            # Read whole lines, so that no record is split between blocks
+            block = f.read(min(DEFAULT_CHUNK_BLOCK_SIZE, remaining))
+            if len(block) < remaining and not block.endswith(b"\n"):
+                block += read_line(f)[: remaining - len(block)]
+            remaining -= len(block)
+            if not block:
+                break
+            reader = csv.reader(io.StringIO(block.decode(encoding), newline=""))
+            batch = list(islice(reader, task.batch_size))
+            while batch:
+                try:
+                    part.write(writer.format_records(batch, written + 1))
+                except ValueError as error:
+                    raise ValueError(f"Chunk at byte {task.start}: {error}") from None
+                written += len(batch)
+                batch = list(islice(reader, task.batch_size))
+    return task.part_filename, written
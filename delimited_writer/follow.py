@@ -0,0 +1,294 @@
+"""
+Incremental conversion of append-only fixed width feeds
+
+A feed that is appended to throughout the day is converted by repeated calls
+to DelimitedFileWriter.convert_incremental(), or continuously by follow(),
+each of which only reads the records added since the last run. Progress is
+kept in a FollowState next to the delimited file.
+
+Run from the repository root, e.g.:
+$ python -m delimited_writer.follow spec.json feed.txt feed.csv
+$ python -m delimited_writer.follow spec.json feed.txt feed.csv --watch
+"""
+
+import argparse
+import hashlib
+import os
+import sys
+
+from delimited_writer.checkpoint import TAIL_SIZE, Checkpoint, CheckpointMismatch
+
+# Seconds between checks of a followed file for new data
+DEFAULT_POLL_INTERVAL = 1.0
+
+# Bytes at the start of a followed file hashed to recognise it
+HEAD_SIZE = 4096
+
+
+def follow_filename(delimited_filename):
+    """ Returns the follow state filename kept next to the delimited file.
+    """
+    return f"{delimited_filename}.follow"
+
+
+def range_digest(f, start, end):
+    """ Returns a SHA-256 digest of the bytes of binary file object f from
+        start to end.
+    """
+    f.seek(start)
+    return hashlib.sha256(f.read(end - start)).hexdigest()
+
+
+def feed_newline(f, size, layout):
+    """ Returns the newline of binary file object f, of size bytes, as by
+        RecordLayout.detect_newline(), or b"" while it is not yet known.
+
+        A first record followed by nothing but '\r' may be followed by a
+        '\n' still to be written, so its newline is not yet known either.
+    """
+    try:
+        newline = layout.detect_newline(f)
+    except ValueError:
+        return b""
+    if newline == layout.carriage_return and size == layout.record_length + 1:
+        return b""
+    return newline
+
+
+def complete_end(f, start, end, newline, layout, block_size=TAIL_SIZE):
+    """ Returns the offset following the last complete line of binary file
+        object f between start and end, or start if there is none. Newlines
+        are those of the RecordLayout layout.
+
+        The bytes after it are a record still being written. A final '\r' is
+        only complete when the file's newline is '\r', as otherwise it may be
+        the first half of a '\r\n'.
+    """
+    carriage_return = layout.carriage_return
+    position = end
+    if newline != carriage_return and end > start:
+        f.seek(end - 1)
+        if f.read(1) == carriage_return:
+            position -= 1
+    while position > start:
+        block_start = max(start, position - block_size)
+        f.seek(block_start)
+        block = f.read(position - block_start)
+        last = max(block.rfind(layout.line_feed), block.rfind(carriage_return))
+        if last != -1:
+            return block_start + last + 1
+        position = block_start
+    return start
+
+
+class RangeReader:
+    """ Reads binary file object f from its position up to end, so that a
+        scan stops at the last complete record rather than end of file.
+    """
+
+    def __init__(self, f, end):
+        self.f = f
+        self.end = end
+
+    def read(self, size=-1):
+        remaining = self.end - self.f.tell()
+        if size < 0 or size > remaining:
+            size = remaining
+        return self.f.read(max(0, size))
+
+
+class FollowState(Checkpoint):
+    """ The progress of a followed feed, saved next to the delimited file.
+
+        As for a Checkpoint, input_offset is where the next run starts reading
+        and output_offset the length of the delimited file written so far.
+        The counts are those of the current input file, so that reject line
+        numbers stay right from one run to the next.
+
+        The file read last is identified by its device and inode, and by
+        digests of its first head_size bytes and of the bytes before
+        input_offset. A followed file that no longer matches has been rotated
+        or rewritten, see sources().
+    """
+
+    FIELDS = Checkpoint.FIELDS + ["device", "inode", "head_size", "head_digest"]
+
+    def __init__(self, filename, fingerprint):
+        super().__init__(filename, fingerprint)
+        self.device = None
+        self.inode = None
+        self.head_size = 0
+        self.head_digest = None
+
+    @property
+    def started(self):
+        return self.output_offset > 0
+
+    def verify(self, fingerprint, delimited_filename):
+        """ Checks that this state belongs to the run with fingerprint, and
+            that the delimited file is as the last run left it.
+        """
+        if not self.started:
+            self.fingerprint = fingerprint
+            return
+        if self.fingerprint != fingerprint:
+            raise CheckpointMismatch(
+                f"{self.filename} was written by a run with different settings"
+            )
+        if (
+            not os.path.exists(delimited_filename)
+            or os.path.getsize(delimited_filename) < self.output_offset
+        ):
+            raise CheckpointMismatch(f"{delimited_filename} is shorter than followed")
+        with open(delimited_filename, "rb") as f:
+            start = max(0, self.output_offset - TAIL_SIZE)
+            if range_digest(f, start, self.output_offset) != self.output_digest:
+                raise CheckpointMismatch(f"{delimited_filename} changed since last run")
+
+    def matches(self, f, size):
+        """ Returns True if binary file object f, of size bytes, holds the
+            file read last, up to input_offset.
+        """
+        if self.head_digest is None or size < max(self.head_size, self.input_offset):
+            return False
+        if range_digest(f, 0, self.head_size) != self.head_digest:
+            return False
+        start = max(0, self.input_offset - TAIL_SIZE)
+        return range_digest(f, start, self.input_offset) == self.input_digest
+
+    def sources(self, fixed_width_filename):
+        """ Returns the files to read this run, as (filename, start, final)
+            tuples in order. A final file is read to its end, including an
+            unterminated last record, as nothing more will be appended to it.
+
+            While the followed file is the one read last it is read from
+            input_offset. Otherwise it has been rotated: a file in the same
+            directory holding what was read last, found by inode or by
+            content as after a copy and truncate, is first read to its end,
+            then the new file from its start. A followed file that was
+            changed before input_offset in place raises CheckpointMismatch.
+        """
+        if self.head_digest is None:
+            return [(fixed_width_filename, 0, False)]
+        try:
+            stat = os.stat(fixed_width_filename)
+        except FileNotFoundError:
+            stat = None
+
+        if stat is not None and (stat.st_dev, stat.st_ino) == (self.device, self.inode):
+            with open(fixed_width_filename, "rb") as f:
+                if self.matches(f, stat.st_size):
+                    return [(fixed_width_filename, self.input_offset, False)]
+                head_size = min(self.head_size, stat.st_size)
+                if (
+                    stat.st_size >= self.input_offset
+                    and range_digest(f, 0, head_size) == self.head_digest
+                ):
+                    raise CheckpointMismatch(
+                        f"{fixed_width_filename} changed before the followed offset"
+                    )
+
+        sources = []
+        rotated = self.find_rotated(fixed_width_filename)
+        if rotated is not None:
+            sources.append((rotated, self.input_offset, True))
+        if stat is not None:
+            sources.append((fixed_width_filename, 0, False))
+        return sources
+
+    def find_rotated(self, fixed_width_filename):
+        """ Returns the name of the rotated copy of the file read last, e.g.
+            feed.txt.1 for feed.txt, or None if there is none.
+        """
+        directory = os.path.dirname(fixed_width_filename) or "."
+        name = os.path.basename(fixed_width_filename)
+        candidates = []
+        for entry in os.scandir(directory):
+            if entry.name == name or not entry.name.startswith(name):
+                continue
+            if not entry.is_file():
+                continue
+            stat = entry.stat()
+            same_inode = (stat.st_dev, stat.st_ino) == (self.device, self.inode)
+            # Try the same inode first, then the most recently modified
+            candidates.append((not same_inode, -stat.st_mtime, entry.path))
+        for _, _, filename in sorted(candidates):
+            with open(filename, "rb") as f:
+                if self.matches(f, os.path.getsize(filename)):
+                    return filename
+        return None
+
+    def advance(self, f, input_offset, summary):
+        """ Records that binary file object f has been read to input_offset,
+            with the counts of summary.
+        """
+        stat = os.fstat(f.fileno())
+        self.device = stat.st_dev
+        self.inode = stat.st_ino
+        self.head_size = min(HEAD_SIZE, max(input_offset, stat.st_size))
+        self.head_digest = range_digest(f, 0, self.head_size)
+        self.input_offset = input_offset
+        self.input_digest = range_digest(
+            f, max(0, input_offset - TAIL_SIZE), input_offset
+        )
+        self.records_read = summary.records_read
+        self.records_written = summary.records_written
+        self.records_filtered = summary.records_filtered
+        self.records_rejected = summary.records_rejected
+
+    def forget_input(self):
+        """ Starts the next run at the beginning of the followed file, once
+            the file read last has been read to its end.
+        """
+        self.device = self.inode = self.head_digest = self.input_digest = None
+        self.head_size = self.input_offset = 0
+        self.records_read = self.records_written = 0
+        self.records_filtered = self.records_rejected = 0
+
+    def save(self, delimited_filename):
+        """ Writes the state atomically, as Checkpoint.save(). The input
+            digests are already set by advance().
+        """
+        with open(delimited_filename, "rb") as f:
+            start = max(0, self.output_offset - TAIL_SIZE)
+            self.output_digest = range_digest(f, start, self.output_offset)
+        self.write()
+
+
+def main(argv=None):
+    # Imported here, as delimited_writer imports this module
+    from delimited_writer.delimited_writer import (
+        DEFAULT_BATCH_SIZE,
+        DelimitedFileWriter,
+    )
+    from delimited_writer.encoding_properties import EncodingProperties
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("spec")
+    parser.add_argument("input", help="fixed width file to follow")
+    parser.add_argument("output", help="delimited file to append to")
+    parser.add_argument("--newline", choices=["\\n", "\\r\\n", "\\r"])
+    parser.add_argument("--watch", action="store_true", help="keep following")
+    parser.add_argument("--poll-interval", type=float, default=DEFAULT_POLL_INTERVAL)
+    parser.add_argument("--idle-timeout", type=float, help="seconds, default never")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE)
+    args = parser.parse_args(argv)
+
+    newline = args.newline and args.newline.encode().decode("unicode_escape")
+    encoding_props = EncodingProperties(args.spec, args.input, args.output, newline)
+    delimited = DelimitedFileWriter(encoding_props)
+
+    def report(summary):
+        print(f"{args.input}: {summary.records_written:,} new records")
+
+    if args.watch:
+        delimited.follow(
+            args.poll_interval, args.idle_timeout, args.batch_size, report
+        )
+    else:
+        report(delimited.convert_incremental(args.batch_size))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,410 @@
+"""
+Opt-in instrumentation of conversion runs: stage timings, throughput,
+peak memory and profiling hooks
+"""
+
+import cProfile
+import io
+import itertools
+import os
+import sys
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:  # Not available on Windows
+    resource = None
+
+# Stages timed by an instrumented convert(), in pipeline order
+STAGES = ["read", "scan", "slice", "decode", "csv", "flush"]
+
+# Environment variable enabling profiling of every run, see profiling()
+PROFILE_VARIABLE = "DELIMITED_WRITER_PROFILE"
+
+# Records timed per record stage are sampled one in SAMPLE_EVERY, as timing
+# every record would cost more than the stages themselves
+SAMPLE_EVERY = 16
+
+# Allocation sites listed in a tracemalloc report
+TRACEMALLOC_TOP = 25
+
+# Numbers the profiled runs of this process, see profile_filename()
+_profiled_runs = itertools.count(1)
+
+
+def peak_rss(who="RUSAGE_SELF"):
+    """ Returns the peak resident set size of this process, or with
+        who="RUSAGE_CHILDREN" of its largest finished child, in bytes.
+    """
+    if resource is None:
+        return None
+    rss = resource.getrusage(getattr(resource, who)).ru_maxrss
+    # ru_maxrss is in bytes on macOS and kilobytes elsewhere
+    return rss if sys.platform == "darwin" else rss * 1024
+
+
+class ConversionMetrics:
+    """ Measurements of one conversion run.
+
+        seconds holds the time spent in each of STAGES:
+
+            read    reading, and decompressing, the fixed width file
+            scan    finding and validating records and applying predicates
+            slice   cutting records into fields and stripping the padding
+            decode  decoding fields to str. For multi-byte encodings lines
+                    are decoded as they are read, so scan is counted here.
+            csv     formatting and encoding the delimited records
+            flush   writing, and compressing, the delimited file
+
+        Stages are timed per batch, except slice and decode which are timed
+        on a sample of the records and scaled up, see SAMPLE_EVERY. Raw
+        records transcoded by a Transcoder are sliced and decoded a batch at
+        a time as they are written, and those stages are timed per batch, see
+        add_transcode(). convert_parallel() only measures the whole run, as
+        its stages happen in the workers.
+
+        peak_memory_bytes is the peak RSS of the process so far, which may
+        predate the run, and peak_child_memory_bytes that of the largest
+        finished worker process.
+    """
+
+    def __init__(self):
+        self.seconds = dict.fromkeys(STAGES, 0.0)
+        self.run_seconds = 0.0
+        self.records_read = 0
+        self.records_written = 0
+        self.bytes_read = 0
+        self.bytes_written = 0
+        self.peak_memory_bytes = None
+        self.peak_child_memory_bytes = None
+        self.text_mode = False
+        self._parse_counted = 0.0
+        self._csv_flushed = 0.0
+        self._transcoded = 0.0
+        self._csv_transcoded = 0.0
+
+    def add_parse(self, seconds):
+        """ Adds the time taken to pull one batch of records, less what was
+            already counted as read, slice or decode, to scan.
+        """
+        stage = "decode" if self.text_mode else "scan"
+        self.seconds[stage] += seconds - (self._parse_seconds() - self._parse_counted)
+        self._parse_counted = self._parse_seconds()
+
+    def _parse_seconds(self):
+        return self.seconds["read"] + self.seconds["slice"] + self.seconds["decode"]
+
+    def add_csv(self, seconds):
+        """ Adds the time taken to write one batch of records, less what was
+            counted as flush, slice or decode, to csv.
+        """
+        flushed = self.seconds["flush"]
+        transcoded = self._transcoded
+        self.seconds["csv"] += (
+            seconds
+            - (flushed - self._csv_flushed)
+            - (transcoded - self._csv_transcoded)
+        )
+        self._csv_flushed = flushed
+        self._csv_transcoded = transcoded
+
+    def add_transcode(self, slice_seconds, decode_seconds):
+        """ Adds the time taken to slice and decode a batch of raw records as
+            it is written. The time is left out of csv, and out of scan as it
+            is not spent pulling a batch.
+        """
+        self.seconds["slice"] += slice_seconds
+        self.seconds["decode"] += decode_seconds
+        self._parse_counted += slice_seconds + decode_seconds
+        self._transcoded += slice_seconds + decode_seconds
+
+    def finish(self, run_seconds, summary):
+        self.run_seconds = run_seconds
+        self.records_read = summary.records_read
+        self.records_written = summary.records_written
+        self.peak_memory_bytes = peak_rss()
+        self.peak_child_memory_bytes = peak_rss("RUSAGE_CHILDREN")
+
+    @property
+    def records_per_sec(self):
+        return self.records_read / self.run_seconds if self.run_seconds else None
+
+    @property
+    def bytes_per_sec(self):
+        return self.bytes_read / self.run_seconds if self.run_seconds else None
+
+    def as_dict(self):
+        return {
+            "run_seconds": self.run_seconds,
+            "stage_seconds": dict(self.seconds),
+            "records_read": self.records_read,
+            "records_written": self.records_written,
+            "bytes_read": self.bytes_read,
+            "bytes_written": self.bytes_written,
+            "records_per_sec": self.records_per_sec,
+            "bytes_per_sec": self.bytes_per_sec,
+            "peak_memory_bytes": self.peak_memory_bytes,
+            "peak_child_memory_bytes": self.peak_child_memory_bytes,
+        }
+
+    def to_prometheus(self, prefix="delimited_writer"):
+        """ Returns the metrics in the Prometheus text exposition format.
+        """
+        stages = {f'stage="{stage}"': value for stage, value in self.seconds.items()}
+        records = {
+            'kind="read"': self.records_read,
+            'kind="written"': self.records_written,
+        }
+        sizes = {'kind="read"': self.bytes_read, 'kind="written"': self.bytes_written}
+        gauges = [
+            ("run_seconds", "Duration of the run", {"": self.run_seconds}),
+            ("stage_seconds", "Time spent in each stage", stages),
+            ("records", "Records read and written", records),
+            ("bytes", "Uncompressed bytes read and written", sizes),
+            ("records_per_second", "Records read a second", {"": self.records_per_sec}),
+            ("bytes_per_second", "Bytes read a second", {"": self.bytes_per_sec}),
+            ("peak_memory_bytes", "Peak RSS", {"": self.peak_memory_bytes}),
+        ]
+        lines = []
+        for name, description, samples in gauges:
+            name = f"{prefix}_{name}"
+            lines.append(f"# HELP {name} {description}")
+            lines.append(f"# TYPE {name} gauge")
+            for labels, value in samples.items():
+                if value is None:
+                    continue
+                labels = "{" + labels + "}" if labels else ""
+                lines.append(f"{name}{labels} {value}")
+        return "\n".join(lines) + "\n"
+
+    def __repr__(self):
+        return f"ConversionMetrics({self.as_dict()})"
+
+
+class TimedReader(io.BufferedIOBase):
+    """ Wraps a binary file object, counting the time spent in and the bytes
+        returned by its reads as the read stage.
+    """
+
+    def __init__(self, fileobj, metrics):
+        super().__init__()
+        self.fileobj = fileobj
+        self.metrics = metrics
+
+    def _timed(self, method, size):
+        start = time.perf_counter()
+        data = method(size)
+        self.metrics.seconds["read"] += time.perf_counter() - start
+        self.metrics.bytes_read += len(data)
+        return data
+
+    def read(self, size=-1):
+        return self._timed(self.fileobj.read, size)
+
+    def read1(self, size=-1):
+        return self._timed(self.fileobj.read1, size)
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return self.fileobj.seekable()
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        return self.fileobj.seek(offset, whence)
+
+    def tell(self):
+        return self.fileobj.tell()
+
+    def close(self):
+        if not self.closed:
+            super().close()
+            self.fileobj.close()
+
+
+class TimedWriter(io.BufferedIOBase):
+    """ Wraps a binary file object, counting the time spent in and the bytes
+        given to its writes and flushes as the flush stage.
+    """
+
+    def __init__(self, fileobj, metrics):
+        super().__init__()
+        self.fileobj = fileobj
+        self.metrics = metrics
+
+    def write(self, data):
+        start = time.perf_counter()
+        written = self.fileobj.write(data)
+        self.metrics.seconds["flush"] += time.perf_counter() - start
+        self.metrics.bytes_written += len(data)
+        return written
+
+    def flush(self):
+        start = time.perf_counter()
+        self.fileobj.flush()
+        self.metrics.seconds["flush"] += time.perf_counter() - start
+
+    def writable(self):
+        return True
+
+    def fileno(self):
+        return self.fileobj.fileno()
+
+    def tell(self):
+        return self.fileobj.tell()
+
+    def close(self):
+        if not self.closed:
+            try:
+                super().close()
+            finally:
+                start = time.perf_counter()
+                self.fileobj.close()
+                self.metrics.seconds["flush"] += time.perf_counter() - start
+
+
+def timed_split_record(layout, metrics):
+    """ Returns layout.split_record() timing the slice and decode stages of
+        one record in SAMPLE_EVERY, counting each sample SAMPLE_EVERY times.
+    """
+    split = layout.split_record
+    unpack = layout.unpacker.unpack
+    order = layout.order
+    encoding = layout.encoding
+    line_feed, space = layout.line_feed, layout.space
+    seconds = metrics.seconds
+    clock = time.perf_counter
+    count = 0
+
+    def split_record(record):
+        nonlocal count
+        count += 1
+        if count % SAMPLE_EVERY:
+            return split(record)
+        start = clock()
+        fields = unpack(record)
+        if order is not None:
+            fields = [fields[i] for i in order]
+        fields = line_feed.join(fields).replace(space, b"")
+        sliced = clock()
+        fields = fields.decode(encoding).split("\n")
+        seconds["slice"] += (sliced - start) * SAMPLE_EVERY
+        seconds["decode"] += (clock() - sliced) * SAMPLE_EVERY
+        return fields
+
+    return split_record
+
+
+def timed_split_line(split_line, metrics):
+    """ Returns split_line() timing the slice stage of one decoded line in
+        SAMPLE_EVERY, counting each sample SAMPLE_EVERY times.
+    """
+    seconds = metrics.seconds
+    clock = time.perf_counter
+    count = 0
+
+    def timed(line):
+        nonlocal count
+        count += 1
+        if count % SAMPLE_EVERY:
+            return split_line(line)
+        start = clock()
+        try:
+            return split_line(line)
+        finally:
+            seconds["slice"] += (clock() - start) * SAMPLE_EVERY
+
+    return timed
+
+
+def profile_filename(filename):
+    """ Returns the file a profiled run writes to: filename with {pid}
+        replaced by the process id and {run} by the number of the run in this
+        process, or with ".{pid}.{run}" appended if it has neither.
+    """
+    if "{pid}" not in filename and "{run}" not in filename:
+        filename += ".{pid}.{run}"
+    run = next(_profiled_runs)
+    return filename.replace("{pid}", str(os.getpid())).replace("{run}", str(run))
+
+
+@contextmanager
+def profiling(profile=None):
+    """ Profiles the enclosed code when profile, or else the environment
+        variable DELIMITED_WRITER_PROFILE, is set, so that any run can be
+        profiled without changing code:
+
+            cprofile:FILENAME     cProfile stats, for pstats or snakeviz
+            tracemalloc:FILENAME  the top allocation sites and peak traced
+                                  memory, as text
+
+        Every run profiled, including those of BatchConverter workers and of
+        each follow() poll, writes a file of its own named by
+        profile_filename(), e.g. "cprofile:run.{pid}.{run}.prof", so that no
+        run overwrites another's.
+    """
+    profile = profile or os.environ.get(PROFILE_VARIABLE)
+    if not profile:
+        yield
+        return
+    kind, _, filename = profile.partition(":")
+    if kind not in {"cprofile", "tracemalloc"} or not filename:
+        raise ValueError(
+            f"Invalid profile {profile}, expected cprofile:FILE or tracemalloc:FILE"
+        )
+    filename = profile_filename(filename)
+
+    if kind == "cprofile":
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            yield
+        finally:
+            profiler.disable()
+            profiler.dump_stats(filename)
+        return
+
+    started = not tracemalloc.is_tracing()
+    if started:
+        tracemalloc.start()
+    elif hasattr(tracemalloc, "reset_peak"):  # Python 3.9+
+        tracemalloc.reset_peak()
+    try:
+        yield
+    finally:
+        snapshot = tracemalloc.take_snapshot()
+        current, peak = tracemalloc.get_traced_memory()
+        if started:
+            tracemalloc.stop()
+        with open(filename, "w") as f:
+            f.write(f"current {current} bytes, peak {peak} bytes\n")
+            for stat in snapshot.statistics("lineno")[:TRACEMALLOC_TOP]:
+                f.write(f"{stat}\n")
+
+
+class Instrumentation:
+    """ Opt-in instrumentation for DelimitedFileWriter.
+
+        Each run's ConversionMetrics is kept on the writer as metrics, passed
+        to callback if given, and written to prometheus_filename if given, in
+        the Prometheus text format. The file is replaced atomically, so it
+        can be read by node_exporter's textfile collector.
+
+        profile wraps each run in cProfile or tracemalloc, see profiling().
+    """
+
+    def __init__(self, callback=None, prometheus_filename=None, profile=None):
+        self.callback = callback
+        self.prometheus_filename = prometheus_filename
+        self.profile = profile
+
+    def publish(self, metrics):
+        if self.prometheus_filename is not None:
+            temporary_filename = f"{self.prometheus_filename}.tmp"
+            with open(temporary_filename, "w") as f:
+                f.write(metrics.to_prometheus())
+            os.replace(temporary_filename, self.prometheus_filename)
+        if self.callback is not None:
+            self.callback(metrics)
@@ -0,0 +1,264 @@
+"""
+Multi-process conversion of fixed width files split on record boundaries
+"""
+
+import csv
+import os
+import shutil
+import struct
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+
+from delimited_writer import compression
+from delimited_writer.quarantine import ConversionSummary
+from delimited_writer.transcoding import Transcoder, can_transcode
+
+# A contiguous run of records, and everything a worker needs to convert it
+ChunkTask = namedtuple(
+    "ChunkTask",
+    [
+        "fixed_width_filename",
+        "layout",
+        "column_names",
+        "predicates",
+        "newline",
+        "first_record",
+        "record_count",
+        "part_filename",
+        "delimited_encoding",
+        "delimited_newline",
+        "batch_size",
+    ],
+)
+
+
+def plan_chunks(record_count, chunks):
+    """ Splits record_count records into at most `chunks` contiguous
+        (first_record, record_count) ranges of near equal size.
+    """
+    chunks = max(1, min(chunks, record_count))
+    size, extra = divmod(record_count, chunks)
+    ranges = []
+    first = 0
+    for i in range(chunks):
+        count = size + (1 if i < extra else 0)
+        if count:
+            ranges.append((first, count))
+        first += count
+    return ranges
+
+
+def iter_chunk_records(f, layout, newline, first_record, record_count, batch_size):
+    """ Yields the raw bytes of records first_record to
+        first_record + record_count from binary file object f.
+
+        Records are read batch_size at a time at a fixed stride. Every
+        terminator must equal newline, so a file with mixed newlines or a
+        line of the wrong length is rejected rather than silently misaligned.
+    """
+    record_length = layout.record_length
+    stride = record_length + len(newline)
+    record_struct = struct.Struct(f"{record_length}s{len(newline)}s")
+    line_feed, carriage_return = layout.line_feed, layout.carriage_return
+
+    f.seek(first_record * stride)
+    remaining = record_count
+    while remaining:
+        count = min(batch_size, remaining)
+        remaining -= count
+        block = f.read(count * stride)
+        if len(block) == count * stride - len(newline):
+            # Final record of the file has no newline
+            block += newline
+        if len(block) != count * stride:
+            raise ValueError("One or more fields are of incorrect length")
+
+        for record, terminator in record_struct.iter_unpack(block):
+            if (
+                terminator != newline
+                or line_feed in record
+                or carriage_return in record
+            ):
+                raise ValueError("One or more fields are of incorrect length")
+            yield record
+
+
+def convert_chunk(task):
+    """ Worker entry point. Converts one chunk of the fixed width file into
+        the delimited part file task.part_filename, and returns its filename
+        with the number of records written.
+    """
+    layout = task.layout
+    matches = [
+        predicate.compile(layout, task.column_names) for predicate in task.predicates
+    ]
+    with open(task.fixed_width_filename, "rb") as f, open(
+        task.part_filename, "w", encoding=task.delimited_encoding, newline=""
+    ) as part:
+        if can_transcode(layout):
+            transcoder = Transcoder(
+                layout, task.delimited_encoding, task.delimited_newline
+            )
+            writer = transcoder.writer(part.buffer)
+            split = bytes
+        else:
+            writer = csv.writer(
+                part, delimiter=",", lineterminator=task.delimited_newline
+            )
+            split = layout.split_record
+        batch = []
+        written = 0
+        for record in iter_chunk_records(
+            f,
+            layout,
+            task.newline,
+            task.first_record,
+            task.record_count,
+            task.batch_size,
+        ):
+            if not all(match(record) for match in matches):
+                continue
+            batch.append(split(record))
+            if len(batch) >= task.batch_size:
+                writer.writerows(batch)
+                written += len(batch)
+                batch = []
+        writer.writerows(batch)
+        written += len(batch)
+    return task.part_filename, written
+
+
+def stitch_parts(convert, tasks, workers, f, part_done=None):
+    """ Runs convert, a worker entry point returning the part filename and
+        record count of a task, over tasks in a pool of `workers` processes.
+
+        Each part file is appended to binary file object f, in task order, as
+        soon as it is ready and then removed, after which part_done(task,
+        count) is called if given. Every task has a part_filename, and parts
+        left behind by a failure are removed.
+    """
+    try:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            # map() yields results in submission order, so parts are
+            # appended in file order as soon as each one is ready
+            for task, (part_filename, count) in zip(tasks, pool.map(convert, tasks)):
+                with open(part_filename, "rb") as part:
+                    shutil.copyfileobj(part, f)
+                os.remove(part_filename)
+                if part_done is not None:
+                    part_done(task, count)
+    finally:
+        for task in tasks:
+            if os.path.exists(task.part_filename):
+                os.remove(task.part_filename)
+
+
+def convert_parallel(
+    encoding_props,
+    layout,
+    header,
+    predicates,
+    workers,
+    batch_size,
+    checkpoint=None,
+    checkpoint_every=None,
+    output_codec=None,
+    compression_workers=None,
+):
+    """ Converts the fixed width file described by encoding_props using a pool
+        of worker processes. layout may be projected onto a subset of columns,
+        named in header, and only records matching all predicates are written.
+
+        The newline convention is detected from the first record, which fixes
+        the byte length of every record. The file is then divided into one
+        contiguous range of records per worker without scanning it. Each worker
+        writes a part file, and the parts are stitched together in order after
+        the header. workers defaults to the number of CPUs when None.
+        Returns the ConversionSummary of the run.
+
+        When a Checkpoint is given, the file is divided into chunks of at most
+        checkpoint_every records instead, and checkpoint is saved after each
+        part is stitched. A started checkpoint skips its chunks_done chunks.
+
+        With output_codec, the stitched output is compressed as it is written
+        by compression_workers threads.
+    """
+    if not layout.single_byte:
+        raise ValueError(
+            "Parallel conversion requires a single byte fixed width encoding"
+        )
+    workers = workers or os.cpu_count() or 1
+
+    fixed_width_filename = encoding_props.fixed_width_filename
+    delimited_filename = encoding_props.delimited_filename
+    delimited_encoding = encoding_props.delimited_encoding
+    delimited_newline = encoding_props.delimited_newline
+    if delimited_newline in {None, ""}:
+        delimited_newline = os.linesep
+
+    with open(fixed_width_filename, "rb") as f:
+        newline = layout.detect_newline(f)
+        file_size = os.fstat(f.fileno()).st_size
+        record_count = layout.count_records(file_size, newline)
+    stride = layout.record_length + len(newline)
+
+    chunks = workers
+    chunks_done = 0
+    summary = ConversionSummary()
+    if checkpoint is not None:
+        if not checkpoint.started:
+            checkpoint.chunks = max(workers, -(-record_count // checkpoint_every))
+        chunks = checkpoint.chunks
+        chunks_done = checkpoint.chunks_done
+        checkpoint.restore(summary)
+    summary.records_read = record_count
+
+    tasks = [
+        ChunkTask(
+            fixed_width_filename,
+            layout,
+            encoding_props.column_names,
+            predicates,
+            newline,
+            first,
+            count,
+            f"{delimited_filename}.part{i}",
+            delimited_encoding,
+            delimited_newline,
+            batch_size,
+        )
+        for i, (first, count) in enumerate(plan_chunks(record_count, chunks))
+    ][chunks_done:]
+
+    resume = chunks_done > 0
+    if resume:
+        # Drop anything appended after the checkpoint by the interrupted run
+        os.truncate(delimited_filename, checkpoint.output_offset)
+    with compression.open_text_output(
+        delimited_filename,
+        output_codec,
+        delimited_encoding,
+        "a" if resume else "w",
+        compression_workers,
+    ) as f:
+        if encoding_props.include_header is True and not resume:
+            writer = csv.writer(f, delimiter=",", lineterminator=delimited_newline)
+            writer.writerow(header)
+        f.flush()
+
+        def part_done(task, written):
+            summary.records_written += written
+            if checkpoint is not None:
+                f.flush()
+                os.fsync(f.fileno())
+                checkpoint.chunks_done += 1
+                input_offset = (task.first_record + task.record_count) * stride
+                checkpoint.update(
+                    summary, min(input_offset, file_size), f.buffer.tell()
+                )
+                checkpoint.save(fixed_width_filename, delimited_filename)
+
+        stitch_parts(convert_chunk, tasks, workers, f.buffer, part_done)
+
+    summary.records_filtered = summary.records_read - summary.records_written
+    return summary
@@ -0,0 +1,96 @@
+"""
+Row predicates evaluated against raw fixed width records
+"""
+
+
+class FieldPredicate:
+    """ Base class for a test on the value of one column of a record.
+
+        Predicates are compiled against a RecordLayout before parsing. For
+        single byte encodings the compiled predicate is given the raw bytes of
+        a record, so rows can be rejected before anything is decoded. The
+        field is compared with its spaces removed, i.e. as it will appear in
+        the delimited output, and the predicate's values are encoded to the
+        fixed width encoding once, up front.
+
+        For other encodings the compiled predicate is given the decoded line.
+
+        Subclasses implement compile_test(), returning a function of the
+        stripped field value.
+    """
+
+    def __init__(self, column):
+        self.column = column
+
+    def compile(self, layout, column_names):
+        """ Returns a function of a raw record, or of a decoded line for
+            multi-byte encodings, that is True when the record matches.
+        """
+        if self.column not in column_names:
+            raise ValueError(f"Unknown column in predicate: {self.column}")
+        start, end = layout.bounds[column_names.index(self.column)]
+
+        if layout.single_byte:
+            encoding = layout.encoding
+            test = self.compile_test(lambda value: value.encode(encoding))
+            space, empty = layout.space, b""
+        else:
+            test = self.compile_test(lambda value: value)
+            space, empty = " ", ""
+
+        def match(record):
+            return test(record[start:end].replace(space, empty))
+
+        return match
+
+    def compile_test(self, convert):
+        """ Returns a function of a stripped field value. convert() turns a
+            str given to the predicate into the same type as that value.
+        """
+        raise NotImplementedError
+
+    def __repr__(self):
+        # Sets are sorted so that the repr is stable between runs
+        arguments = ", ".join(
+            repr(sorted(value) if isinstance(value, frozenset) else value)
+            for value in vars(self).values()
+        )
+        return f"{self.__class__.__name__}({arguments})"
+
+
+class Equals(FieldPredicate):
+    """ Matches records where column equals value.
+    """
+
+    def __init__(self, column, value):
+        super().__init__(column)
+        self.value = value
+
+    def compile_test(self, convert):
+        value = convert(self.value)
+        return lambda field: field == value
+
+
+class InSet(FieldPredicate):
+    """ Matches records where column is one of values.
+    """
+
+    def __init__(self, column, values):
+        super().__init__(column)
+        self.values = frozenset(values)
+
+    def compile_test(self, convert):
+        return frozenset(convert(value) for value in self.values).__contains__
+
+
+class Prefix(FieldPredicate):
+    """ Matches records where column starts with prefix.
+    """
+
+    def __init__(self, column, prefix):
+        super().__init__(column)
+        self.prefix = prefix
+
+    def compile_test(self, convert):
+        prefix = convert(self.prefix)
+        return lambda field: field.startswith(prefix)
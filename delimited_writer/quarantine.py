@@ -0,0 +1,157 @@
+"""
+Quarantining of malformed fixed width records
+"""
+
+import csv
+import os
+
+# Records read before max_error_rate is first checked
+DEFAULT_MIN_RECORDS = 1000
+
+
+class ErrorRateExceeded(ValueError):
+    """ Raised when a run rejects more records than its Quarantine allows.
+        The ConversionSummary at the time of aborting is attached.
+    """
+
+    def __init__(self, message, summary):
+        super().__init__(message)
+        self.summary = summary
+
+
+class ConversionSummary:
+    """ Record counts for one conversion run.
+
+        records_read counts every line of the fixed width file, including
+        rejected lines. records_filtered counts valid records not matching
+        the predicates, and records_written those sent to the delimited file.
+        records_duplicate counts records dropped by a deduplicating sort.
+    """
+
+    COUNTS = [
+        "records_read",
+        "records_written",
+        "records_filtered",
+        "records_rejected",
+        "records_duplicate",
+    ]
+
+    def __init__(self):
+        self.records_read = 0
+        self.records_written = 0
+        self.records_filtered = 0
+        self.records_rejected = 0
+        self.records_duplicate = 0
+
+    @property
+    def error_rate(self):
+        if not self.records_read:
+            return 0.0
+        return self.records_rejected / self.records_read
+
+    def add(self, summary, since=None):
+        """ Adds the counts of summary, less those of since when given.
+        """
+        for name in self.COUNTS:
+            count = getattr(summary, name)
+            if since is not None:
+                count -= getattr(since, name)
+            setattr(self, name, getattr(self, name) + count)
+
+    def as_dict(self):
+        return {
+            "records_read": self.records_read,
+            "records_written": self.records_written,
+            "records_filtered": self.records_filtered,
+            "records_rejected": self.records_rejected,
+            "records_duplicate": self.records_duplicate,
+            "error_rate": self.error_rate,
+        }
+
+    def __repr__(self):
+        counts = ", ".join(f"{key}={value}" for key, value in self.as_dict().items())
+        return f"ConversionSummary({counts})"
+
+
+class Quarantine:
+    """ Tolerant mode for DelimitedFileWriter.
+
+        Instead of aborting on the first malformed record, each line of the
+        wrong length, or that cannot be decoded, is written to the CSV file
+        reject_filename with its 1-based line number, its byte offset in the
+        fixed width file, the reason and the line itself. Bytes that cannot be
+        decoded are written as backslash escapes. Good records carry on to the
+        delimited file.
+
+        The run is still aborted with ErrorRateExceeded once more than
+        max_errors records have been rejected, or once the fraction of
+        rejected records exceeds max_error_rate. The rate is checked after
+        min_records records have been read, and again at the end of the run.
+    """
+
+    def __init__(
+        self,
+        reject_filename,
+        max_errors=None,
+        max_error_rate=None,
+        min_records=DEFAULT_MIN_RECORDS,
+    ):
+        self.reject_filename = reject_filename
+        self.max_errors = max_errors
+        self.max_error_rate = max_error_rate
+        self.min_records = min_records
+        self._file = None
+        self._writer = None
+
+    def open(self, offset=0):
+        """ Opens the reject file. A resumed run passes the checkpointed
+            offset, and the file is truncated there and appended to.
+        """
+        if offset:
+            os.truncate(self.reject_filename, offset)
+            self._file = open(self.reject_filename, "a", encoding="utf-8", newline="")
+            self._writer = csv.writer(self._file, lineterminator="\n")
+        else:
+            self._file = open(self.reject_filename, "w", encoding="utf-8", newline="")
+            self._writer = csv.writer(self._file, lineterminator="\n")
+            self._writer.writerow(["line_number", "byte_offset", "reason", "record"])
+
+    def sync(self):
+        """ Flushes the reject file to disk and returns its length in bytes.
+        """
+        if self._file is None:
+            # Closed, and so flushed, at the end of the run
+            return os.path.getsize(self.reject_filename)
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        return self._file.buffer.tell()
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def reject(self, summary, line_number, byte_offset, line, encoding, reason):
+        """ Writes a rejected line, which is bytes or a line decoded with
+            surrogateescape, and aborts the run if the limits are exceeded.
+        """
+        summary.records_rejected += 1
+        if isinstance(line, str):
+            line = line.encode(encoding, errors="surrogateescape")
+        line = line.decode(encoding, errors="backslashreplace")
+        self._writer.writerow([line_number, byte_offset, reason, line])
+
+        if self.max_errors is not None and summary.records_rejected > self.max_errors:
+            raise ErrorRateExceeded(
+                f"More than {self.max_errors} records rejected", summary
+            )
+        if summary.records_read >= self.min_records:
+            self.check_error_rate(summary)
+
+    def check_error_rate(self, summary):
+        if self.max_error_rate is not None and summary.error_rate > self.max_error_rate:
+            raise ErrorRateExceeded(
+                f"Error rate {summary.error_rate:.2%} exceeds "
+                f"{self.max_error_rate:.2%}",
+                summary,
+            )
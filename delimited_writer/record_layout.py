@@ -0,0 +1,274 @@
+"""
+Compiled fixed width record layout
+"""
+
+import codecs
+import struct
+from itertools import accumulate
+
+# Codecs in which every character is exactly one byte, so that byte and
+# character positions within a record coincide.
+SINGLE_BYTE_ENCODINGS = frozenset(
+    {"cp1252", "cp1250", "iso8859-1", "cp437", "cp037", "cp500"}
+)
+
+# Number of bytes read from the fixed width file at a time
+DEFAULT_BLOCK_SIZE = 1 << 20
+
+
+def is_single_byte_encoding(encoding):
+    """ Returns True if encoding maps every character to exactly one byte.
+    """
+    return codecs.lookup(encoding).name in SINGLE_BYTE_ENCODINGS
+
+
+class RecordLayout:
+    """ A compiled form of the column offsets provided in 'spec.json'.
+
+        The start and end position of every column and the total record
+        length are computed once, so that splitting a record costs one slice
+        per column instead of summing the preceding offsets for each field.
+
+        For single byte encodings, such as cp1252, a struct.Struct unpacker
+        is also compiled. This allows fields to be cut straight out of the
+        raw bytes of a record before anything is decoded.
+
+        Fields have their space padding removed in the same way as the
+        original parser, i.e. every ' ' in the field is dropped.
+
+        Raw records are searched for the bytes of ' ', '\n' and '\r' in the
+        fixed width encoding, which are those of ASCII in every supported
+        code page except EBCDIC, e.g. b"@" and b"%" for ' ' and '\n' in
+        cp037. They are kept as space, line_feed and carriage_return.
+
+        A layout may be projected onto a subset of columns, given as a list of
+        column indices in output order. The unpacker then skips the other
+        columns as pad bytes, so they are never copied or decoded.
+    """
+
+    def __init__(self, offsets, encoding, columns=None):
+        self.offsets = list(offsets)
+        self.encoding = encoding
+        self.ends = list(accumulate(self.offsets))
+        self.starts = [0] + self.ends[:-1]
+        self.bounds = list(zip(self.starts, self.ends))
+        self.record_length = self.ends[-1] if self.ends else 0
+        self.single_byte = is_single_byte_encoding(encoding)
+        if self.single_byte:
+            self.space, self.line_feed, self.carriage_return = (
+                char.encode(encoding) for char in " \n\r"
+            )
+        else:
+            self.space, self.line_feed, self.carriage_return = b" ", b"\n", b"\r"
+        self.crlf = self.carriage_return + self.line_feed
+
+        if columns is None:
+            columns = range(len(self.offsets))
+        self.columns = list(columns)
+        self.column_bounds = [self.bounds[i] for i in self.columns]
+        selected = sorted(set(self.columns))
+        # Position of each output column within the unpacked fields, when the
+        # output order differs from the file order
+        if self.columns == selected:
+            self.order = None
+        else:
+            self.order = [selected.index(i) for i in self.columns]
+
+        if self.single_byte:
+            self.unpacker = struct.Struct(
+                "".join(
+                    f"{offset}s" if i in self.columns else f"{offset}x"
+                    for i, offset in enumerate(self.offsets)
+                )
+            )
+        else:
+            self.unpacker = None
+
+    def __reduce__(self):
+        # struct.Struct cannot be pickled, so rebuild from the spec instead.
+        # This allows layouts to be passed to worker processes.
+        return (self.__class__, (self.offsets, self.encoding, self.columns))
+
+    def project(self, columns):
+        """ Returns a layout producing only the column indices in columns.
+        """
+        return self.__class__(self.offsets, self.encoding, columns)
+
+    def split_line(self, line):
+        """ Splits a decoded line, without its newline, into stripped fields.
+        """
+        if len(line) != self.record_length:
+            raise ValueError("One or more fields are of incorrect length")
+        return [line[start:end].replace(" ", "") for start, end in self.column_bounds]
+
+    def split_record(self, record):
+        """ Splits the raw bytes of a record into stripped, decoded fields.
+            Only available for single byte encodings.
+
+            Records never contain a newline, so the unpacked fields are joined
+            on line_feed, stripped and decoded in one call each, then split
+            apart again. This avoids a decode call per field.
+        """
+        fields = self.unpacker.unpack(record)
+        if self.order is not None:
+            fields = [fields[i] for i in self.order]
+        fields = self.line_feed.join(fields).replace(self.space, b"")
+        return fields.decode(self.encoding).split("\n")
+
+    def detect_newline(self, f):
+        """ Detects the newline convention of binary file object f from its
+            first record, returning the bytes of '\r\n', '\n' or '\r' in the
+            fixed width encoding.
+
+            b"" is returned for an empty file or a file holding a single
+            unterminated record. The file position is restored afterwards.
+        """
+        position = f.tell()
+        f.seek(0)
+        head = f.read(self.record_length + 2)
+        f.seek(position)
+
+        terminator = head[self.record_length :]
+        if not head or (terminator == b"" and len(head) == self.record_length):
+            return b""
+        if terminator == self.crlf:
+            return self.crlf
+        if terminator[:1] in {self.line_feed, self.carriage_return}:
+            return terminator[:1]
+        raise ValueError("One or more fields are of incorrect length")
+
+    def count_records(self, file_size, newline):
+        """ Returns the number of records in a file of file_size bytes.
+            Every record is record_length bytes followed by newline, except
+            that the final record may be unterminated. Any other size means a
+            line is of the wrong length, or the newline varies between lines.
+        """
+        stride = self.record_length + len(newline)
+        if stride == 0:
+            return 0
+        full, remainder = divmod(file_size, stride)
+        if remainder == 0:
+            return full
+        if remainder == self.record_length:
+            return full + 1
+        raise ValueError("One or more fields are of incorrect length")
+
+    def scan_lines(self, f, tolerant=False, block_size=DEFAULT_BLOCK_SIZE, offset=0):
+        """ Reads binary file object f block by block and yields the byte
+            offset and decoded text of each line, without its newline,
+            followed by the offset of the next line. For encodings whose
+            characters take several bytes, such as utf-8, in which '\r' and
+            '\n' are never part of another character, so that lines are
+            split before they are decoded.
+
+            As with universal newlines, '\r', '\n' and '\r\n' are all
+            accepted as line terminators. A ValueError is raised for any line
+            whose length in characters does not match record_length, unless
+            tolerant, in which case the line is yielded for the caller to
+            reject, with any bytes that cannot be decoded escaped as by
+            surrogateescape.
+        """
+        encoding = self.encoding
+        errors = "surrogateescape" if tolerant else "strict"
+        record_length = self.record_length
+        newlines = self.crlf
+        buffer = b""
+        eof = False
+
+        while not eof:
+            block = f.read(block_size)
+            eof = not block
+            # bytes.splitlines() splits on '\r', '\n' and '\r\n' only
+            lines = (buffer + block).splitlines(keepends=True)
+            buffer = b""
+            if lines and not eof:
+                # The last line may go on, or end in '\r\n', in the next block
+                buffer = lines.pop()
+            for line in lines:
+                next_offset = offset + len(line)
+                line = line.rstrip(newlines).decode(encoding, errors)
+                if len(line) != record_length and not tolerant:
+                    raise ValueError("One or more fields are of incorrect length")
+                yield offset, line, next_offset
+                offset = next_offset
+
+    def iter_records(self, f, block_size=DEFAULT_BLOCK_SIZE):
+        """ Reads binary file object f block by block and yields the raw bytes
+            of each record, without its newline. See scan().
+        """
+        for _, record, _ in self.scan(f, block_size=block_size):
+            yield record
+
+    def scan(self, f, tolerant=False, block_size=DEFAULT_BLOCK_SIZE, offset=0):
+        """ Reads binary file object f block by block and yields the byte
+            offset and raw bytes of each record, without its newline, followed
+            by the offset of the next line. offset is the position of f when
+            the scan starts.
+
+            As with universal newlines, '\r', '\n' and '\r\n' are all
+            accepted as record terminators, and may be mixed within a file.
+            The final record need not be terminated.
+
+            A ValueError is raised for any line whose length does not match
+            record_length. If tolerant, such a line is instead yielded whole,
+            so its length differs from record_length, and scanning resumes
+            after its newline. Only available for single byte encodings.
+        """
+        record_length = self.record_length
+        line_feed, carriage_return = self.line_feed, self.carriage_return
+        crlf = self.crlf
+        newlines = {line_feed, carriage_return}
+        buffer = b""
+        eof = False
+
+        while not eof:
+            block = f.read(block_size)
+            eof = not block
+            buffer += block
+            end = len(buffer)
+            # Keep enough bytes back to tell '\r' from '\r\n' at a block edge
+            limit = end if eof else end - record_length - 2
+            position = 0
+
+            while position < end and position <= limit:
+                record_end = position + record_length
+                record = buffer[position:record_end]
+                terminator = buffer[record_end : record_end + 2]
+                if record_end > end or line_feed in record or carriage_return in record:
+                    next_position = None
+                elif terminator == crlf:
+                    next_position = record_end + 2
+                elif terminator[:1] in newlines:
+                    next_position = record_end + 1
+                elif record_end == end:
+                    next_position = record_end
+                else:
+                    next_position = None
+
+                if next_position is None:
+                    if not tolerant:
+                        raise ValueError("One or more fields are of incorrect length")
+                    # Resynchronise on the newline ending the malformed line
+                    line_end = find_newline(buffer, position, newlines)
+                    if not eof and (line_end == -1 or line_end + 1 == end):
+                        break
+                    if line_end == -1:
+                        line_end = end
+                    record = buffer[position:line_end]
+                    if buffer[line_end : line_end + 2] == crlf:
+                        next_position = line_end + 2
+                    else:
+                        next_position = min(line_end + 1, end)
+
+                yield offset + position, record, offset + next_position
+                position = next_position
+
+            buffer = buffer[position:]
+            offset += position
+
+
+def find_newline(buffer, start, newlines=(b"\n", b"\r")):
+    """ Returns the index of the first of newlines in buffer from start, or -1.
+    """
+    found = [buffer.find(newline, start) for newline in newlines]
+    return min((index for index in found if index != -1), default=-1)
@@ -0,0 +1,261 @@
+"""
+Memory-mapped random access to the records of a fixed width file
+"""
+
+import mmap
+from array import array
+
+from delimited_writer.record_view import RecordSchema, RecordView
+
+# Records checked at once by FixedWidthRecordReader.views()
+VIEW_BLOCK_SIZE = 4096
+
+
+class FixedWidthRecordReader:
+    """ Provides random access to the records of the fixed width file named in
+        encoding_props, without parsing the whole file.
+
+        The file is memory-mapped. Since every record is the same number of
+        bytes, the position of record n is computed directly as
+        n * (record_length + len(newline)), where the newline is detected from
+        the first record. Only the records and fields that are asked for are
+        decoded, with padding removed as in DelimitedFileWriter.
+
+        If the newline convention varies within the file, record positions can
+        no longer be computed. In that rare case an index of record positions
+        is built by scanning the file once. As a file of mixed newlines may
+        still be a whole number of strides long, the records of its first and
+        last VIEW_BLOCK_SIZE are checked to lie at the stride when it is
+        opened, and each record again as it is read.
+
+        Usage:
+            with FixedWidthRecordReader(encoding_props) as reader:
+                reader[7300112]         # one record, as a list of fields
+                reader[1000:2000]       # a list of records
+                reader.column("f5")     # every value of one column
+                reader.record(42, ["f1", "f5"])
+                for view in reader.views():   # lazy RecordViews
+                    view["f5"]
+
+        Only single byte fixed width encodings are supported.
+    """
+
+    def __init__(self, encoding_props):
+        self.encoding_props = encoding_props
+        self.layout = encoding_props.layout
+        if not self.layout.single_byte:
+            raise ValueError(
+                "Random access requires a single byte fixed width encoding"
+            )
+        self.column_indices = {
+            name: i for i, name in enumerate(encoding_props.column_names)
+        }
+        self.index = None
+        self.schema = RecordSchema(self.layout, encoding_props.column_names)
+        self._map = None
+        self._view = None
+
+        with open(encoding_props.fixed_width_filename, "rb") as f:
+            self.newline = self.layout.detect_newline(f)
+            self.file_size = f.seek(0, 2)
+            if self.file_size:
+                self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                self._view = memoryview(self._map)
+
+        self.stride = self.layout.record_length + len(self.newline)
+        try:
+            self.record_count = self.layout.count_records(
+                self.file_size, self.newline
+            )
+        except ValueError:
+            self.build_index()
+        else:
+            if not self._is_stride():
+                self.build_index()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        if self._map is not None:
+            # Views of the records fail from now on, rather than the close
+            self._view.release()
+            self._map.close()
+            self._map = None
+
+    def __len__(self):
+        return self.record_count
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            return [self.record(i) for i in range(*key.indices(self.record_count))]
+        return self.record(key)
+
+    def __iter__(self):
+        for i in range(self.record_count):
+            yield self.record(i)
+
+    def build_index(self):
+        """ Scans the file once, recording the start position of every record.
+            Accepts '\\r', '\\n' and '\\r\\n' terminators in any mix.
+        """
+        layout = self.layout
+        record_length = layout.record_length
+        data = self._map
+        index = array("q")
+        position = 0
+        while position < self.file_size:
+            record_end = position + record_length
+            if record_end > self.file_size or self._has_newline(position, record_end):
+                raise ValueError("One or more fields are of incorrect length")
+            index.append(position)
+            if data[record_end : record_end + 2] == layout.crlf:
+                position = record_end + 2
+            elif data[record_end : record_end + 1] in {
+                layout.line_feed,
+                layout.carriage_return,
+            }:
+                position = record_end + 1
+            elif record_end == self.file_size:
+                position = record_end
+            else:
+                raise ValueError("One or more fields are of incorrect length")
+        self.index = index
+        self.record_count = len(index)
+
+    def position(self, n):
+        """ Returns the byte offset of record n. Negative n counts from the end.
+        """
+        if n < 0:
+            n += self.record_count
+        if not 0 <= n < self.record_count:
+            raise IndexError("record index out of range")
+        if self.index is not None:
+            return self.index[n]
+
+        position = n * self.stride
+        if not self._is_record(position):
+            # Newlines vary within the file, so the stride is not reliable
+            self.build_index()
+            return self.position(n)
+        return position
+
+    def raw(self, n):
+        """ Returns the raw bytes of record n, without its newline.
+        """
+        position = self.position(n)
+        return self._map[position : position + self.layout.record_length]
+
+    def record(self, n, columns=None):
+        """ Returns the stripped, decoded fields of record n. If columns, a
+            list of column names, is given only those fields are decoded.
+        """
+        if columns is None:
+            return self.layout.split_record(self.raw(n))
+        record = self.raw(n)
+        encoding = self.layout.encoding
+        space = self.layout.space
+        bounds = self.layout.bounds
+        return [
+            record[slice(*bounds[self.column_indices[name]])]
+            .replace(space, b"")
+            .decode(encoding)
+            for name in columns
+        ]
+
+    def view(self, n):
+        """ Returns a RecordView of record n, decoding nothing until a field
+            is accessed.
+        """
+        return RecordView(self._view, self.position(n), self.schema)
+
+    def views(self, start=0, stop=None):
+        """ Yields a RecordView of each record from start to stop. Views share
+            the memory map of the file and one RecordSchema.
+
+            Records are checked VIEW_BLOCK_SIZE at a time, by counting the
+            newlines of the block and checking that each terminator is where
+            the stride puts it, rather than one at a time as by position().
+        """
+        buffer = self._view
+        schema = self.schema
+        start, stop, _ = slice(start, stop).indices(self.record_count)
+        for first in range(start, stop, VIEW_BLOCK_SIZE):
+            last = min(first + VIEW_BLOCK_SIZE, stop)
+            if self.index is None and self._is_block(first, last):
+                stride = self.stride
+                for position in range(first * stride, last * stride, stride):
+                    yield RecordView(buffer, position, schema)
+            else:
+                for n in range(first, last):
+                    yield RecordView(buffer, self.position(n), schema)
+
+    def _is_block(self, first, last):
+        """ Checks that records first to last lie at the fixed stride.
+        """
+        newline = self.newline
+        start = first * self.stride
+        end = min(last * self.stride, self.file_size)
+        block = self._map[start:end]
+        count = last - first
+        # The final record of the file may have no newline
+        terminators = count if end - start == count * self.stride else count - 1
+        record_length = self.layout.record_length
+        for i, char in enumerate(newline):
+            found = block[record_length + i :: self.stride]
+            if found[:terminators] != bytes([char]) * terminators:
+                return False
+        newlines = block.count(self.layout.line_feed) + block.count(
+            self.layout.carriage_return
+        )
+        return newlines == terminators * len(newline)
+
+    def column(self, name, start=0, stop=None):
+        """ Returns the stripped, decoded values of column `name` for records
+            start to stop, decoding nothing else.
+        """
+        field_start, field_end = self.layout.bounds[self.column_indices[name]]
+        encoding = self.layout.encoding
+        space = self.layout.space
+        data = self._map
+        values = []
+        for n in range(*slice(start, stop).indices(self.record_count)):
+            position = self.position(n)
+            values.append(
+                data[position + field_start : position + field_end]
+                .replace(space, b"")
+                .decode(encoding)
+            )
+        return values
+
+    def _is_stride(self):
+        """ Checks that the first and last blocks of records lie at the fixed
+            stride, reading no more than two blocks of the file.
+        """
+        count = self.record_count
+        first_block = min(VIEW_BLOCK_SIZE, count)
+        last_block = max(first_block, count - VIEW_BLOCK_SIZE)
+        return (
+            not count
+            or self._is_block(0, first_block)
+            and (last_block == count or self._is_block(last_block, count))
+        )
+
+    def _is_record(self, position):
+        """ Checks that a whole record, followed by a newline or the end of
+            the file, starts at position.
+        """
+        record_end = position + self.layout.record_length
+        if self._has_newline(position, record_end):
+            return False
+        return record_end == self.file_size or self._map[record_end] in self.layout.crlf
+
+    def _has_newline(self, start, end):
+        data = self._map
+        return (
+            data.find(self.layout.line_feed, start, end) != -1
+            or data.find(self.layout.carriage_return, start, end) != -1
+        )
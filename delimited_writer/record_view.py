@@ -0,0 +1,80 @@
+"""
+Lazy views of fixed width records over a shared buffer
+"""
+
+import codecs
+
+
+class RecordSchema:
+    """ What every RecordView of one layout shares: the column names, their
+        byte bounds and the decoder, looked up once rather than per record.
+        The decoder takes the memoryview of a field directly, without a copy
+        or a codec lookup by name.
+    """
+
+    __slots__ = ("layout", "column_names", "columns", "bounds", "decode")
+
+    def __init__(self, layout, column_names):
+        self.layout = layout
+        self.column_names = tuple(column_names)
+        self.columns = {name: i for i, name in enumerate(self.column_names)}
+        self.bounds = layout.bounds
+        self.decode = codecs.getdecoder(layout.encoding)
+
+
+class RecordView:
+    """ A read-only view of one record in a shared memoryview buffer.
+
+        Nothing is decoded until a field is asked for, by column name or
+        index, as view["f5"] or view[4]; each access decodes and strips that
+        field alone, as DelimitedFileWriter does. as_tuple() and as_dict()
+        decode the whole record in one call. len() and iteration cover the
+        decoded fields, and raw is the record's bytes.
+
+        Views hold only the buffer, an offset and the shared RecordSchema, so
+        a view costs one small object and no copy of the record. A view is
+        valid as long as its buffer: views of a FixedWidthRecordReader
+        cannot be read once the reader is closed.
+    """
+
+    __slots__ = ("_buffer", "_start", "_schema")
+
+    def __init__(self, buffer, start, schema):
+        self._buffer = buffer
+        self._start = start
+        self._schema = schema
+
+    def __getitem__(self, key):
+        schema = self._schema
+        if isinstance(key, str):
+            try:
+                key = schema.columns[key]
+            except KeyError:
+                raise KeyError(f"Unknown column: {key}") from None
+        start, end = schema.bounds[key]
+        offset = self._start
+        field = schema.decode(self._buffer[offset + start : offset + end])[0]
+        return field.replace(" ", "")
+
+    def __len__(self):
+        return len(self._schema.column_names)
+
+    def __iter__(self):
+        return iter(self.as_tuple())
+
+    @property
+    def raw(self):
+        start = self._start
+        return self._buffer[start : start + self._schema.layout.record_length].tobytes()
+
+    def keys(self):
+        return self._schema.column_names
+
+    def as_tuple(self):
+        return tuple(self._schema.layout.split_record(self.raw))
+
+    def as_dict(self):
+        return dict(zip(self._schema.column_names, self.as_tuple()))
+
+    def __repr__(self):
+        return f"RecordView({self.as_dict()})"
@@ -0,0 +1,204 @@
+"""
+Byte to byte transcoding of single byte fixed width records
+"""
+
+import csv
+import io
+import time
+from operator import itemgetter
+
+
+def can_transcode(layout):
+    """ Returns True if records of layout can be written by a Transcoder.
+
+        A single column is left to csv.writer, which quotes a record holding
+        only an empty field, so that it is not read back as a blank line.
+    """
+    return layout.single_byte and len(layout.columns) > 1
+
+
+class Transcoder:
+    """ Formats the raw records of a single byte fixed width encoding as
+        delimited text in output_encoding, such as UTF-8, without decoding
+        them to str.
+
+        The tables are computed once per code page: the output bytes of each
+        of the 256 input bytes, and a bytes.translate() table mapping every
+        byte whose output is a single byte, which covers ASCII. A batch of
+        records is then unpacked, joined with the encoded separator and
+        newline, stripped of spaces and translated, each in one call over the
+        whole batch, with no str or csv.writer call per record. In an ASCII
+        compatible code page a batch holding only ASCII is its own output,
+        and EBCDIC batches are translated. A batch holding characters that
+        take several bytes in the output, e.g. 'é' in UTF-8, is decoded and
+        encoded by the codecs instead, still in one call.
+
+        Fields holding a ',' or '"' are quoted as csv.writer quotes them,
+        within '"' and with every '"' doubled, before the batch is
+        transcoded. Records never hold a line break, which is the other
+        reason csv.writer quotes a field. Rows of str, such as the header,
+        are formatted by csv.writer itself.
+
+        Given a ConversionMetrics, unpacking, joining and stripping a batch
+        is timed as slice, and transcoding it as decode.
+    """
+
+    def __init__(self, layout, output_encoding, lineterminator):
+        if not can_transcode(layout):
+            raise ValueError(
+                "Transcoding requires a single byte fixed width encoding and "
+                "more than one column"
+            )
+        encoding = layout.encoding
+        self.layout = layout
+        self.encoding = encoding
+        self.output_encoding = output_encoding
+        self.unpack = layout.unpacker.unpack
+        self.order = None if layout.order is None else itemgetter(*layout.order)
+        self.space = layout.space
+        self.separator = ",".encode(encoding)
+        self.newline = lineterminator.encode(encoding)
+        self.output_line_feed = "\n".encode(output_encoding)
+        self.quote = '"'.encode(encoding)
+        self.escaped_quote = self.quote * 2
+        self.separators = len(layout.columns) - 1
+
+        self.outputs = []
+        undefined = bytearray()
+        for byte in range(256):
+            try:
+                output = bytes([byte]).decode(encoding).encode(output_encoding)
+            except UnicodeError:
+                undefined.append(byte)
+                output = b""
+            self.outputs.append(output)
+        self.undefined = bytes(undefined)
+        narrow = [len(output) == 1 for output in self.outputs]
+        self.narrow = bytes(byte for byte in range(256) if narrow[byte])
+        self.table = bytes(
+            self.outputs[byte][0] if narrow[byte] else byte for byte in range(256)
+        )
+        self.ascii = self.table[:128] == bytes(range(128)) and all(narrow[:128])
+
+        self.text = io.StringIO()
+        self.csv_writer = csv.writer(
+            self.text, delimiter=",", lineterminator=lineterminator
+        )
+
+    def check(self, record):
+        """ Returns record, first raising UnicodeDecodeError, as
+            RecordLayout.split_record() would, if it holds a byte that the
+            code page leaves undefined. Without a quarantine there is no need,
+            as transcoding the batch raises it.
+        """
+        undefined = self.undefined
+        if undefined and len(record.translate(None, undefined)) != len(record):
+            record.decode(self.encoding)
+        return record
+
+    def format_records(self, records, metrics=None):
+        """ Returns the delimited bytes of a batch of raw records.
+        """
+        if not records:
+            return b""
+        start = time.perf_counter()
+        fields = map(self.unpack, records)
+        if self.order is not None:
+            fields = map(self.order, fields)
+        joined = b"".join(records)
+        if self.separator in joined or self.quote in joined:
+            lines = map(self.join_quoted, fields)
+        else:
+            lines = map(self.separator.join, fields)
+        newline = self.newline
+        data = (newline.join(lines) + newline).replace(self.space, b"")
+        if metrics is None:
+            return self.transcode(data)
+        sliced = time.perf_counter()
+        data = self.transcode(data)
+        metrics.add_transcode(sliced - start, time.perf_counter() - sliced)
+        return data
+
+    def join_quoted(self, fields):
+        """ Joins the fields of a record, quoting those that need it.
+        """
+        separator, quote = self.separator, self.quote
+        line = separator.join(fields)
+        if quote not in line and line.count(separator) == self.separators:
+            return line
+        escaped_quote = self.escaped_quote
+        return separator.join(
+            [
+                quote + field.replace(quote, escaped_quote) + quote
+                if separator in field or quote in field
+                else field
+                for field in fields
+            ]
+        )
+
+    def transcode_columns(self, records, metrics=None):
+        """ Returns the values of each column of a batch of raw records, as
+            lists of stripped values in output_encoding.
+
+            The values of a column are joined on the code page's line feed,
+            which no record holds, transcoded in one call, then split apart.
+        """
+        clock = time.perf_counter
+        start = clock()
+        fields = map(self.unpack, records)
+        if self.order is not None:
+            fields = map(self.order, fields)
+        line_feed = self.layout.line_feed
+        space = self.space
+        columns = [
+            line_feed.join(values).replace(space, b"") for values in zip(*fields)
+        ]
+        sliced = clock()
+        columns = [
+            self.transcode(column).split(self.output_line_feed) for column in columns
+        ]
+        if metrics is not None:
+            metrics.add_transcode(sliced - start, clock() - sliced)
+        return columns
+
+    def transcode(self, data):
+        """ Returns bytes data of the code page in output_encoding.
+        """
+        if self.ascii and data.isascii():
+            return data
+        if not data.translate(None, self.narrow):
+            return data.translate(self.table)
+        return data.decode(self.encoding).encode(self.output_encoding)
+
+    def format_rows(self, rows):
+        """ Returns the delimited bytes of rows of str, written by csv.writer.
+        """
+        text = self.text
+        text.seek(0)
+        text.truncate()
+        self.csv_writer.writerows(rows)
+        return text.getvalue().encode(self.output_encoding)
+
+    def writer(self, f, metrics=None):
+        """ Returns a TranscodingWriter to binary file object f.
+        """
+        return TranscodingWriter(f, self, metrics)
+
+
+class TranscodingWriter:
+    """ Stands in for csv.writer in a run whose records are raw bytes.
+        writerows() takes raw records and writerow() a row of str, such as
+        the header. Given a ConversionMetrics, the records are timed as
+        Transcoder.format_records() describes.
+    """
+
+    def __init__(self, f, transcoder, metrics=None):
+        self.f = f
+        self.transcoder = transcoder
+        self.metrics = metrics
+
+    def writerow(self, row):
+        self.f.write(self.transcoder.format_rows([row]))
+
+    def writerows(self, records):
+        self.f.write(self.transcoder.format_records(list(records), self.metrics))
@@ -1,9 +1,50 @@
 from delimited_writer.delimited_writer import DelimitedFileWriter
-from delimited_writer.fixed_width_writer import MockFixedWidthFileWriter
+from delimited_writer.fixed_width_writer import (
+    FixedWidthFileWriter,
+    MockFixedWidthFileWriter,
+    split_on_lines,
+)
 from delimited_writer.encoding_properties import EncodingProperties
+from delimited_writer.record_reader import VIEW_BLOCK_SIZE, FixedWidthRecordReader
+from delimited_writer.columnar import ColumnarParser
+from delimited_writer import columnar
+from delimited_writer.predicates import Equals, InSet, Prefix
+from delimited_writer.quarantine import ErrorRateExceeded, Quarantine
+from delimited_writer.checkpoint import CheckpointMismatch, checkpoint_filename
+from delimited_writer.follow import follow_filename
+from delimited_writer.column_stats import ColumnStatistics, HyperLogLog, stats_filename
+from delimited_writer.external_sort import ExternalSort
+from delimited_writer.column_store import (
+    ColumnStoreReader,
+    ColumnStoreWriter,
+    manifest_filename,
+)
+from delimited_writer import external_sort
+from delimited_writer import compression, parallel
+from delimited_writer.metrics import STAGES, Instrumentation, PROFILE_VARIABLE
+from delimited_writer.batch import (
+    BatchConverter,
+    ConversionJob,
+    SpecCache,
+    read_manifest,
+    watch_directory,
+)
+from benchmarks.synthetic import SyntheticFixedWidthFile
 
+import bz2
+import csv
+import gzip
+import io
+import lzma
+import pstats
+import json
 import unittest
 import os
+import shutil
+import subprocess
+import sys
+import tempfile
+from unittest import mock
 
 
 class CorrectEncodingDecoding(unittest.TestCase):
@@ -260,6 +301,1618 @@ class WrongFixedWidthFileEncoding(unittest.TestCase):
             self.delimited_data = self.delimited.parse_fixed_width_file()
 
 
+class StreamingConversion(unittest.TestCase):
+    """ Tests that the streaming convert() path writes the same delimited
+        file as parsing into memory and then generating the file.
+    """
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        spec_filename = "spec.json"
+        fixed_width_filename = os.path.join(self.directory, "fixed_width_cp1252.txt")
+        self.delimited_filename = os.path.join(self.directory, "delimited_utf8.txt")
+
+        # Set encoding properties
+        self.encoding_props = EncodingProperties(
+            spec_filename,
+            fixed_width_filename,
+            self.delimited_filename,
+            delimited_newline="\n",
+        )
+
+        # Generate mock fixed width data and file
+        self.fixed_width = MockFixedWidthFileWriter(
+            self.encoding_props, fixed_width_newline=None
+        )
+        self.fixed_width_data = self.fixed_width.generate_fixed_width_data()
+        self.fixed_width.write_fixed_width_file(self.fixed_width_data)
+        self.delimited = DelimitedFileWriter(self.encoding_props)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_convert_matches_two_step_api(self):
+        """ Write the delimited file both ways, using a batch size smaller
+            than the number of lines, and assert the files are identical.
+        """
+        delimited_data = self.delimited.parse_fixed_width_file()
+        self.delimited.generate_delimited_file(delimited_data)
+        with open(self.delimited_filename, "rb") as f:
+            expected = f.read()
+
+        self.delimited.convert(batch_size=3)
+        with open(self.delimited_filename, "rb") as f:
+            self.assertEqual(f.read(), expected)
+
+    def test_iter_fixed_width_records_is_lazy(self):
+        """ Ensure records are yielded one at a time rather than as a list.
+        """
+        records = self.delimited.iter_fixed_width_records()
+        self.assertNotIsInstance(records, list)
+        first = next(records)
+        expected = [field.replace(" ", "") for field in self.fixed_width_data[0]]
+        self.assertEqual(first, expected)
+        records.close()
+
+    def test_invalid_batch_size_raises_exception(self):
+        with self.assertRaises(ValueError):
+            self.delimited.convert(batch_size=0)
+
+
+class CompiledRecordLayout(unittest.TestCase):
+    """ Tests the RecordLayout compiled by EncodingProperties from spec.json.
+    """
+
+    def setUp(self):
+        self.encoding_props = EncodingProperties(
+            "spec.json", "fixed_width_cp1252.txt", "delimited_utf8.txt"
+        )
+        self.layout = self.encoding_props.layout
+
+    def test_boundaries_match_offsets(self):
+        offsets = self.encoding_props.offsets
+        self.assertEqual(self.layout.record_length, sum(offsets))
+        for i, (start, end) in enumerate(self.layout.bounds):
+            self.assertEqual(start, sum(offsets[0:i]))
+            self.assertEqual(end - start, offsets[i])
+        self.assertEqual(self.layout.unpacker.size, sum(offsets))
+
+    def test_split_record_matches_split_line(self):
+        fixed_width = MockFixedWidthFileWriter(self.encoding_props, None)
+        for line in fixed_width.generate_fixed_width_data():
+            line = "".join(line)
+            record = line.encode(self.encoding_props.fixed_width_encoding)
+            self.assertEqual(
+                self.layout.split_record(record), self.layout.split_line(line)
+            )
+
+    def test_iter_records_accepts_mixed_newlines_across_blocks(self):
+        """ Use a block size that splits '\r\n' terminators between reads.
+        """
+        records = [bytes([65 + i]) * self.layout.record_length for i in range(6)]
+        newlines = [b"\r\n", b"\n", b"\r", b"\r\n", b"\r", b""]
+        data = b"".join(r + n for r, n in zip(records, newlines))
+        for block_size in [1, 7, self.layout.record_length + 1, len(data)]:
+            f = io.BytesIO(data)
+            self.assertEqual(list(self.layout.iter_records(f, block_size)), records)
+
+    def test_iter_records_rejects_short_line(self):
+        data = b"A" * self.layout.record_length + b"\n" + b"B" * 10 + b"\n"
+        with self.assertRaises(ValueError):
+            list(self.layout.iter_records(io.BytesIO(data)))
+
+
+class ParallelConversion(unittest.TestCase):
+    """ Tests that convert_parallel() stitches the worker outputs together
+        into the same file as the single process convert().
+    """
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.fixed_width_filename = os.path.join(
+            self.directory, "fixed_width_cp1252.txt"
+        )
+        self.delimited_filename = os.path.join(self.directory, "delimited_utf8.txt")
+        self.encoding_props = EncodingProperties(
+            "spec.json", self.fixed_width_filename, self.delimited_filename
+        )
+        self.delimited = DelimitedFileWriter(self.encoding_props)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def helper_convert_both_ways(self, fixed_width_newline):
+        fixed_width = MockFixedWidthFileWriter(self.encoding_props, fixed_width_newline)
+        fixed_width.write_fixed_width_file(fixed_width.generate_fixed_width_data())
+
+        self.delimited.convert()
+        with open(self.delimited_filename, "rb") as f:
+            expected = f.read()
+        self.delimited.convert_parallel(workers=3, batch_size=2)
+        with open(self.delimited_filename, "rb") as f:
+            return expected, f.read()
+
+    def test_parallel_matches_streaming(self):
+        for fixed_width_newline in ["\n", "\r\n", "\r"]:
+            expected, actual = self.helper_convert_both_ways(fixed_width_newline)
+            self.assertEqual(actual, expected)
+
+    def test_unterminated_final_record(self):
+        self.helper_convert_both_ways("\n")
+        with open(self.fixed_width_filename, "rb+") as f:
+            f.truncate(os.path.getsize(self.fixed_width_filename) - 1)
+        self.delimited.convert()
+        with open(self.delimited_filename, "rb") as f:
+            expected = f.read()
+        self.delimited.convert_parallel(workers=2)
+        with open(self.delimited_filename, "rb") as f:
+            self.assertEqual(f.read(), expected)
+
+    def test_detect_newline(self):
+        layout = self.encoding_props.layout
+        record = b"A" * layout.record_length
+        for newline in [b"\n", b"\r\n", b"\r"]:
+            f = io.BytesIO(record + newline + record)
+            self.assertEqual(layout.detect_newline(f), newline)
+        self.assertEqual(layout.detect_newline(io.BytesIO(record)), b"")
+
+    def test_mixed_newlines_raise_exception(self):
+        record = b"A" * self.encoding_props.layout.record_length
+        with open(self.fixed_width_filename, "wb") as f:
+            f.write(record + b"\r\n" + record + b"\n" + record + b"\n")
+        with self.assertRaises(ValueError):
+            self.delimited.convert_parallel(workers=2)
+
+
+class RandomAccessRecordReader(unittest.TestCase):
+    """ Tests that FixedWidthRecordReader returns the same records as the
+        sequential parser, by index, slice and column.
+    """
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.fixed_width_filename = os.path.join(
+            self.directory, "fixed_width_cp1252.txt"
+        )
+        self.delimited_filename = os.path.join(self.directory, "delimited_utf8.txt")
+        self.encoding_props = EncodingProperties(
+            "spec.json", self.fixed_width_filename, self.delimited_filename
+        )
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def helper_write_and_parse(self, fixed_width_newline):
+        fixed_width = MockFixedWidthFileWriter(self.encoding_props, fixed_width_newline)
+        fixed_width.write_fixed_width_file(fixed_width.generate_fixed_width_data())
+        return DelimitedFileWriter(self.encoding_props).parse_fixed_width_file()
+
+    def test_indexing_and_slicing(self):
+        for fixed_width_newline in ["\n", "\r\n", "\r"]:
+            expected = self.helper_write_and_parse(fixed_width_newline)
+            with FixedWidthRecordReader(self.encoding_props) as reader:
+                self.assertEqual(len(reader), len(expected))
+                self.assertIsNone(reader.index)
+                self.assertEqual(reader[3], expected[3])
+                self.assertEqual(reader[-1], expected[-1])
+                self.assertEqual(reader[2:8:2], expected[2:8:2])
+                self.assertEqual(list(reader), expected)
+                with self.assertRaises(IndexError):
+                    reader[len(expected)]
+
+    def test_column_and_projected_record(self):
+        expected = self.helper_write_and_parse("\n")
+        with FixedWidthRecordReader(self.encoding_props) as reader:
+            self.assertEqual(reader.column("f5"), [line[4] for line in expected])
+            self.assertEqual(
+                reader.record(6, ["f10", "f1"]), [expected[6][9], expected[6][0]]
+            )
+
+    def test_mixed_newlines_fall_back_to_index(self):
+        record_length = self.encoding_props.layout.record_length
+        records = [bytes([65 + i]) * record_length for i in range(4)]
+        with open(self.fixed_width_filename, "wb") as f:
+            f.write(b"\r\n".join(records[:2]) + b"\n" + b"\r".join(records[2:]))
+        with FixedWidthRecordReader(self.encoding_props) as reader:
+            self.assertEqual(len(reader), 4)
+            self.assertIsNotNone(reader.index)
+            self.assertEqual(reader.raw(3), records[3])
+            self.assertEqual(reader.column("f1"), ["AAAAA", "BBBBB", "CCCCC", "DDDDD"])
+
+        # Mixed newlines adding up to a whole number of strides of "\n"
+        with open("spec.json") as f:
+            spec = json.load(f)
+        spec.update(ColumnNames=["f1"], Offsets=["3"])
+        encoding_props = EncodingProperties(
+            "spec.json", self.fixed_width_filename, self.delimited_filename, spec=spec
+        )
+        records = [b"%03d" % i for i in range(10)]
+        newlines = [b"\n"] + [b"\r\n"] * 4 + [b"\n"] * 5
+        with open(self.fixed_width_filename, "wb") as f:
+            f.write(b"".join(map(bytes.__add__, records, newlines)))
+        with FixedWidthRecordReader(encoding_props) as reader:
+            self.assertEqual(len(reader), 10)
+            self.assertIsNotNone(reader.index)
+            self.assertEqual(reader[9], ["009"])
+            self.assertEqual(list(reader), [[record.decode()] for record in records])
+            self.assertEqual(
+                [view["f1"] for view in reader.views()],
+                [record.decode() for record in records],
+            )
+
+    def test_well_formed_file_is_not_scanned_on_open(self):
+        with open("spec.json") as f:
+            spec = json.load(f)
+        spec.update(ColumnNames=["f1"], Offsets=["6"])
+        encoding_props = EncodingProperties(
+            "spec.json", self.fixed_width_filename, self.delimited_filename, spec=spec
+        )
+        count = 4 * VIEW_BLOCK_SIZE
+        with open(self.fixed_width_filename, "wb") as f:
+            f.write(b"".join(b"%06d\n" % i for i in range(count)))
+        build_index = mock.patch.object(
+            FixedWidthRecordReader,
+            "build_index",
+            autospec=True,
+            side_effect=FixedWidthRecordReader.build_index,
+        )
+        is_block = mock.patch.object(
+            FixedWidthRecordReader,
+            "_is_block",
+            autospec=True,
+            side_effect=FixedWidthRecordReader._is_block,
+        )
+        with build_index as patched_build_index, is_block as patched_is_block:
+            with FixedWidthRecordReader(encoding_props) as reader:
+                self.assertEqual(len(reader), count)
+                self.assertEqual(reader[count // 2], ["%06d" % (count // 2)])
+                self.assertEqual(reader.record(-1), ["%06d" % (count - 1)])
+                self.assertIsNone(reader.index)
+            patched_build_index.assert_not_called()
+            # Only the first and last blocks are checked
+            self.assertEqual(
+                [call.args[1:] for call in patched_is_block.call_args_list],
+                [(0, VIEW_BLOCK_SIZE), (count - VIEW_BLOCK_SIZE, count)],
+            )
+
+        # Seven "\r\n" between the checked blocks add up to one whole stride
+        newlines = [b"\n"] * (count - 1)
+        middle = 2 * VIEW_BLOCK_SIZE
+        newlines[middle : middle + 7] = [b"\r\n"] * 7
+        with open(self.fixed_width_filename, "wb") as f:
+            f.write(
+                b"".join(b"%06d" % i + newline for i, newline in enumerate(newlines))
+            )
+        with FixedWidthRecordReader(encoding_props) as reader:
+            self.assertEqual(len(reader), count)
+            self.assertIsNone(reader.index)
+            self.assertEqual(reader[middle + 3], ["%06d" % (middle + 3)])
+            self.assertIsNotNone(reader.index)
+            self.assertEqual(len(reader), count - 1)
+
+
+class LazyRecordViews(unittest.TestCase):
+    """ Tests that the RecordViews of FixedWidthRecordReader decode the same
+        fields as the reader, field by field.
+    """
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.fixed_width_filename = os.path.join(
+            self.directory, "fixed_width_cp1252.txt"
+        )
+        self.delimited_filename = os.path.join(self.directory, "delimited_utf8.txt")
+        self.encoding_props = EncodingProperties(
+            "spec.json", self.fixed_width_filename, self.delimited_filename
+        )
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_views_match_records(self):
+        column_names = self.encoding_props.column_names
+        for fixed_width_newline in ["\n", "\r\n", "\r"]:
+            fixed_width = MockFixedWidthFileWriter(
+                self.encoding_props, fixed_width_newline
+            )
+            fixed_width.write_fixed_width_file(fixed_width.generate_fixed_width_data())
+            with FixedWidthRecordReader(self.encoding_props) as reader:
+                views = list(reader.views())
+                self.assertEqual(len(views), len(reader))
+                for n, view in enumerate(views):
+                    record = reader.record(n)
+                    self.assertEqual(len(view), len(record))
+                    self.assertEqual(view[4], record[4])
+                    self.assertEqual(view["f5"], record[4])
+                    self.assertEqual(view.as_tuple(), tuple(record))
+                    self.assertEqual(list(view), record)
+                    self.assertEqual(view.as_dict(), dict(zip(column_names, record)))
+                    self.assertEqual(view.raw, reader.raw(n))
+                self.assertEqual(view.keys(), tuple(column_names))
+                self.assertEqual(reader.view(-1).as_tuple(), tuple(reader[-1]))
+                self.assertEqual(
+                    [view["f1"] for view in reader.views(2, 5)],
+                    reader.column("f1", 2, 5),
+                )
+                with self.assertRaises(KeyError):
+                    view["missing"]
+
+    def test_mixed_newlines(self):
+        record_length = self.encoding_props.layout.record_length
+        records = [bytes([65 + i]) * record_length for i in range(4)]
+        with open(self.fixed_width_filename, "wb") as f:
+            f.write(b"\r\n".join(records[:2]) + b"\n" + b"\r".join(records[2:]))
+        with FixedWidthRecordReader(self.encoding_props) as reader:
+            self.assertEqual([view.raw for view in reader.views()], records)
+            self.assertEqual(
+                [view["f1"] for view in reader.views()],
+                ["AAAAA", "BBBBB", "CCCCC", "DDDDD"],
+            )
+
+    def test_views_fail_once_reader_is_closed(self):
+        fixed_width = MockFixedWidthFileWriter(self.encoding_props, "\n")
+        fixed_width.write_fixed_width_file(fixed_width.generate_fixed_width_data())
+        with FixedWidthRecordReader(self.encoding_props) as reader:
+            view = reader.view(0)
+            self.assertTrue(view["f1"])
+        with self.assertRaises(ValueError):
+            view["f1"]
+
+
+class ColumnarParsing(unittest.TestCase):
+    """ Tests that ColumnarParser agrees with DelimitedFileWriter, with and
+        (where installed) without NumPy.
+    """
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.fixed_width_filename = os.path.join(
+            self.directory, "fixed_width_cp1252.txt"
+        )
+        self.delimited_filename = os.path.join(self.directory, "delimited_utf8.txt")
+        self.encoding_props = EncodingProperties(
+            "spec.json", self.fixed_width_filename, self.delimited_filename
+        )
+        fixed_width = MockFixedWidthFileWriter(self.encoding_props, "\r\n")
+        fixed_width_data = fixed_width.generate_fixed_width_data()
+        # Include a field with spaces inside its value as well as padding
+        fixed_width_data[4][1] = " A B   é    "
+        fixed_width.write_fixed_width_file(fixed_width_data)
+        delimited = DelimitedFileWriter(self.encoding_props)
+        self.expected = delimited.parse_fixed_width_file()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def helper_test_parser(self, use_numpy):
+        parser = ColumnarParser(self.encoding_props, use_numpy=use_numpy, batch_size=3)
+        self.assertEqual([list(row) for row in parser.iter_rows()], self.expected)
+        columns = parser.parse_columns(["f2", "f1"])
+        self.assertEqual(list(columns["f2"]), [line[1] for line in self.expected])
+        self.assertEqual(list(columns["f1"]), [line[0] for line in self.expected])
+
+    def test_pure_python_fallback(self):
+        self.helper_test_parser(use_numpy=False)
+
+    @unittest.skipIf(columnar.np is None, "NumPy is not installed")
+    def test_numpy_parser(self):
+        self.helper_test_parser(use_numpy=True)
+
+    def helper_test_trailing_nul(self, use_numpy):
+        fixed_width = MockFixedWidthFileWriter(self.encoding_props, "\n")
+        fixed_width_data = fixed_width.generate_fixed_width_data()
+        fixed_width_data[4][0] = "ab\0  "
+        fixed_width.write_fixed_width_file(fixed_width_data)
+        expected = DelimitedFileWriter(self.encoding_props).parse_fixed_width_file()
+        self.assertEqual(expected[4][0], "ab\0")
+
+        parser = ColumnarParser(self.encoding_props, use_numpy=use_numpy, batch_size=3)
+        self.assertEqual([list(row) for row in parser.iter_rows()], expected)
+        f1 = parser.parse_columns(["f1"])["f1"]
+        self.assertEqual(list(f1), [line[0] for line in expected])
+        self.assertEqual(parser.to_utf8(f1)[4], b"ab\0")
+
+    def test_pure_python_trailing_nul(self):
+        self.helper_test_trailing_nul(use_numpy=False)
+
+    @unittest.skipIf(columnar.np is None, "NumPy is not installed")
+    def test_numpy_trailing_nul(self):
+        self.helper_test_trailing_nul(use_numpy=True)
+
+    @unittest.skipIf(columnar.np is None, "NumPy is not installed")
+    def test_numpy_undefined_byte_raises_exception(self):
+        record_length = self.encoding_props.layout.record_length
+        with open(self.fixed_width_filename, "wb") as f:
+            f.write(b"A" * (record_length - 1) + b"\x81\n")
+        with self.assertRaises(UnicodeDecodeError):
+            ColumnarParser(self.encoding_props, use_numpy=True).parse_columns()
+
+
+class SyntheticDataGenerator(unittest.TestCase):
+    """ Tests that the benchmark data generator writes deterministic files
+        which the converter accepts.
+    """
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.fixed_width_filename = os.path.join(
+            self.directory, "fixed_width_cp1252.txt"
+        )
+        self.delimited_filename = os.path.join(self.directory, "delimited_utf8.txt")
+        self.encoding_props = EncodingProperties(
+            "spec.json", self.fixed_width_filename, self.delimited_filename
+        )
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def helper_generate(self, seed, **kwargs):
+        generator = SyntheticFixedWidthFile(self.encoding_props, seed=seed)
+        records = generator.write(**kwargs)
+        with open(self.fixed_width_filename, "rb") as f:
+            return records, f.read()
+
+    def test_same_seed_gives_same_file(self):
+        records, data = self.helper_generate(seed=1, record_count=5000)
+        self.assertEqual(records, 5000)
+        self.assertEqual(self.helper_generate(seed=1, record_count=5000)[1], data)
+        self.assertNotEqual(self.helper_generate(seed=2, record_count=5000)[1], data)
+
+    def test_generated_file_is_parsed(self):
+        size = 100 * (self.encoding_props.layout.record_length + 1)
+        records, data = self.helper_generate(seed=0, size=size)
+        self.assertEqual(len(data), size)
+        delimited = DelimitedFileWriter(self.encoding_props)
+        self.assertEqual(len(delimited.parse_fixed_width_file()), records)
+
+
+class ProjectionAndPredicates(unittest.TestCase):
+    """ Tests that a column subset and row predicates select the same records
+        as filtering the fully parsed data.
+    """
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        fixed_width_filename = os.path.join(self.directory, "fixed_width_cp1252.txt")
+        self.delimited_filename = os.path.join(self.directory, "delimited_utf8.txt")
+        self.encoding_props = EncodingProperties(
+            "spec.json", fixed_width_filename, self.delimited_filename, "\n"
+        )
+        fixed_width = MockFixedWidthFileWriter(self.encoding_props, "\n")
+        fixed_width.write_fixed_width_file(fixed_width.generate_fixed_width_data())
+        delimited = DelimitedFileWriter(self.encoding_props)
+        self.all_data = delimited.parse_fixed_width_file()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_projection_selects_and_orders_columns(self):
+        delimited = DelimitedFileWriter(self.encoding_props, columns=["f9", "f2", "f5"])
+        expected = [[line[8], line[1], line[4]] for line in self.all_data]
+        self.assertEqual(delimited.parse_fixed_width_file(), expected)
+
+        delimited.convert()
+        with open(self.delimited_filename, "r", encoding="utf-8", newline="") as f:
+            self.assertEqual(f.readline(), "f9,f2,f5\n")
+
+    def test_predicates(self):
+        first = self.all_data[0]
+        predicates = [
+            (Equals("f1", first[0]), lambda line: line[0] == first[0]),
+            (
+                InSet("f3", [first[2], self.all_data[-1][2]]),
+                lambda line: line[2] in {first[2], self.all_data[-1][2]},
+            ),
+            (Prefix("f4", first[3][0]), lambda line: line[3].startswith(first[3][0])),
+        ]
+        for predicate, check in predicates:
+            delimited = DelimitedFileWriter(self.encoding_props, predicates=[predicate])
+            expected = [line for line in self.all_data if check(line)]
+            self.assertEqual(delimited.parse_fixed_width_file(), expected)
+            self.assertIn(first, expected)
+
+    def test_parallel_projection_and_predicates(self):
+        first = self.all_data[0]
+        delimited = DelimitedFileWriter(
+            self.encoding_props,
+            columns=["f10", "f1"],
+            predicates=[Equals("f2", first[1]), Prefix("f1", first[0][:1])],
+        )
+        delimited.convert()
+        with open(self.delimited_filename, "rb") as f:
+            expected = f.read()
+        delimited.convert_parallel(workers=2)
+        with open(self.delimited_filename, "rb") as f:
+            self.assertEqual(f.read(), expected)
+        row = io.StringIO()
+        csv.writer(row, lineterminator="\n").writerow([first[9], first[0]])
+        self.assertIn(row.getvalue().encode("utf-8"), expected)
+
+    def test_unknown_columns_raise_exception(self):
+        with self.assertRaises(ValueError):
+            DelimitedFileWriter(self.encoding_props, columns=["f1", "f11"])
+        with self.assertRaises(ValueError):
+            DelimitedFileWriter(self.encoding_props, predicates=[Equals("f0", "A")])
+
+
+class QuarantineMalformedRecords(unittest.TestCase):
+    """ Tests that a tolerant run rejects malformed records to a reject file
+        while good records are still converted.
+    """
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.fixed_width_filename = os.path.join(
+            self.directory, "fixed_width_cp1252.txt"
+        )
+        self.delimited_filename = os.path.join(self.directory, "delimited_utf8.txt")
+        self.reject_filename = os.path.join(self.directory, "rejects_utf8.txt")
+        self.encoding_props = EncodingProperties(
+            "spec.json", self.fixed_width_filename, self.delimited_filename, "\n"
+        )
+        record_length = self.encoding_props.layout.record_length
+        self.good = [bytes([65 + i]) * record_length for i in range(6)]
+        self.lines = [
+            self.good[0],
+            b"short",
+            self.good[1],
+            b"X" * (record_length + 3),
+            self.good[2],
+            b"Y" * (record_length - 1) + b"\x81",
+            self.good[3],
+        ]
+        with open(self.fixed_width_filename, "wb") as f:
+            f.write(b"\r\n".join(self.lines))
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def helper_read_rejects(self):
+        with open(self.reject_filename, "r", encoding="utf-8", newline="") as f:
+            return list(csv.reader(f))[1:]
+
+    def test_bad_records_are_rejected(self):
+        delimited = DelimitedFileWriter(
+            self.encoding_props, quarantine=Quarantine(self.reject_filename)
+        )
+        summary = delimited.convert()
+        self.assertEqual(
+            [line[0] for line in delimited.parse_fixed_width_file()],
+            [record[:5].decode("cp1252") for record in self.good[:4]],
+        )
+        self.assertEqual(summary.records_read, 7)
+        self.assertEqual(summary.records_written, 4)
+        self.assertEqual(summary.records_rejected, 3)
+
+        rejects = self.helper_read_rejects()
+        offsets = [sum(len(line) + 2 for line in self.lines[:i]) for i in [1, 3, 5]]
+        self.assertEqual([int(reject[0]) for reject in rejects], [2, 4, 6])
+        self.assertEqual([int(reject[1]) for reject in rejects], offsets)
+        self.assertEqual(rejects[0][3], "short")
+        self.assertTrue(rejects[2][3].endswith("Y\\x81"))
+
+    def test_error_limits_abort_run(self):
+        for quarantine in [
+            Quarantine(self.reject_filename, max_errors=1),
+            Quarantine(self.reject_filename, max_error_rate=0.25, min_records=4),
+        ]:
+            delimited = DelimitedFileWriter(self.encoding_props, quarantine=quarantine)
+            with self.assertRaises(ErrorRateExceeded) as context:
+                delimited.convert()
+            self.assertEqual(context.exception.summary.records_rejected, 2)
+            self.assertEqual(len(self.helper_read_rejects()), 2)
+
+    def test_strict_mode_still_raises(self):
+        with self.assertRaises(ValueError):
+            DelimitedFileWriter(self.encoding_props).convert()
+
+    def test_multi_byte_rejects_have_byte_offsets(self):
+        with open("spec.json") as f:
+            spec = json.load(f)
+        spec["FixedWidthEncoding"] = "utf-8"
+        encoding_props = EncodingProperties(
+            "spec.json", self.fixed_width_filename, self.delimited_filename, spec=spec
+        )
+        record_length = encoding_props.layout.record_length
+        good = "é" * 5 + "A" * (record_length - 5)
+        lines = [
+            good.encode("utf-8") + b"\r\n",
+            "€ short".encode("utf-8") + b"\n",
+            good.encode("utf-8") + b"\r",
+            b"\xff" * record_length + b"\r\n",
+            good.encode("utf-8"),
+        ]
+        with open(self.fixed_width_filename, "wb") as f:
+            f.write(b"".join(lines))
+        delimited = DelimitedFileWriter(
+            encoding_props, quarantine=Quarantine(self.reject_filename)
+        )
+        summary = delimited.convert()
+        self.assertEqual(summary.records_written, 3)
+        self.assertEqual(summary.records_rejected, 2)
+
+        rejects = self.helper_read_rejects()
+        offsets = [sum(map(len, lines[:i])) for i in [1, 3]]
+        self.assertEqual([int(reject[0]) for reject in rejects], [2, 4])
+        self.assertEqual([int(reject[1]) for reject in rejects], offsets)
+        self.assertEqual(rejects[0][3], "€ short")
+        self.assertTrue(rejects[1][2].startswith("Cannot be decoded"))
+
+
+class CheckpointAndResume(unittest.TestCase):
+    """ Tests that an interrupted conversion resumes from its checkpoint and
+        produces the same files as an uninterrupted run.
+    """
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.fixed_width_filename = os.path.join(
+            self.directory, "fixed_width_cp1252.txt"
+        )
+        self.delimited_filename = os.path.join(self.directory, "delimited_utf8.txt")
+        self.reject_filename = os.path.join(self.directory, "rejects_utf8.txt")
+        self.checkpoint_filename = checkpoint_filename(self.delimited_filename)
+        self.encoding_props = EncodingProperties(
+            "spec.json", self.fixed_width_filename, self.delimited_filename, "\n"
+        )
+        SyntheticFixedWidthFile(self.encoding_props).write(record_count=200)
+        # Add malformed lines for the quarantine to reject
+        with open(self.fixed_width_filename, "rb") as f:
+            lines = f.read().split(b"\n")
+        lines[50:50] = [b"short"]
+        lines[150:150] = [b"also short"]
+        with open(self.fixed_width_filename, "wb") as f:
+            f.write(b"\n".join(lines))
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def helper_read(self, filename):
+        with open(filename, "rb") as f:
+            return f.read()
+
+    def helper_writer(self):
+        return DelimitedFileWriter(
+            self.encoding_props, quarantine=Quarantine(self.reject_filename)
+        )
+
+    def helper_interrupt(self, delimited, after):
+        """ Makes delimited's parser fail after yielding `after` records.
+        """
+        parse = delimited.iter_fixed_width_records
+
+        def interrupted(*args):
+            for i, record in enumerate(parse(*args)):
+                if i == after:
+                    raise KeyboardInterrupt
+                yield record
+
+        delimited.iter_fixed_width_records = interrupted
+
+    def test_resumed_run_matches_full_run(self):
+        self.helper_writer().convert(batch_size=10)
+        expected = self.helper_read(self.delimited_filename)
+        expected_rejects = self.helper_read(self.reject_filename)
+
+        delimited = self.helper_writer()
+        self.helper_interrupt(delimited, 105)
+        with self.assertRaises(KeyboardInterrupt):
+            delimited.convert(batch_size=10, checkpoint_every=25)
+        self.assertTrue(os.path.exists(self.checkpoint_filename))
+
+        summary = self.helper_writer().convert(batch_size=10, checkpoint_every=25)
+        self.assertEqual(self.helper_read(self.delimited_filename), expected)
+        self.assertEqual(self.helper_read(self.reject_filename), expected_rejects)
+        self.assertEqual(summary.records_read, 202)
+        self.assertEqual(summary.records_written, 200)
+        self.assertEqual(summary.records_rejected, 2)
+        self.assertFalse(os.path.exists(self.checkpoint_filename))
+
+    def test_changed_settings_or_files_raise_exception(self):
+        delimited = self.helper_writer()
+        self.helper_interrupt(delimited, 105)
+        with self.assertRaises(KeyboardInterrupt):
+            delimited.convert(batch_size=10, checkpoint_every=25)
+
+        with self.assertRaises(CheckpointMismatch):
+            DelimitedFileWriter(
+                self.encoding_props,
+                columns=["f1"],
+                quarantine=Quarantine(self.reject_filename),
+            ).convert(checkpoint_every=25)
+        with open(self.checkpoint_filename) as f:
+            output_offset = json.load(f)["output_offset"]
+        with open(self.delimited_filename, "r+b") as f:
+            f.seek(output_offset - 7)
+            f.write(b"changed")
+        with self.assertRaises(CheckpointMismatch):
+            self.helper_writer().convert(checkpoint_every=25)
+
+    def test_resumed_parallel_run_matches_full_run(self):
+        SyntheticFixedWidthFile(self.encoding_props).write(record_count=200)
+        DelimitedFileWriter(self.encoding_props).convert()
+        expected = self.helper_read(self.delimited_filename)
+
+        copy = parallel.shutil.copyfileobj
+        calls = []
+
+        def interrupted(source, destination):
+            calls.append(source)
+            if len(calls) == 3:
+                raise KeyboardInterrupt
+            copy(source, destination)
+
+        with mock.patch.object(parallel.shutil, "copyfileobj", interrupted):
+            with self.assertRaises(KeyboardInterrupt):
+                DelimitedFileWriter(self.encoding_props).convert_parallel(
+                    workers=2, checkpoint_every=30
+                )
+
+        summary = DelimitedFileWriter(self.encoding_props).convert_parallel(
+            workers=2, checkpoint_every=30
+        )
+        self.assertEqual(self.helper_read(self.delimited_filename), expected)
+        self.assertEqual(summary.records_written, 200)
+        self.assertFalse(os.path.exists(self.checkpoint_filename))
+
+
+class FollowMode(unittest.TestCase):
+    """ Tests that incremental runs over a growing, and rotated, fixed width
+        file append the same records as one conversion of all the data.
+    """
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.fixed_width_filename = os.path.join(self.directory, "feed.txt")
+        self.delimited_filename = os.path.join(self.directory, "feed.csv")
+        self.encoding_props = EncodingProperties(
+            "spec.json", self.fixed_width_filename, self.delimited_filename, "\n"
+        )
+        self.record_length = self.encoding_props.layout.record_length
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def helper_records(self, start, stop, newline=b"\n"):
+        return b"".join(
+            b"%0*d" % (self.record_length, i) + newline for i in range(start, stop)
+        )
+
+    def helper_append(self, data, filename=None):
+        with open(filename or self.fixed_width_filename, "ab") as f:
+            f.write(data)
+
+    def helper_expected(self, data):
+        """ Returns the delimited file of a single conversion of data.
+        """
+        fixed_width_filename = os.path.join(self.directory, "all.txt")
+        delimited_filename = os.path.join(self.directory, "all.csv")
+        with open(fixed_width_filename, "wb") as f:
+            f.write(data)
+        encoding_props = EncodingProperties(
+            "spec.json", fixed_width_filename, delimited_filename, "\n"
+        )
+        DelimitedFileWriter(encoding_props).convert()
+        with open(delimited_filename, "rb") as f:
+            return f.read()
+
+    def helper_read(self, filename):
+        with open(filename, "rb") as f:
+            return f.read()
+
+    def test_only_new_records_are_read(self):
+        delimited = DelimitedFileWriter(
+            self.encoding_props, instrumentation=Instrumentation()
+        )
+        self.helper_append(self.helper_records(0, 3))
+        self.assertEqual(delimited.convert_incremental().records_written, 3)
+        self.assertTrue(os.path.exists(follow_filename(self.delimited_filename)))
+
+        # A record still being written is left for the next run
+        partial = self.helper_records(5, 6)
+        appended = self.helper_records(3, 5) + partial[:40]
+        self.helper_append(appended)
+        self.assertEqual(delimited.convert_incremental().records_written, 2)
+        self.assertEqual(delimited.metrics.bytes_read, len(self.helper_records(3, 5)))
+
+        self.assertEqual(delimited.convert_incremental().records_written, 0)
+        self.helper_append(partial[40:])
+        summary = DelimitedFileWriter(self.encoding_props).convert_incremental()
+        self.assertEqual(summary.records_read, 1)
+
+        expected = self.helper_expected(self.helper_records(0, 6))
+        self.assertEqual(self.helper_read(self.delimited_filename), expected)
+
+    def test_carriage_return_at_end_is_held_back(self):
+        delimited = DelimitedFileWriter(self.encoding_props)
+        data = self.helper_records(0, 2, b"\r\n")
+        self.helper_append(data[:-1])
+        self.assertEqual(delimited.convert_incremental().records_written, 1)
+        self.helper_append(data[-1:] + self.helper_records(2, 3, b"\r\n"))
+        self.assertEqual(delimited.convert_incremental().records_written, 2)
+        expected = self.helper_expected(self.helper_records(0, 3))
+        self.assertEqual(self.helper_read(self.delimited_filename), expected)
+
+    def test_first_record_ending_in_carriage_return_is_held_back(self):
+        delimited = DelimitedFileWriter(self.encoding_props)
+        data = self.helper_records(0, 2, b"\r\n")
+        self.helper_append(data[: self.record_length + 1])
+        self.assertEqual(delimited.convert_incremental().records_written, 0)
+        self.helper_append(data[self.record_length + 1 :])
+        self.assertEqual(delimited.convert_incremental().records_written, 2)
+        self.helper_append(self.helper_records(2, 3, b"\r\n"))
+        self.assertEqual(delimited.convert_incremental().records_written, 1)
+        expected = self.helper_expected(self.helper_records(0, 3))
+        self.assertEqual(self.helper_read(self.delimited_filename), expected)
+
+    def test_rotation(self):
+        delimited = DelimitedFileWriter(self.encoding_props)
+        rotated_filename = f"{self.fixed_width_filename}.1"
+        self.helper_append(self.helper_records(0, 3))
+        delimited.convert_incremental()
+
+        # Renamed, after records the last run did not see, with an
+        # unterminated final record
+        self.helper_append(self.helper_records(3, 5)[:-1])
+        os.rename(self.fixed_width_filename, rotated_filename)
+        self.helper_append(self.helper_records(5, 7))
+        self.assertEqual(delimited.convert_incremental().records_written, 4)
+
+        # Copied and truncated in place
+        self.helper_append(self.helper_records(7, 8))
+        shutil.copyfile(self.fixed_width_filename, rotated_filename)
+        with open(self.fixed_width_filename, "wb") as f:
+            f.write(self.helper_records(8, 9))
+        self.assertEqual(delimited.convert_incremental().records_written, 2)
+
+        expected = self.helper_expected(self.helper_records(0, 9))
+        self.assertEqual(self.helper_read(self.delimited_filename), expected)
+
+    def test_changed_files_are_refused(self):
+        delimited = DelimitedFileWriter(self.encoding_props)
+        self.helper_append(self.helper_records(0, 60))
+        delimited.convert_incremental()
+
+        # Edited in place after the head used to recognise the file
+        with open(self.fixed_width_filename, "r+b") as f:
+            f.seek(50 * (self.record_length + 1))
+            f.write(b"9")
+        with self.assertRaises(CheckpointMismatch):
+            delimited.convert_incremental()
+
+        os.truncate(self.delimited_filename, 10)
+        with self.assertRaises(CheckpointMismatch):
+            delimited.convert_incremental()
+
+    def test_follow_until_idle(self):
+        summaries = []
+        self.helper_append(self.helper_records(0, 4))
+        total = DelimitedFileWriter(self.encoding_props).follow(
+            poll_interval=0.01, idle_timeout=0.05, callback=summaries.append
+        )
+        self.assertEqual(total.records_written, 4)
+        self.assertEqual([summary.records_written for summary in summaries], [4])
+
+
+class BatchConversionService(unittest.TestCase):
+    """ Tests that batches of jobs from a manifest or a watched directory are
+        converted as they would be one at a time.
+    """
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.jobs = []
+        for i in range(3):
+            job = ConversionJob(
+                "spec.json",
+                os.path.join(self.directory, f"fixed_width_{i}.txt"),
+                os.path.join(self.directory, f"delimited_{i}.csv"),
+                "\n",
+            )
+            SyntheticFixedWidthFile(EncodingProperties(*job), seed=i).write(
+                record_count=50 * (i + 1)
+            )
+            self.jobs.append(job)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def helper_write_jobs(self, filename, jobs):
+        with open(os.path.join(self.directory, filename), "w") as f:
+            for job in jobs:
+                fields = dict(zip(["spec", "input", "output", "newline"], job))
+                f.write(json.dumps(fields) + "\n")
+        return os.path.join(self.directory, filename)
+
+    def helper_check_outputs(self, jobs):
+        for job in jobs:
+            with open(job.delimited_filename, "rb") as f:
+                converted = f.read()
+            DelimitedFileWriter(EncodingProperties(*job)).convert()
+            with open(job.delimited_filename, "rb") as f:
+                self.assertEqual(converted, f.read())
+
+    def test_manifest_jobs_are_converted(self):
+        missing = ConversionJob("spec.json", "missing.txt", "missing.csv", None)
+        manifest = self.helper_write_jobs("jobs.jsonl", self.jobs + [missing])
+        self.assertEqual(list(read_manifest(manifest)), self.jobs + [missing])
+
+        results = []
+        converter = BatchConverter(workers=2, max_pending=2)
+        report = converter.run(read_manifest(manifest), results.append).as_dict()
+        self.helper_check_outputs(self.jobs)
+        self.assertEqual(report["jobs"], 4)
+        self.assertEqual(report["failed"], 1)
+        self.assertEqual(report["records"], 300)
+        self.assertEqual(
+            [result.job for result in results if result.error], [missing]
+        )
+        self.assertTrue(all(result.latency >= result.seconds for result in results))
+
+    def test_watched_directory_jobs_are_converted(self):
+        watched = os.path.join(self.directory, "incoming")
+        os.mkdir(watched)
+        self.helper_write_jobs(os.path.join("incoming", "a.json"), self.jobs[:2])
+        self.helper_write_jobs(os.path.join("incoming", "b.jsonl"), self.jobs[2:])
+        jobs = watch_directory(watched, poll_interval=0.01, idle_timeout=0.1)
+        report = BatchConverter(workers=2).run(jobs).as_dict()
+        self.helper_check_outputs(self.jobs)
+        self.assertEqual(report["jobs"], 3)
+        self.assertEqual(report["failed"], 0)
+
+    def test_spec_cache(self):
+        cache = SpecCache()
+        first, cached = cache.get(*self.jobs[0])
+        self.assertFalse(cached)
+        second, cached = cache.get(*self.jobs[1])
+        self.assertTrue(cached)
+        self.assertIs(first.layout, second.layout)
+        self.assertEqual(second.fixed_width_filename, self.jobs[1].fixed_width_filename)
+
+
+class CompressedInputOutput(unittest.TestCase):
+    """ Tests that compressed fixed width and delimited files are converted
+        as streams, with the same result as uncompressed files.
+    """
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.encoding_props = self.helper_props("fixed_width.txt", "delimited.csv")
+        SyntheticFixedWidthFile(self.encoding_props).write(record_count=500)
+        DelimitedFileWriter(self.encoding_props).convert()
+        with open(self.encoding_props.fixed_width_filename, "rb") as f:
+            self.fixed_width = f.read()
+        with open(self.encoding_props.delimited_filename, "rb") as f:
+            self.delimited = f.read()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def helper_props(self, fixed_width_filename, delimited_filename):
+        return EncodingProperties(
+            "spec.json",
+            os.path.join(self.directory, fixed_width_filename),
+            os.path.join(self.directory, delimited_filename),
+            "\n",
+        )
+
+    def test_codecs_chosen_by_extension(self):
+        for extension, module in [(".gz", gzip), (".bz2", bz2), (".xz", lzma)]:
+            encoding_props = self.helper_props(
+                "fixed_width.txt" + extension, "delimited.csv" + extension
+            )
+            with module.open(encoding_props.fixed_width_filename, "wb") as f:
+                f.write(self.fixed_width)
+
+            delimited = DelimitedFileWriter(encoding_props, compression_workers=2)
+            self.assertEqual(delimited.convert().records_written, 500)
+            with module.open(encoding_props.delimited_filename, "rb") as f:
+                self.assertEqual(f.read(), self.delimited)
+
+    def test_compression_option_overrides_extension(self):
+        encoding_props = self.helper_props("fixed_width.txt", "delimited.out")
+        encoding_props.delimited_compression = "xz"
+        DelimitedFileWriter(encoding_props).convert()
+        with lzma.open(encoding_props.delimited_filename, "rb") as f:
+            self.assertEqual(f.read(), self.delimited)
+
+        encoding_props.delimited_compression = "zip"
+        with self.assertRaises(ValueError):
+            DelimitedFileWriter(encoding_props)
+
+    def test_parallel_members(self):
+        filename = os.path.join(self.directory, "blocks.gz")
+        with compression.ParallelCompressedWriter(
+            open(filename, "wb"), "gzip", workers=3, block_size=1000
+        ) as f:
+            f.write(self.delimited)
+            self.assertGreater(f.members, 10)
+        with gzip.open(filename, "rb") as f:
+            self.assertEqual(f.read(), self.delimited)
+
+        encoding_props = self.helper_props("fixed_width.txt", "delimited.csv.gz")
+        DelimitedFileWriter(encoding_props).convert_parallel(workers=2)
+        with gzip.open(encoding_props.delimited_filename, "rb") as f:
+            self.assertEqual(f.read(), self.delimited)
+
+        encoding_props = self.helper_props("fixed_width.txt", "delimited.csv")
+        encoding_props.fixed_width_compression = "gzip"
+        with self.assertRaises(ValueError):
+            DelimitedFileWriter(encoding_props).convert_parallel(workers=2)
+
+
+class InstrumentedConversion(unittest.TestCase):
+    """ Tests that an instrumented run reports its stages and throughput
+        without changing the output, and that runs can be profiled.
+    """
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.encoding_props = EncodingProperties(
+            "spec.json",
+            os.path.join(self.directory, "fixed_width.txt"),
+            os.path.join(self.directory, "delimited.csv"),
+            "\n",
+        )
+        SyntheticFixedWidthFile(self.encoding_props).write(record_count=1000)
+        DelimitedFileWriter(self.encoding_props).convert()
+        with open(self.encoding_props.delimited_filename, "rb") as f:
+            self.delimited = f.read()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_metrics(self):
+        published = []
+        prometheus_filename = os.path.join(self.directory, "metrics.prom")
+        delimited = DelimitedFileWriter(
+            self.encoding_props,
+            instrumentation=Instrumentation(published.append, prometheus_filename),
+        )
+        delimited.convert(batch_size=100)
+        with open(self.encoding_props.delimited_filename, "rb") as f:
+            self.assertEqual(f.read(), self.delimited)
+
+        metrics = delimited.metrics
+        self.assertEqual(published, [metrics])
+        self.assertEqual(metrics.records_read, 1000)
+        fixed_width_size = os.path.getsize(self.encoding_props.fixed_width_filename)
+        self.assertEqual(metrics.bytes_read, fixed_width_size)
+        self.assertEqual(metrics.bytes_written, len(self.delimited))
+        self.assertEqual(list(metrics.seconds), STAGES)
+        self.assertLessEqual(sum(metrics.seconds.values()), metrics.run_seconds * 1.5)
+        self.assertGreater(metrics.records_per_sec, 0)
+        # Records are transcoded, and sliced and decoded, as they are written
+        self.assertIsNotNone(delimited.transcoder)
+        for stage in STAGES:
+            self.assertGreaterEqual(metrics.seconds[stage], 0, stage)
+        self.assertGreater(metrics.seconds["slice"], 0)
+        self.assertGreater(metrics.seconds["decode"], 0)
+        delimited.convert_to_column_store(os.path.join(self.directory, "store"))
+        self.assertGreater(delimited.metrics.seconds["slice"], 0)
+        self.assertGreater(delimited.metrics.seconds["decode"], 0)
+
+        with open(prometheus_filename) as f:
+            prometheus = f.read()
+        self.assertIn('delimited_writer_records{kind="read"} 1000', prometheus)
+        self.assertIn('delimited_writer_stage_seconds{stage="decode"}', prometheus)
+
+    def test_profiling_from_environment(self):
+        for kind in ["cprofile", "tracemalloc"]:
+            profile_filename = os.path.join(self.directory, kind)
+            environment = {PROFILE_VARIABLE: f"{kind}:{profile_filename}"}
+            with mock.patch.dict(os.environ, environment):
+                DelimitedFileWriter(self.encoding_props).convert()
+                DelimitedFileWriter(self.encoding_props).convert()
+            # Each run writes its own file
+            filenames = [
+                filename
+                for filename in os.listdir(self.directory)
+                if filename.startswith(f"{kind}.{os.getpid()}.")
+            ]
+            self.assertEqual(len(filenames), 2)
+        stats = pstats.Stats(
+            *(
+                os.path.join(self.directory, filename)
+                for filename in os.listdir(self.directory)
+                if filename.startswith("cprofile.")
+            )
+        )
+        self.assertTrue(
+            any(function[2] == "parse_lines" for function in stats.stats)
+        )
+
+    def test_profile_filename_placeholders(self):
+        profile = f"cprofile:{os.path.join(self.directory, '{run}-{pid}.prof')}"
+        with mock.patch.dict(os.environ, {PROFILE_VARIABLE: profile}):
+            DelimitedFileWriter(self.encoding_props).convert()
+            DelimitedFileWriter(self.encoding_props).convert()
+        filenames = sorted(
+            filename
+            for filename in os.listdir(self.directory)
+            if filename.endswith(f"-{os.getpid()}.prof")
+        )
+        self.assertEqual(len(filenames), 2)
+        first, second = (int(filename.split("-")[0]) for filename in filenames)
+        self.assertEqual(abs(second - first), 1)
+
+
+class ReverseConversion(unittest.TestCase):
+    """ Tests that delimited files are converted back into the fixed width
+        files they were generated from.
+    """
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.encoding_props = self.helper_props("fixed_width.txt", "delimited.csv")
+        SyntheticFixedWidthFile(self.encoding_props).write(
+            record_count=2000, newline=b"\r\n"
+        )
+        DelimitedFileWriter(self.encoding_props).convert()
+        with open(self.encoding_props.fixed_width_filename, "rb") as f:
+            self.fixed_width = f.read()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def helper_props(self, fixed_width_filename, delimited_filename):
+        return EncodingProperties(
+            "spec.json",
+            os.path.join(self.directory, fixed_width_filename),
+            os.path.join(self.directory, delimited_filename),
+            "\r\n",
+        )
+
+    def helper_write_delimited(self, rows):
+        with open(
+            self.encoding_props.delimited_filename, "w", encoding="utf-8", newline=""
+        ) as f:
+            csv.writer(f).writerows([self.encoding_props.column_names] + rows)
+
+    def test_round_trip(self):
+        encoding_props = self.helper_props("round_trip.txt.gz", "delimited.csv")
+        for convert in ["convert", "convert_parallel"]:
+            writer = FixedWidthFileWriter(self.encoding_props, "\r\n")
+            kwargs = {"workers": 3} if convert == "convert_parallel" else {}
+            summary = getattr(writer, convert)(batch_size=300, **kwargs)
+            self.assertEqual(summary.records_written, 2000)
+            with open(self.encoding_props.fixed_width_filename, "rb") as f:
+                self.assertEqual(f.read(), self.fixed_width)
+
+        FixedWidthFileWriter(encoding_props, "\r\n").convert_parallel(workers=2)
+        with gzip.open(encoding_props.fixed_width_filename, "rb") as f:
+            self.assertEqual(f.read(), self.fixed_width)
+
+        # Delimited files written with '\r' line breaks, with and without header
+        with open("spec.json") as f:
+            spec = json.load(f)
+        for include_header in ["True", "False"]:
+            spec["IncludeHeader"] = include_header
+            encoding_props = EncodingProperties(
+                "spec.json",
+                self.encoding_props.fixed_width_filename,
+                os.path.join(self.directory, "delimited_cr.csv"),
+                "\r",
+                spec=spec,
+            )
+            DelimitedFileWriter(encoding_props).convert()
+            with open(encoding_props.delimited_filename, "rb") as f:
+                self.assertNotIn(b"\n", f.read())
+                self.assertEqual(len(split_on_lines(f, 0, 3)), 3)
+            for convert in ["convert", "convert_parallel"]:
+                writer = FixedWidthFileWriter(encoding_props, "\r\n")
+                kwargs = {"workers": 3} if convert == "convert_parallel" else {}
+                summary = getattr(writer, convert)(batch_size=300, **kwargs)
+                self.assertEqual(summary.records_written, 2000)
+                with open(encoding_props.fixed_width_filename, "rb") as f:
+                    self.assertEqual(f.read(), self.fixed_width)
+
+    def test_invalid_fields(self):
+        row = ["a"] * 10
+        long_row = row[:8] + ["b" * 21, "c"]
+        self.helper_write_delimited([row, long_row])
+        with self.assertRaisesRegex(ValueError, "Record 2: f9 is 21 characters"):
+            FixedWidthFileWriter(self.encoding_props).convert()
+        with self.assertRaisesRegex(ValueError, "Record 2: f9 is 21 characters"):
+            FixedWidthFileWriter(self.encoding_props).convert_parallel(workers=2)
+
+        FixedWidthFileWriter(self.encoding_props, "\n", truncate=True).convert()
+        with open(self.encoding_props.fixed_width_filename, "rb") as f:
+            self.assertEqual(f.read().split(b"\n")[1][65:86], b"b" * 20 + b"c")
+
+        for rows, message in [
+            ([row[:9]], "has 9 fields"),
+            ([row[:9] + ["x\ny"]], "contains a newline"),
+            ([row[:9] + ["\u20ac\u0100"]], "cannot be encoded"),
+        ]:
+            self.helper_write_delimited(rows)
+            with self.assertRaisesRegex(ValueError, message):
+                FixedWidthFileWriter(self.encoding_props).convert()
+
+        with open(self.encoding_props.delimited_filename, "w") as f:
+            f.write("f1,f2\n")
+        with self.assertRaisesRegex(ValueError, "Header"):
+            FixedWidthFileWriter(self.encoding_props).convert()
+
+
+class ColumnStatisticsProfiling(unittest.TestCase):
+    """ Tests that the column statistics collected during a conversion match
+        those computed from the delimited file.
+    """
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.encoding_props = EncodingProperties(
+            "spec.json",
+            os.path.join(self.directory, "fixed_width.txt"),
+            os.path.join(self.directory, "delimited.csv"),
+            "\n",
+        )
+        SyntheticFixedWidthFile(self.encoding_props).write(record_count=3000)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_statistics_match_output(self):
+        columns = ["f9", "f4"]
+        delimited = DelimitedFileWriter(
+            self.encoding_props, columns=columns, column_stats=ColumnStatistics()
+        )
+        delimited.convert(batch_size=500)
+        with open(stats_filename(self.encoding_props.delimited_filename)) as f:
+            stats = json.load(f)
+        collected = delimited.column_stats.as_dict()
+        self.assertEqual(stats, json.loads(json.dumps(collected)))
+        with open(self.encoding_props.delimited_filename, encoding="utf-8") as f:
+            rows = list(csv.reader(f))[1:]
+
+        self.assertEqual(stats["records"], 3000)
+        self.assertEqual(list(stats["columns"]), columns)
+        for i, (name, width) in enumerate([("f9", 20), ("f4", 2)]):
+            values = [row[i] for row in rows]
+            lengths = [len(value) for value in values]
+            column = stats["columns"][name]
+            self.assertEqual(column["width"], width)
+            self.assertEqual(column["count"], 3000)
+            self.assertEqual(column["blank"], lengths.count(0))
+            self.assertEqual(column["min_length"], min(lengths))
+            self.assertEqual(column["max_length"], max(lengths))
+            self.assertAlmostEqual(column["average_length"], sum(lengths) / 3000)
+            self.assertAlmostEqual(column["fill_ratio"], sum(lengths) / 3000 / width)
+            non_ascii = sum(ord(char) > 127 for value in values for char in value)
+            self.assertEqual(column["non_ascii"], non_ascii)
+            distinct = len(set(values))
+            self.assertLess(abs(column["distinct"] - distinct), distinct * 0.1)
+
+    def test_hyperloglog(self):
+        sketch = HyperLogLog(precision=10)
+        for start in range(0, 200000, 10000):
+            sketch.update([f"value {i}" for i in range(start, start + 10000)])
+        self.assertEqual(len(sketch.registers), 1024)
+        self.assertLess(abs(sketch.estimate() - 200000), 200000 * 0.15)
+
+        sketch = HyperLogLog()
+        sketch.update(["a", "b", "c", "a"] * 1000)
+        self.assertEqual(sketch.estimate(), 3)
+        with self.assertRaises(ValueError):
+            HyperLogLog(precision=20)
+
+    def test_hyperloglog_is_the_same_in_every_process(self):
+        # hash() of a str is salted per process, unless PYTHONHASHSEED is set
+        code = (
+            "from delimited_writer.column_stats import HyperLogLog\n"
+            "sketch = HyperLogLog(precision=8)\n"
+            "sketch.update([f'value {i}' for i in range(20000)])\n"
+            "print(sketch.estimate())\n"
+        )
+        estimates = {
+            int(
+                subprocess.run(
+                    [sys.executable, "-c", code],
+                    cwd=os.path.dirname(os.path.abspath(__file__)),
+                    env=dict(os.environ, PYTHONHASHSEED=seed),
+                    stdout=subprocess.PIPE,
+                    check=True,
+                ).stdout
+            )
+            for seed in ["1", "2", "3"]
+        }
+        sketch = HyperLogLog(precision=8)
+        sketch.update([f"value {i}" for i in range(20000)])
+        self.assertEqual(estimates, {sketch.estimate()})
+
+    def test_unsupported_modes(self):
+        delimited = DelimitedFileWriter(
+            self.encoding_props, column_stats=ColumnStatistics()
+        )
+        with self.assertRaises(ValueError):
+            delimited.convert(checkpoint_every=100)
+        with self.assertRaises(ValueError):
+            delimited.convert_parallel()
+
+
+class ExternalSortAndDedup(unittest.TestCase):
+    """ Tests that sorted, and deduplicated, conversions spilling runs to disk
+        write the same rows as sorting the unsorted output in memory.
+    """
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.encoding_props = EncodingProperties(
+            "spec.json",
+            os.path.join(self.directory, "fixed_width.txt"),
+            os.path.join(self.directory, "delimited.csv"),
+            "\n",
+        )
+        SyntheticFixedWidthFile(self.encoding_props).write(record_count=3000)
+        DelimitedFileWriter(self.encoding_props).convert()
+        self.header, self.rows = self.helper_read()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def helper_read(self):
+        with open(self.encoding_props.delimited_filename, encoding="utf-8") as f:
+            rows = list(csv.reader(f))
+        return rows[0], rows[1:]
+
+    def helper_expected(self, columns, keep):
+        indices = [self.header.index(column) for column in columns]
+        key = lambda row: [row[i] for i in indices]
+        rows = sorted(self.rows, key=key)
+        if keep is None:
+            return rows
+        expected = []
+        for row in rows:
+            if expected and key(expected[-1]) == key(row):
+                if keep == "last":
+                    expected[-1] = row
+            else:
+                expected.append(row)
+        return expected
+
+    def test_sorted_runs_match_in_memory_sort(self):
+        cases = [(["f4"], None, 1), (["f4", "f3"], "first", 2), (["f4"], "last", 2)]
+        for keys, keep, workers in cases:
+            sort = ExternalSort(keys, keep, memory_budget=50000, workers=workers)
+            delimited = DelimitedFileWriter(self.encoding_props, sort=sort)
+            summary = delimited.convert()
+            expected = self.helper_expected(keys, keep)
+            self.assertEqual(self.helper_read(), (self.header, expected))
+            self.assertEqual(summary.records_read, 3000)
+            self.assertEqual(summary.records_written, len(expected))
+            self.assertEqual(summary.records_duplicate, 3000 - len(expected))
+        # The run files are removed
+        self.assertEqual(
+            sorted(os.listdir(self.directory)), ["delimited.csv", "fixed_width.txt"]
+        )
+
+    def test_merge_in_passes(self):
+        sort = ExternalSort(["f2"], "first", memory_budget=20000, workers=1)
+        spill = mock.Mock(wraps=external_sort.spill)
+        with mock.patch.multiple(
+            external_sort, MAX_MERGE_RUNS=3, SIZE_SAMPLE=100, spill=spill
+        ):
+            DelimitedFileWriter(self.encoding_props, sort=sort).convert()
+        # 29 runs spilled and the last kept in memory, merged in 3 passes
+        self.assertEqual(spill.call_count, 29 + 10 + 4 + 2)
+        self.assertEqual(self.helper_read()[1], self.helper_expected(["f2"], "first"))
+
+    def test_keys_must_be_written(self):
+        with self.assertRaises(ValueError):
+            DelimitedFileWriter(
+                self.encoding_props, columns=["f1"], sort=ExternalSort(["f2"])
+            )
+        with self.assertRaises(ValueError):
+            ExternalSort(["f1"], keep="middle")
+
+
+class SingleByteTranscoding(unittest.TestCase):
+    """ Tests that records of every supported single byte code page are
+        transcoded straight to UTF-8 as csv.writer would write them.
+    """
+
+    # Padded values of f1 to f3, including ones that need quoting
+    VALUES = [
+        ["ab c", "café", "x"],
+        ["a,b", 'say "hi"', ""],
+        ["ÁÉ", "", '"'],
+        ["", "", ""],
+    ]
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        with open("spec.json") as f:
+            self.spec = json.load(f)
+        self.spec.update(ColumnNames=["f1", "f2", "f3"], Offsets=["5", "10", "2"])
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def helper_props(self, encoding, delimited_newline="\n"):
+        self.spec["FixedWidthEncoding"] = encoding
+        return EncodingProperties(
+            "spec.json",
+            os.path.join(self.directory, "fixed_width.txt"),
+            os.path.join(self.directory, "delimited.csv"),
+            delimited_newline,
+            spec=self.spec,
+        )
+
+    def helper_write(self, encoding_props, lines):
+        # Written as text, so newlines are those of the code page
+        with open(
+            encoding_props.fixed_width_filename,
+            "w",
+            encoding=encoding_props.fixed_width_encoding,
+        ) as f:
+            for line in lines:
+                f.write(line + "\n")
+
+    def helper_convert(self, delimited):
+        delimited.convert(batch_size=3)
+        with open(delimited.encoding_props.delimited_filename, "rb") as f:
+            return f.read()
+
+    def test_code_pages(self):
+        lines = [
+            "".join(value.ljust(width) for value, width in zip(row, [5, 10, 2]))
+            for row in self.VALUES
+        ]
+        expected = [self.spec["ColumnNames"]] + [
+            [value.replace(" ", "") for value in row] for row in self.VALUES
+        ]
+        for encoding in ["windows-1252", "windows-1250", "latin-1", "cp037", "cp500"]:
+            encoding_props = self.helper_props(encoding, "\r\n")
+            self.assertTrue(encoding_props.layout.single_byte)
+            self.helper_write(encoding_props, lines)
+            delimited = DelimitedFileWriter(encoding_props)
+            self.assertIsNotNone(delimited.transcoder)
+            transcoded = self.helper_convert(delimited)
+            delimited.transcoder = None
+            self.assertEqual(transcoded, self.helper_convert(delimited), encoding)
+            text = io.StringIO(transcoded.decode("utf-8"), newline="")
+            self.assertEqual(list(csv.reader(text)), expected)
+
+        # cp437 has box drawing characters, and puts 'é' at another byte
+        encoding_props = self.helper_props("cp437")
+        self.helper_write(encoding_props, ["é    ╬ä        x "])
+        with open(encoding_props.fixed_width_filename, "rb") as f:
+            self.assertEqual(f.read(2), b"\x82 ")
+        transcoded = self.helper_convert(DelimitedFileWriter(encoding_props))
+        self.assertEqual(transcoded.decode("utf-8"), "f1,f2,f3\né,╬ä,x\n")
+
+    def test_projection_and_multi_byte_fallback(self):
+        encoding_props = self.helper_props("cp037")
+        self.helper_write(encoding_props, ["a    b         c "])
+        delimited = DelimitedFileWriter(encoding_props, columns=["f3", "f1"])
+        self.assertEqual(self.helper_convert(delimited), b"f3,f1\nc,a\n")
+        # A single column is left to csv.writer, which quotes an empty field
+        delimited = DelimitedFileWriter(encoding_props, columns=["f2"])
+        self.assertIsNone(delimited.transcoder)
+
+        # utf-8 is decoded as text, with lengths in characters
+        encoding_props = self.helper_props("utf-8")
+        self.assertFalse(encoding_props.layout.single_byte)
+        self.helper_write(encoding_props, ["ü    €         ß "])
+        delimited = DelimitedFileWriter(encoding_props)
+        self.assertIsNone(delimited.transcoder)
+        self.assertEqual(
+            self.helper_convert(delimited).decode("utf-8"), "f1,f2,f3\nü,€,ß\n"
+        )
+
+        with self.assertRaises(ValueError):
+            self.helper_props("shift_jis")
+
+    def test_undefined_byte_is_quarantined(self):
+        encoding_props = self.helper_props("windows-1252")
+        with open(encoding_props.fixed_width_filename, "wb") as f:
+            f.write(b"a    b         c \na\x81   b         c \nd    e         f \n")
+        reject_filename = os.path.join(self.directory, "rejects.txt")
+        delimited = DelimitedFileWriter(
+            encoding_props, quarantine=Quarantine(reject_filename)
+        )
+        self.assertEqual(self.helper_convert(delimited), b"f1,f2,f3\na,b,c\nd,e,f\n")
+        self.assertEqual(delimited.summary.records_rejected, 1)
+        with self.assertRaises(UnicodeDecodeError):
+            DelimitedFileWriter(encoding_props).convert()
+
+
+class ColumnStoreOutput(unittest.TestCase):
+    """ Tests that column stores hold the rows of the delimited file, and are
+        read back a column or a record at a time.
+    """
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.store = os.path.join(self.directory, "store")
+        self.encoding_props = EncodingProperties(
+            "spec.json",
+            os.path.join(self.directory, "fixed_width.txt"),
+            os.path.join(self.directory, "delimited.csv"),
+            "\n",
+        )
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def helper_layouts(self, directory):
+        with open(manifest_filename(directory)) as f:
+            return [column["layout"] for column in json.load(f)["columns"]]
+
+    def test_matches_delimited_file(self):
+        for charset, layout in [("ascii", "fixed"), ("cp1252", "offsets")]:
+            SyntheticFixedWidthFile(self.encoding_props, charset=charset).write(
+                record_count=3000
+            )
+            DelimitedFileWriter(self.encoding_props).convert()
+            with open(self.encoding_props.delimited_filename, encoding="utf-8") as f:
+                rows = list(csv.reader(f))[1:]
+
+            delimited = DelimitedFileWriter(self.encoding_props)
+            summary = delimited.convert_to_column_store(self.store, batch_size=700)
+            self.assertEqual(summary.records_written, 3000)
+            self.assertEqual(self.helper_layouts(self.store), [layout] * 10)
+            with ColumnStoreReader(self.store) as reader:
+                self.assertEqual(len(reader), 3000)
+                self.assertEqual([list(record) for record in reader], rows)
+                self.assertEqual(reader[-1], rows[-1])
+                self.assertEqual(reader[10:20], rows[10:20])
+                self.assertEqual(
+                    reader.column("f5", 100, 200), [row[4] for row in rows[100:200]]
+                )
+                self.assertEqual(
+                    reader.record(7, ["f5", "f1"]), [rows[7][4], rows[7][0]]
+                )
+
+            # Values parsed as str are stored the same as transcoded ones
+            other = os.path.join(self.directory, "other")
+            delimited.transcoder = None
+            delimited.convert_to_column_store(other)
+            for filename in os.listdir(self.store):
+                with open(os.path.join(self.store, filename), "rb") as f:
+                    with open(os.path.join(other, filename), "rb") as g:
+                        self.assertEqual(f.read(), g.read(), filename)
+
+    def test_column_promoted_to_offsets(self):
+        with ColumnStoreWriter(self.store, ["a", "b", "c"], [3, 3, 2]) as writer:
+            writer.writerows([("ab", "x", "y"), ("", "abc", "z")])
+            writer.writerows([("a b", "ééé", "z"), ("c", "", "q\0")])
+        self.assertEqual(
+            self.helper_layouts(self.store), ["fixed", "offsets", "offsets"]
+        )
+        self.assertEqual(
+            sorted(os.listdir(self.store)),
+            ["0.fixed", "1.data", "1.offsets", "2.data", "2.offsets", "manifest.json"],
+        )
+        with ColumnStoreReader(self.store) as reader:
+            self.assertEqual(reader.column("b"), ["x", "abc", "ééé", ""])
+            self.assertEqual(reader.column("c"), ["y", "z", "z", "q\0"])
+            self.assertEqual(reader[2], ["a b", "ééé", "z"])
+            self.assertEqual(reader.value("a", -1), "c")
+
+    def test_reads_only_columns_asked_for(self):
+        SyntheticFixedWidthFile(self.encoding_props).write(record_count=100)
+        delimited = DelimitedFileWriter(self.encoding_props, columns=["f3", "f1"])
+        delimited.convert_to_column_store(self.store)
+        with ColumnStoreReader(self.store) as reader:
+            self.assertEqual(reader.column_names, ["f3", "f1"])
+            reader.column("f1")
+            self.assertEqual(list(reader._maps), ["1.offsets", "1.data"])
+            with self.assertRaises(KeyError):
+                reader.column("f2")
+            with self.assertRaises(IndexError):
+                reader.record(100)
+
+        # A store is incomplete until its manifest is written
+        with self.assertRaises(ValueError):
+            with ColumnStoreWriter(self.store, ["f1"], [5]) as writer:
+                writer.writerows([("a",)])
+                raise ValueError("interrupted")
+        with self.assertRaises(FileNotFoundError):
+            ColumnStoreReader(self.store)
+
+
 if __name__ == "__main__":
 
     unittest.main()